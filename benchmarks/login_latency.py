@@ -0,0 +1,55 @@
+"""Measure login latency with the current password hashing settings.
+
+Run from the repository root:
+
+    python benchmarks/login_latency.py --logins 200
+"""
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "notebird"))
+
+from db import dbhelper  # noqa: E402
+from utils import security  # noqa: E402
+from utils.stats import percentile  # noqa: E402
+
+
+def run(logins: int, users: int, rounds: int = None):
+    if rounds:
+        security.set_rounds(rounds)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = dbhelper.DBHelper(str(Path(tmp) / "bench.sqlite3"))
+        db.setup()
+        accounts = [(f"user{i:05}", f"password{i}", "Bench User")
+                    for i in range(users)]
+        db.create_users(accounts)
+
+        samples = []
+        for i in range(logins):
+            user, password, _ = accounts[i % users]
+            start = time.perf_counter()
+            db.login(user, password)
+            samples.append((time.perf_counter() - start) * 1000)
+        db.conn.close()
+
+    settings = security.pwd_context.to_dict()
+    print(f"rounds: {settings['pbkdf2_sha256__default_rounds']}")
+    print(f"logins: {logins}")
+    print(f"  mean: {statistics.mean(samples):8.2f} ms")
+    print(f"   p50: {percentile(samples, 50):8.2f} ms")
+    print(f"   p99: {percentile(samples, 99):8.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--logins", type=int, default=100)
+    parser.add_argument("-u", "--users", type=int, default=10)
+    parser.add_argument("-r", "--rounds", type=int, default=None,
+                        help="override the configured rounds")
+    args = parser.parse_args()
+    run(args.logins, args.users, args.rounds)
@@ -0,0 +1,119 @@
+"""Load generator for the headless note service (`notebird serve`).
+
+Starts the service on a temporary database, unless `--port` or `--socket`
+point to one already running, and opens many concurrent clients that log
+in and issue a mix of note requests. Run from the repository root:
+
+    python benchmarks/server_load.py --clients 200 --requests 50
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "notebird"))
+
+from db import dbhelper, server  # noqa: E402
+from utils.stats import percentile  # noqa: E402
+
+MIX = ["add"] * 3 + ["get"] * 4 + ["update"] * 2 + ["search"]
+
+
+async def client(number: int, args, latencies: list, errors: list):
+    if args.socket:
+        reader, writer = await asyncio.open_unix_connection(args.socket)
+    else:
+        reader, writer = await asyncio.open_connection("127.0.0.1", args.port)
+
+    async def request(**fields):
+        start = time.perf_counter()
+        writer.write(json.dumps(fields).encode() + b"\n")
+        response = json.loads(await reader.readline())
+        latencies.append((fields["op"], time.perf_counter() - start))
+        if not response["ok"]:
+            errors.append(response["error"])
+        return response.get("result")
+
+    user = number % args.users
+    await request(op="login", username=f"user{user:05}",
+                  password=f"password{user}")
+    note_ids = [await request(op="add", content=f"Note of client {number}")]
+
+    for i in range(args.requests):
+        op = random.choice(MIX)
+        if op == "add":
+            note_ids.append(await request(
+                op="add", content=f"Note {i} of client {number} #bench"))
+        elif op == "get":
+            await request(op="get", note_id=random.choice(note_ids))
+        elif op == "update":
+            await request(op="update", note_id=random.choice(note_ids),
+                          content=f"Updated {i} by client {number}")
+        else:
+            await request(op="search", text=f"client {number}")
+
+    writer.close()
+
+
+async def run_clients(args):
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(number, args, latencies, errors)
+                           for number in range(args.clients)))
+    elapsed = time.perf_counter() - start
+
+    print(f"clients: {args.clients}, requests: {len(latencies)}, "
+          f"errors: {len(errors)}")
+    print(f"throughput: {len(latencies) / elapsed:.0f} requests/s")
+    for op in ["login", "add", "get", "update", "search"]:
+        samples = [lat * 1000 for name, lat in latencies if name == op]
+        if samples:
+            print(f"{op:>8}: p50 {percentile(samples, 50):7.2f} ms, "
+                  f"p99 {percentile(samples, 99):7.2f} ms")
+
+
+def main(args):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    if args.port or args.socket:
+        args.port = args.port or 8765
+        loop.run_until_complete(run_clients(args))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        name = str(Path(tmp) / "bench.sqlite3")
+        db = dbhelper.DBHelper(name)
+        db.setup()
+        db.create_users((f"user{i:05}", f"password{i}", "Bench User")
+                        for i in range(args.users))
+        db.close()
+
+        args.socket = str(Path(tmp) / "notebird.sock")
+        service = server.NoteService(name, args.workers, args.max_requests)
+        listener = loop.run_until_complete(
+            service.start(path=args.socket))
+        loop.run_until_complete(run_clients(args))
+        listener.close()
+        loop.run_until_complete(listener.wait_closed())
+        service.close()
+    loop.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-c", "--clients", type=int, default=100)
+    parser.add_argument("-n", "--requests", type=int, default=20,
+                        help="requests per client after logging in")
+    parser.add_argument("-u", "--users", type=int, default=10)
+    parser.add_argument("-w", "--workers", type=int, default=4)
+    parser.add_argument("-m", "--max-requests", type=int, default=64)
+    parser.add_argument("-p", "--port", type=int, default=None,
+                        help="use a service already listening on this port")
+    parser.add_argument("-s", "--socket", default=None,
+                        help="use a service already listening on this socket")
+    main(parser.parse_args())
@@ -0,0 +1,79 @@
+"""Measure note write throughput of many users for several shard counts.
+
+Every writer thread has its own connection and user, and commits one
+note at a time. Run from the repository root:
+
+    python benchmarks/shard_writes.py --writers 8 --shards 0 1 2 4 8
+"""
+import sys
+import time
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "notebird"))
+
+from db import dbhelper, storage  # noqa: E402
+from utils import exceptions  # noqa: E402
+
+
+def writer(name: str, shards: int, user_id: int, notes: int,
+           barrier: threading.Barrier, errors: list):
+    db = dbhelper.DBHelper(name, busy_timeout=30,
+                           storage=storage.make_backend(shards))
+    barrier.wait()
+    for i in range(notes):
+        try:
+            db.add_item(user_id, f"Note {i} of user {user_id}")
+        except exceptions.DatabaseError as e:
+            errors.append(e.message)
+    db.close()
+
+
+def run(shards: int, writers: int, notes: int) -> float:
+    """Return the notes written per second."""
+    with tempfile.TemporaryDirectory() as tmp:
+        name = str(Path(tmp) / "bench.sqlite3")
+        db = dbhelper.DBHelper(name, storage=storage.make_backend(shards))
+        db.setup()
+        # Cheap passwords, hashing is not measured here
+        for i in range(writers):
+            db.conn.execute("INSERT INTO users (username, password, name, "
+                            "avatar_id) VALUES (?, '', ?, 0)",
+                            (f"user{i:05}", "Bench User"))
+        db.conn.commit()
+        db.close()
+
+        barrier = threading.Barrier(writers + 1)
+        errors = []
+        threads = [threading.Thread(target=writer,
+                                    args=(name, shards, user_id, notes,
+                                          barrier, errors))
+                   for user_id in range(1, writers + 1)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+    if errors:
+        print(f"  {len(errors)} writes failed: {errors[0]}")
+    return (writers * notes - len(errors)) / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-w", "--writers", type=int, default=8)
+    parser.add_argument("-n", "--notes", type=int, default=100,
+                        help="notes written by each writer")
+    parser.add_argument("-s", "--shards", type=int, nargs="+",
+                        default=[0, 1, 2, 4, 8],
+                        help="shard counts to compare (0 = single file)")
+    args = parser.parse_args()
+
+    print(f"{'shards':>6} {'notes/s':>10}")
+    for shards in args.shards:
+        print(f"{shards:>6} {run(shards, args.writers, args.notes):>10.0f}")
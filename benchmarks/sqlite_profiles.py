@@ -0,0 +1,47 @@
+"""Compare latency and throughput of the SQLite profiles on our workload.
+
+Runs the load test (logins, note writes and reads from concurrent
+sessions) once per profile on a fresh temporary database. Run from the
+repository root:
+
+    python benchmarks/sqlite_profiles.py --workers 8 --operations 200
+"""
+import sys
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "notebird"))
+
+from db import loadtest, profiles  # noqa: E402
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-w", "--workers", type=int, default=8)
+    parser.add_argument("-n", "--operations", type=int, default=200,
+                        help="operations run by each session")
+    parser.add_argument("--mix", type=loadtest.parse_mix,
+                        default=loadtest.DEFAULT_MIX,
+                        help="weights of the operations, e.g. "
+                             "login=0,add=3,update=3,read=2,delete=1")
+    parser.add_argument("--processes", action="store_true",
+                        help="run sessions in processes, not threads")
+    parser.add_argument("-p", "--profiles", nargs="+",
+                        choices=list(profiles.PROFILES),
+                        default=[name for name in profiles.PROFILES
+                                 if name != profiles.DEFAULT_PROFILE])
+    args = parser.parse_args()
+
+    # Write latencies tell the profiles apart, reads barely change
+    print(f"{'profile':>9} {'ops/s':>8} {'add p50':>8} {'add p99':>8} "
+          f"{'read p50':>9} {'read p99':>9} {'locked':>7}")
+    for profile in args.profiles:
+        result = loadtest.run_load_test(
+            workers=args.workers, operations=args.operations, mix=args.mix,
+            processes=args.processes, profile=profile)
+        add = result["operations"].get("add", {})
+        read = result["operations"].get("read", {})
+        print(f"{profile:>9} {result['throughput_ops']:>8.0f} "
+              f"{add.get('p50_ms', 0):>8.2f} {add.get('p99_ms', 0):>8.2f} "
+              f"{read.get('p50_ms', 0):>9.2f} {read.get('p99_ms', 0):>9.2f} "
+              f"{result['locked_total']:>7}")
@@ -0,0 +1,95 @@
+"""Incremental I/O of BLOB columns, a chunk at a time.
+
+`Connection.blobopen` (Python 3.11+) reads and writes BLOBs in place,
+without building a copy of the whole value for each statement. Older
+versions fall back to plain statements."""
+import io
+import sqlite3
+from typing import Any, BinaryIO, Optional
+
+# Bytes read or written at once
+BLOB_CHUNK = 64 * 1024
+HAS_BLOBOPEN = hasattr(sqlite3.Connection, "blobopen")
+
+
+def write_blob(conn: sqlite3.Connection, table: str, column: str,
+               rowid: int, data: bytes):
+    """Write `data` into a BLOB created as `zeroblob(len(data))`."""
+    if not HAS_BLOBOPEN:
+        conn.execute(f"UPDATE {table} SET {column}=? WHERE rowid=?",
+                     (data, rowid))
+        return
+
+    view = memoryview(data)
+    with conn.blobopen(table, column, rowid) as blob:
+        for offset in range(0, len(view), BLOB_CHUNK):
+            blob.write(view[offset:offset+BLOB_CHUNK])
+
+
+def copy_to_blob(conn: sqlite3.Connection, table: str, column: str,
+                 rowid: int, source: BinaryIO, size: int, digest: Any = None):
+    """Stream `size` bytes of `source` into a BLOB created as
+    `zeroblob(size)`, feeding them to the `hashlib` object `digest`."""
+    if not HAS_BLOBOPEN:
+        data = source.read(size)
+        if len(data) < size:
+            raise EOFError(f"{size - len(data)} bytes missing for the BLOB")
+        if digest:
+            digest.update(data)
+        write_blob(conn, table, column, rowid, data)
+        return
+
+    with conn.blobopen(table, column, rowid) as blob:
+        while size > 0:
+            chunk = source.read(min(BLOB_CHUNK, size))
+            if not chunk:
+                raise EOFError(f"{size} bytes missing for the BLOB")
+            if digest:
+                digest.update(chunk)
+            blob.write(chunk)
+            size -= len(chunk)
+
+
+def read_blob(conn: sqlite3.Connection, table: str, column: str,
+              rowid: int) -> Optional[bytes]:
+    """Return the whole BLOB, or `None` if there is no such row."""
+    if not HAS_BLOBOPEN:
+        row = conn.execute(f"SELECT {column} FROM {table} WHERE rowid=?",
+                           (rowid,)).fetchone()
+        return row[0] if row else None
+
+    try:
+        blob = conn.blobopen(table, column, rowid, readonly=True)
+    except sqlite3.OperationalError as e:
+        if "no such rowid" in str(e):
+            return None
+        raise
+    with blob:
+        return blob.read()
+
+
+def open_blob(conn: sqlite3.Connection, table: str, column: str,
+              rowid: int) -> BinaryIO:
+    """Return a read-only file object over the BLOB, which reads from the
+    database only the parts asked for."""
+    if not HAS_BLOBOPEN:
+        return io.BytesIO(read_blob(conn, table, column, rowid) or b"")
+    return conn.blobopen(table, column, rowid, readonly=True)
+
+
+def copy_from_blob(conn: sqlite3.Connection, table: str, column: str,
+                   rowid: int, target: BinaryIO) -> int:
+    """Stream a BLOB into `target`, returning the number of bytes."""
+    if not HAS_BLOBOPEN:
+        data = read_blob(conn, table, column, rowid) or b""
+        target.write(data)
+        return len(data)
+
+    size = 0
+    with conn.blobopen(table, column, rowid, readonly=True) as blob:
+        while True:
+            chunk = blob.read(BLOB_CHUNK)
+            if not chunk:
+                return size
+            target.write(chunk)
+            size += len(chunk)
@@ -6,40 +6,251 @@
 # | username      |   \--<| user_id (FK) |
 # | password      |       | content      |
 # | name          |       | creation     |
-# | avatar_id     |       | last_update  |
-# |===============|       |==============|
+# | avatar_id     |>--\   | last_update  |
+# |===============|   |   |==============|
+#                     |          |
+# |===============|   |          |        |=================|
+# | avatars       |   |          +-------<| attachments     |
+# |===============|   |          |        |=================|
+# | avatar_id (PK)|--/           |        | attachment_id   |
+# | hash          |              |        | note_id (FK)    |
+# | image         |              |        | name            |
+# | thumbnail     |              |        | size            |
+# |===============|              |        | hash            |
+#                                |        | data            |
+#                                |        |=================|
+#                                |
+#          |============|        |        |=============|
+#          | note_tags  |>-------+-------<| note_links  |
+#          |============|                 |=============|
+#          | note_id    |                 | note_id     |
+#          | tag        |                 | url         |
+#          |============|                 | domain      |
+#                                         |=============|
+# `library` may live in other database files, see `db.storage`. The
+# content of archived notes lives in `archived_notes` of a cold database
+# next to each of them, see `DBHelper.archive_items`.
+import os
 import time
+import uuid
+import logging
+import hashlib
 import sqlite3
-from typing import Optional, Tuple, List, NewType
+from pathlib import Path
+from urllib.request import pathname2url
+from concurrent.futures import ProcessPoolExecutor
+from typing import (Optional, Tuple, List, Set, Iterable, NewType, Dict,
+                    BinaryIO, Callable)
 
+from db import profiles, storage as backends
+from db.blobs import (write_blob, read_blob, open_blob, copy_to_blob,
+                      copy_from_blob)
 from utils import exceptions
-from utils.security import encrypt_password, check_encrypted_password
+from utils.extraction import (extract_tags, extract_links, link_domain,
+                              normalize_domain, content_hash, note_title,
+                              note_preview)
+from utils.security import encrypt_password, check_and_update_password
 from utils.validations import validate_username, validate_pwd, validate_name
 
+logger = logging.getLogger(__name__)
+
 Timestamp = NewType("Timestamp", float)
+NewUser = Tuple[str, str, str]
 UserInfo = NewType("UserInfo",
                    Tuple[str, str, int, int, str, Timestamp, Timestamp])
+Note = NewType("Note", Tuple[int, str, Timestamp, Timestamp])
+# username, name, avatar_id, number of notes and last update of any
+UserSummary = Tuple[str, str, int, int, Optional[Timestamp]]
+# note_id, title, creation, last_update and the start of the text
+NotePreview = NewType("NotePreview",
+                      Tuple[int, str, Timestamp, Timestamp, str])
+NoteChange = NewType("NoteChange",
+                     Tuple[int, int, bool, str, Timestamp, Timestamp])
+Period = Tuple[Optional[Timestamp], Optional[Timestamp]]
+# Avatar and its thumbnail, encoded
+AvatarImages = Tuple[bytes, bytes]
+# attachment_id, note_id, name, size, hash
+Attachment = Tuple[int, int, str, int, str]
+Cursor = Tuple[float, int]
+
+# Name of a database living only in memory, lost when closed
+MEMORY = ":memory:"
+
+# What to do with imported notes whose content the user already has:
+# skip them, merge their dates into the existing note, or add them anyway
+IMPORT_MODES = ("skip", "merge", "all")
+# content, creation and last update of an imported note, dates may be
+# `None` (now)
+ImportedNote = Tuple[str, Optional[Timestamp], Optional[Timestamp]]
+# user_id, content_hash, number of notes, their ids
+Duplicates = Tuple[int, str, int, List[int]]
+# seq, guid, deleted, time of the change and, unless deleted, username,
+# password, name and avatar_id
+UserChange = Tuple[int, str, bool, Timestamp, Optional[str], Optional[str],
+                   Optional[str], Optional[int]]
+# seq, guid, deleted, time of the change and, unless deleted, user_id,
+# content, creation and last update
+NoteSync = Tuple[int, str, bool, Timestamp, Optional[int], Optional[str],
+                 Optional[Timestamp], Optional[Timestamp]]
+# guid, content, creation and last update of a note from another database
+SyncedNote = Tuple[str, str, Timestamp, Timestamp]
+
+# Notes read or written by a single statement of the bulk operations
+BULK_CHUNK = 500
+
+# Columns notes can be sorted by, and their position in `Note`
+ORDER_COLUMNS = {"note_id": 0, "creation": 2, "last_update": 3}
+
+# Current UNIX Epoch time, in SQL
+SQL_NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+# New random id of a row, the same in every copy of the database
+SQL_GUID = "lower(hex(randomblob(16)))"
+
+# Content of a note, read from the cold database if archived
+TIERED_CONTENT = """CASE WHEN library.archived
+                         THEN (SELECT cold_note.content
+                               FROM cold.archived_notes AS cold_note
+                               WHERE cold_note.note_id = library.note_id)
+                         ELSE library.content END"""
+
+
+def cold_name(name: str) -> str:
+    """Return the name of the cold database of the given library file,
+    `database.cold.sqlite3` for `database.sqlite3`."""
+    path = Path(name)
+    return str(path.with_name(f"{path.stem}.cold{path.suffix}"))
+
+
+def note_cursor(note: Note, order_by: str = "note_id") -> Cursor:
+    """Return the cursor to query the notes (or their previews) after the
+    given one."""
+    return note[ORDER_COLUMNS[order_by.lstrip("-")]], note[0]
+
+
+def note_guid(username: str, note_id: int, creation: Timestamp) -> str:
+    """Return the `guid` of a note written before notes had one, the same
+    in every copy of the database it was written in."""
+    key = f"{username}:{note_id}:{creation!r}".encode("utf-8")
+    return hashlib.sha256(key).hexdigest()[:32]
+
+
+def derived_columns(content: str) -> Tuple[str, str, str]:
+    """Return `content_hash`, `title` and `plain_preview` of a note."""
+    return content_hash(content), note_title(content), note_preview(content)
+
+
+def page_clauses(user_id: int, order_by: str,
+                 created_between: Optional[Period],
+                 updated_between: Optional[Period],
+                 after: Optional[Cursor]) -> Tuple[str, str, list]:
+    """Return the conditions, the order and their parameters to query a
+    page of the user's notes, see `DBHelper.query_items`."""
+    descending = order_by.startswith("-")
+    column = order_by.lstrip("-")
+    if column not in ORDER_COLUMNS:
+        raise ValueError(f"cannot sort notes by `{order_by}`")
+
+    conditions = ["user_id=?"]
+    params = [user_id]
+    for date, period in (("creation", created_between),
+                         ("last_update", updated_between)):
+        start, end = period or (None, None)
+        if start is not None:
+            conditions.append(f"{date}>=?")
+            params.append(start)
+        if end is not None:
+            conditions.append(f"{date}<?")
+            params.append(end)
+
+    # Keyset pagination, seeking in the index instead of skipping rows
+    direction, operator = ("DESC", "<") if descending else ("ASC", ">")
+    if after is not None:
+        if column == "note_id":
+            conditions.append(f"note_id {operator} ?")
+            params.append(after[1])
+        else:
+            conditions.append(f"({column}, note_id) {operator} (?, ?)")
+            params.extend(after)
+
+    order = f"note_id {direction}"
+    if column != "note_id":
+        order = f"{column} {direction}, " + order
+    return " AND ".join(conditions), order, params
 
 
 class DBHelper:
-    """Connect to the given SQLite database."""
+    """Connect to the given SQLite database.
+
+    Notes are stored according to `storage`, in the same database by
+    default. Every connection is tuned as the named `profile` says, see
+    `db.profiles`. Sessions keep at most `content_budget` bytes of note
+    contents in memory, all of them if `None`.
+
+    With `MEMORY` as name the database only lives in memory, a single
+    file that can be seeded from and saved to disk as a snapshot."""
 
-    def __init__(self, name: str):
+    def __init__(self, name: str, busy_timeout: float = 5.0,
+                 check_same_thread: bool = True,
+                 storage: Optional[backends.StorageBackend] = None,
+                 profile: str = profiles.DEFAULT_PROFILE,
+                 content_budget: Optional[int] = None):
         self.name = name
+        self.profile = profiles.get_profile(profile)
         self.current_user = None
+        self.content_budget = content_budget
+        self.busy_timeout = busy_timeout
+        self.check_same_thread = check_same_thread
+        # Library connections with their cold database attached
+        self.cold_tiers = set()
+
+        if name == MEMORY and storage and not storage.shared:
+            raise ValueError("in-memory databases cannot be sharded")
+
+        self.conn = self.connect(name)
+        self.storage = storage or backends.SingleFileBackend()
+        self.storage.open(self)
+
+    # =====  Database methods  ============================================
+    def connect(self, name: str) -> sqlite3.Connection:
+        """Open a connection to the given database file."""
 
         try:
-            self.conn = sqlite3.connect(name)
+            # `timeout` sets SQLite's busy_timeout: how long to wait for
+            # a lock held by another connection before giving up
+            conn = sqlite3.connect(
+                name, timeout=self.busy_timeout,
+                check_same_thread=self.check_same_thread)
 
-        except sqlite3.OperationalError:
+        except sqlite3.OperationalError as e:
             error_message = f"Cannot connect to {name}."
-            raise exceptions.DatabaseError(error_message)
+            raise exceptions.DatabaseError(error_message, e)
 
         else:
             # Function creation routine (name, num_params, function)
-            self.conn.create_function("hash", 1, encrypt_password)
+            conn.create_function("hash", 1, encrypt_password)
+
+            # SQLite ignores `ON DELETE` clauses unless this is enabled
+            conn.execute("PRAGMA foreign_keys = ON")
+
+            # Journal, syncs and caches, as the profile says
+            try:
+                profiles.apply_profile(conn, self.profile)
+            except sqlite3.OperationalError as e:
+                conn.close()
+                error_message = f"Cannot tune the connection to {name}."
+                raise exceptions.DatabaseError(error_message, e)
+            return conn
+
+    def close(self):
+        """Close the connection with the database."""
+
+        self.storage.close()
+        try:
+            self.conn.close()
+        except sqlite3.Error as e:
+            error_message = f"Cannot close connection with {self.name}."
+            raise exceptions.DatabaseError(error_message, e)
 
-    # =====  Database methods  ============================================
     def setup(self):
         """Create structure of the database for the first time."""
 
@@ -53,36 +264,611 @@ class DBHelper:
             )"""
         try:
             self.conn.execute(stmt_table)
-        except sqlite3.OperationalError:
+        except sqlite3.OperationalError as e:
             error_message = "Cannot create table `users`."
-            raise exceptions.DatabaseError(error_message)
+            raise exceptions.DatabaseError(error_message, e)
+
+        self.setup_user_changes()
+
+        # Images are deduplicated by the hash of their content. Users
+        # with `avatar_id` 0 have the default avatar, which is not stored
+        stmt_table = """
+            CREATE TABLE IF NOT EXISTS avatars (
+                avatar_id   INTEGER PRIMARY KEY AUTOINCREMENT,
+                hash        TEXT    NOT NULL    UNIQUE,
+                image       BLOB    NOT NULL,
+                thumbnail   BLOB    NOT NULL
+            )"""
+        try:
+            self.conn.execute(stmt_table)
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot create table `avatars`."
+            raise exceptions.DatabaseError(error_message, e)
 
-        # Store dates as floats (UNIX Epoch time)
         stmt_table = """
+            CREATE TABLE IF NOT EXISTS storage (
+                key         TEXT    PRIMARY KEY,
+                value
+            )"""
+        try:
+            self.conn.execute(stmt_table)
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot create table `storage`."
+            raise exceptions.DatabaseError(error_message, e)
+
+        self.storage.setup()
+        for conn in self.storage.connections():
+            self.setup_library(conn)
+            self.cold_tier(conn)
+
+    def setup_user_changes(self):
+        """Give every user a `guid` and the time of its last change
+        (`updated`), and log changes to users, for `db.sync`.
+
+        Both are stamped by triggers unless the statement sets them, so
+        synced users keep the values of the other database."""
+
+        try:
+            columns = {row[1] for row in
+                       self.conn.execute("PRAGMA table_info(users)")}
+            for column, kind in (("guid", "TEXT"), ("updated", "REAL")):
+                if column not in columns:
+                    self.conn.execute(
+                        f"ALTER TABLE users ADD COLUMN {column} {kind}")
+            self.conn.execute(f"""UPDATE users SET guid={SQL_GUID}
+                                               WHERE guid IS NULL""")
+        except sqlite3.OperationalError as e:
+            self.conn.rollback()
+            error_message = "Cannot add columns to table `users`."
+            raise exceptions.DatabaseError(error_message, e)
+
+        # `guid` and `changed` of deleted users only
+        stmts_changes = ["""
+            CREATE UNIQUE INDEX IF NOT EXISTS users_guid_index
+                   ON users (guid)""", """
+            CREATE TABLE IF NOT EXISTS users_changes (
+                seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id     INTEGER NOT NULL    UNIQUE,
+                deleted     INTEGER NOT NULL,
+                guid        TEXT,
+                changed     REAL
+            )""", f"""
+            CREATE TRIGGER IF NOT EXISTS users_insert_stamp
+                   AFTER INSERT ON users
+                   WHEN NEW.guid IS NULL OR NEW.updated IS NULL
+            BEGIN
+                UPDATE users SET guid=coalesce(NEW.guid, {SQL_GUID}),
+                                 updated=coalesce(NEW.updated, {SQL_NOW})
+                             WHERE user_id = NEW.user_id;
+            END""", f"""
+            CREATE TRIGGER IF NOT EXISTS users_update_stamp
+                   AFTER UPDATE OF username, password, name, avatar_id
+                   ON users
+                   WHEN NEW.updated IS OLD.updated
+            BEGIN
+                UPDATE users SET updated={SQL_NOW}
+                             WHERE user_id = NEW.user_id;
+            END""", """
+            CREATE TRIGGER IF NOT EXISTS users_insert_log
+                   AFTER INSERT ON users
+            BEGIN
+                DELETE FROM users_changes WHERE user_id = NEW.user_id;
+                INSERT INTO users_changes (user_id, deleted)
+                       VALUES (NEW.user_id, 0);
+            END""", """
+            CREATE TRIGGER IF NOT EXISTS users_update_log
+                   AFTER UPDATE ON users
+            BEGIN
+                DELETE FROM users_changes WHERE user_id = NEW.user_id;
+                INSERT INTO users_changes (user_id, deleted)
+                       VALUES (NEW.user_id, 0);
+            END""", f"""
+            CREATE TRIGGER IF NOT EXISTS users_delete_log
+                   AFTER DELETE ON users
+            BEGIN
+                DELETE FROM users_changes WHERE user_id = OLD.user_id;
+                INSERT INTO users_changes (user_id, deleted, guid, changed)
+                       VALUES (OLD.user_id, 1, OLD.guid, {SQL_NOW});
+            END"""]
+        try:
+            logged = self.conn.execute("""SELECT 1 FROM sqlite_master
+                                     WHERE name='users_changes'""").fetchone()
+            for stmt in stmts_changes:
+                self.conn.execute(stmt)
+
+            # Users created before the log existed
+            if not logged:
+                self.conn.execute("""INSERT INTO users_changes
+                                            (user_id, deleted)
+                                     SELECT user_id, 0 FROM users""")
+        except sqlite3.OperationalError as e:
+            self.conn.rollback()
+            error_message = "Cannot create table `users_changes`."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            self.conn.commit()
+
+    def setup_library(self, conn: sqlite3.Connection):
+        """Create the tables for notes in the given database."""
+
+        # Foreign keys can't point to tables of other databases
+        foreign_key = ""
+        if self.storage.shared:
+            foreign_key = """,
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+                                      ON UPDATE CASCADE
+                                      ON DELETE SET NULL"""
+
+        # Store dates as floats (UNIX Epoch time)
+        stmt_table = f"""
             CREATE TABLE IF NOT EXISTS library (
                 note_id     INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id     INTEGER,
+                guid        TEXT,
+                archived    INTEGER NOT NULL    DEFAULT 0,
+                title       TEXT,
+                plain_preview TEXT,
                 content     TEXT    NOT NULL,
                 creation    REAL    NOT NULL,
                 last_update REAL    NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-                                      ON UPDATE CASCADE
-                                      ON DELETE SET NULL
+                content_hash TEXT{foreign_key}
             )"""
         try:
-            self.conn.execute(stmt_table)
-        except sqlite3.OperationalError:
+            conn.execute(stmt_table)
+        except sqlite3.OperationalError as e:
             error_message = "Cannot create table `library`."
-            raise exceptions.DatabaseError(error_message)
+            raise exceptions.DatabaseError(error_message, e)
 
-        stmt_index = """CREATE INDEX IF NOT EXISTS owner_index
-                               ON library (user_id ASC)"""
+        # Columns derived from `content`, missing in older databases. They
+        # are filled by `fill_derived_columns`, run in batches by
+        # `maintenance.fill_derived_columns`
         try:
-            self.conn.execute(stmt_index)
-        except sqlite3.OperationalError:
+            columns = {row[1] for row in
+                       conn.execute("PRAGMA table_info(library)")}
+            # Notes written before they had a `guid`, logged below
+            unlogged = "guid" not in columns
+            for column in ("content_hash", "title", "plain_preview"):
+                if column not in columns:
+                    conn.execute(
+                        f"ALTER TABLE library ADD COLUMN {column} TEXT")
+            if "archived" not in columns:
+                conn.execute("""ALTER TABLE library ADD COLUMN
+                                archived INTEGER NOT NULL DEFAULT 0""")
+            if unlogged:
+                # Copies of a database made before the upgrade give their
+                # notes the same `guid`, so a sync matches them
+                conn.execute("ALTER TABLE library ADD COLUMN guid TEXT")
+                usernames = dict(self.conn.execute(
+                    "SELECT user_id, username FROM users"))
+                conn.executemany(
+                    "UPDATE library SET guid=? WHERE note_id=?",
+                    [(note_guid(usernames.get(user_id, ""), note_id,
+                                creation), note_id)
+                     for note_id, user_id, creation in conn.execute(
+                         "SELECT note_id, user_id, creation FROM library")])
+            if not {"content_hash", "archived"} <= columns:
+                # Recreated below, without firing for derived columns
+                # nor archiving
+                conn.execute("DROP TRIGGER IF EXISTS library_update_log")
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            error_message = "Cannot add columns to table `library`."
+            raise exceptions.DatabaseError(error_message, e)
+
+        # Entries of an index end with the rowid (`note_id`), so sorting
+        # by date with ties broken by `note_id` reads a single index
+        stmts_index = ["""CREATE INDEX IF NOT EXISTS owner_index
+                                 ON library (user_id ASC)""",
+                       """CREATE INDEX IF NOT EXISTS creation_index
+                                 ON library (user_id, creation)""",
+                       """CREATE INDEX IF NOT EXISTS update_index
+                                 ON library (user_id, last_update)""",
+                       """CREATE INDEX IF NOT EXISTS hash_index
+                                 ON library (user_id, content_hash)""",
+                       # Notes whose derived columns are not filled yet
+                       """CREATE INDEX IF NOT EXISTS unfilled_index
+                                 ON library (note_id) WHERE title IS NULL""",
+                       # Notes not archived, oldest update first
+                       """CREATE INDEX IF NOT EXISTS hot_index
+                                 ON library (last_update)
+                                 WHERE archived = 0""",
+                       """CREATE UNIQUE INDEX IF NOT EXISTS guid_index
+                                 ON library (guid)""",
+                       # Notes keep the `guid` they are synced with
+                       f"""CREATE TRIGGER IF NOT EXISTS library_guid
+                                  AFTER INSERT ON library
+                                  WHEN NEW.guid IS NULL
+                           BEGIN
+                               UPDATE library SET guid={SQL_GUID}
+                                              WHERE note_id = NEW.note_id;
+                           END"""]
+        try:
+            for stmt in stmts_index:
+                conn.execute(stmt)
+        except sqlite3.OperationalError as e:
             error_message = "Cannot create index for table `library`."
+            raise exceptions.DatabaseError(error_message, e)
+
+        # Feed of changed notes, one row per note, so other instances
+        # using the same file can pull only what changed since `seq`.
+        # Archiving a note changes nothing readers can see. Deleted notes
+        # keep their `guid` and the time of the deletion, for `db.sync`,
+        # until pruned. Notes left by a deleted user are gone for them.
+        # No `INSERT OR REPLACE`: foreign key actions (`ON DELETE SET NULL`)
+        # would override its conflict resolution and abort the deletion
+        stmts_changes = ["""
+            CREATE TABLE IF NOT EXISTS library_changes (
+                seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id     INTEGER,
+                note_id     INTEGER NOT NULL    UNIQUE,
+                deleted     INTEGER NOT NULL,
+                guid        TEXT,
+                changed     REAL
+            )""", """
+            CREATE INDEX IF NOT EXISTS changes_index
+                   ON library_changes (user_id, seq)""", """
+            CREATE INDEX IF NOT EXISTS tombstones_index
+                   ON library_changes (guid) WHERE deleted = 1""", """
+            CREATE TRIGGER IF NOT EXISTS library_insert_log
+                   AFTER INSERT ON library
+            BEGIN
+                DELETE FROM library_changes WHERE note_id = NEW.note_id;
+                INSERT INTO library_changes (user_id, note_id, deleted)
+                       VALUES (NEW.user_id, NEW.note_id, 0);
+            END""", f"""
+            CREATE TRIGGER IF NOT EXISTS library_update_log
+                   AFTER UPDATE OF user_id, content, creation, last_update
+                   ON library
+                   WHEN NOT (NEW.archived AND NOT OLD.archived)
+            BEGIN
+                DELETE FROM library_changes WHERE note_id = NEW.note_id;
+                INSERT INTO library_changes (user_id, note_id, deleted,
+                                             changed)
+                       VALUES (IFNULL(NEW.user_id, OLD.user_id),
+                               NEW.note_id, NEW.user_id IS NULL,
+                               CASE WHEN NEW.user_id IS NULL
+                                    THEN {SQL_NOW} END);
+            END""", f"""
+            CREATE TRIGGER IF NOT EXISTS library_delete_log
+                   AFTER DELETE ON library
+            BEGIN
+                DELETE FROM library_changes WHERE note_id = OLD.note_id;
+                INSERT INTO library_changes (user_id, note_id, deleted,
+                                             guid, changed)
+                       VALUES (OLD.user_id, OLD.note_id, 1, OLD.guid,
+                               {SQL_NOW});
+            END"""]
+        try:
+            columns = {row[1] for row in conn.execute(
+                "PRAGMA table_info(library_changes)")}
+            if columns and "guid" not in columns:
+                for column, kind in (("guid", "TEXT"), ("changed", "REAL")):
+                    conn.execute(f"""ALTER TABLE library_changes
+                                     ADD COLUMN {column} {kind}""")
+                # Recreated below, naming the columns they fill
+                for trigger in ("insert", "update", "delete"):
+                    conn.execute(
+                        f"DROP TRIGGER IF EXISTS library_{trigger}_log")
+            trigger = conn.execute("""SELECT sql FROM sqlite_master
+                                      WHERE name='library_update_log'
+                                      """).fetchone()
+            if trigger and "OLD.user_id" not in trigger[0]:
+                # Recreated below, logging notes of deleted users for
+                # their owner, as gone
+                conn.execute("DROP TRIGGER library_update_log")
+            for stmt in stmts_changes:
+                conn.execute(stmt)
+
+            # Older versions did not log every note, `db.sync` sends them
+            if unlogged:
+                conn.execute("""INSERT INTO library_changes
+                                       (user_id, note_id, deleted)
+                                SELECT user_id, note_id, 0 FROM library
+                                WHERE user_id IS NOT NULL
+                                      AND note_id NOT IN
+                                          (SELECT note_id
+                                           FROM library_changes)""")
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            error_message = "Cannot create table `library_changes`."
+            raise exceptions.DatabaseError(error_message, e)
+
+        # Hashtags and link targets of each note, extracted when it is
+        # written, so finding notes by them is an index seek
+        stmts_references = ["""
+            CREATE TABLE IF NOT EXISTS note_tags (
+                note_id     INTEGER NOT NULL,
+                tag         TEXT    NOT NULL,
+                PRIMARY KEY (note_id, tag),
+                FOREIGN KEY (note_id) REFERENCES library(note_id)
+                                      ON DELETE CASCADE
+            ) WITHOUT ROWID""", """
+            CREATE INDEX IF NOT EXISTS tags_index
+                   ON note_tags (tag, note_id)""", """
+            CREATE TABLE IF NOT EXISTS note_links (
+                note_id     INTEGER NOT NULL,
+                url         TEXT    NOT NULL,
+                domain      TEXT,
+                PRIMARY KEY (note_id, url),
+                FOREIGN KEY (note_id) REFERENCES library(note_id)
+                                      ON DELETE CASCADE
+            ) WITHOUT ROWID""", """
+            CREATE INDEX IF NOT EXISTS links_index
+                   ON note_links (domain, note_id)"""]
+        try:
+            # Tables and backfill in one transaction, so the tables never
+            # exist without the references of older notes
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            indexed = conn.execute("""SELECT 1 FROM sqlite_master
+                                      WHERE name='note_tags'""").fetchone()
+            for stmt in stmts_references:
+                conn.execute(stmt)
+
+            # Notes written before the tables existed
+            if not indexed:
+                cur = conn.cursor()
+                for note_id, content in conn.execute(
+                        "SELECT note_id, content FROM library"):
+                    self.index_references(cur, note_id, content)
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            error_message = "Cannot create tables `note_tags`, `note_links`."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            conn.commit()
+
+        # Files inserted in notes, `hash` is the SHA-256 of `data`. Columns
+        # are read in order, `data` goes last so reading the others never
+        # loads the pages holding the file
+        stmts_attachments = ["""
+            CREATE TABLE IF NOT EXISTS attachments (
+                attachment_id   INTEGER PRIMARY KEY AUTOINCREMENT,
+                note_id         INTEGER NOT NULL,
+                name            TEXT    NOT NULL,
+                size            INTEGER NOT NULL,
+                hash            TEXT    NOT NULL,
+                data            BLOB    NOT NULL,
+                FOREIGN KEY (note_id) REFERENCES library(note_id)
+                                      ON DELETE CASCADE
+            )""", """
+            CREATE INDEX IF NOT EXISTS attachments_index
+                   ON attachments (note_id)"""]
+        try:
+            for stmt in stmts_attachments:
+                conn.execute(stmt)
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot create table `attachments`."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def index_references(self, cur: sqlite3.Cursor, note_id: int,
+                         content: str):
+        """Bring the hashtags and links of a note in line with its content.
+
+        Only entries that changed are written, within the transaction of
+        the cursor."""
+
+        tags = extract_tags(content)
+        cur.execute("SELECT tag FROM note_tags WHERE note_id=?", (note_id,))
+        old_tags = {row[0] for row in cur.fetchall()}
+        cur.executemany("DELETE FROM note_tags WHERE note_id=? AND tag=?",
+                        [(note_id, tag) for tag in old_tags - tags])
+        cur.executemany("INSERT INTO note_tags VALUES (?, ?)",
+                        [(note_id, tag) for tag in tags - old_tags])
+
+        links = extract_links(content)
+        cur.execute("SELECT url FROM note_links WHERE note_id=?", (note_id,))
+        old_links = {row[0] for row in cur.fetchall()}
+        cur.executemany("DELETE FROM note_links WHERE note_id=? AND url=?",
+                        [(note_id, url) for url in old_links - links])
+        cur.executemany("INSERT INTO note_links VALUES (?, ?, ?)",
+                        [(note_id, url, link_domain(url))
+                         for url in links - old_links])
+
+    def get_storage_setting(self, key: str):
+        """Return the given setting of the storage, if stored."""
+
+        stmt = """SELECT value FROM storage
+                               WHERE key=?"""
+        try:
+            row = self.conn.execute(stmt, (key,)).fetchone()
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `storage`."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            return row[0] if row else None
+
+    def set_storage_setting(self, key: str, value):
+        """Store the given setting of the storage."""
+
+        stmt = """INSERT OR REPLACE INTO storage
+                         VALUES (?, ?)"""
+        try:
+            self.conn.execute(stmt, (key, value))
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot insert data into table `storage`."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            self.conn.commit()
+
+    def has_library(self) -> bool:
+        """Return `True` if the main database has a `library` table."""
+
+        stmt = """SELECT count(*) FROM sqlite_master
+                                  WHERE type='table' AND name='library'"""
+        try:
+            return bool(self.conn.execute(stmt).fetchone()[0])
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve the database schema."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def get_data_version(self, user_id: int) -> int:
+        """Return a number that changes whenever another connection
+        commits changes to the notes of the given user."""
+
+        conn = self.storage.library(user_id)
+        try:
+            return conn.execute("PRAGMA data_version").fetchone()[0]
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve the data version."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def vacuum(self):
+        """Rebuild the database file, returning free pages to the OS."""
+
+        try:
+            for conn in self.storage.connections():
+                conn.execute("VACUUM")
+            if not self.storage.shared:
+                self.conn.execute("VACUUM")
+        except sqlite3.OperationalError as e:
+            error_message = "An operational error prevented the vacuum."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def load_snapshot(self, name: str):
+        """Replace the whole database with a copy of the given file.
+
+        Meant for in-memory databases, right after connecting. The copy
+        goes through SQLite's backup API, page by page."""
+
+        try:
+            uri = "file:" + pathname2url(os.path.abspath(name)) + "?mode=ro"
+            snapshot = sqlite3.connect(uri, uri=True)
+        except sqlite3.OperationalError as e:
+            error_message = f"Cannot open snapshot {name}."
+            raise exceptions.DatabaseError(error_message, e)
+
+        try:
+            snapshot.backup(self.conn)
+        except sqlite3.Error as e:
+            error_message = f"Cannot load snapshot {name}."
+            raise exceptions.DatabaseError(error_message, e)
+        finally:
+            snapshot.close()
+
+    def save_snapshot(self, name: str):
+        """Copy the whole database into the given file, replacing it.
+
+        The file is written in a single transaction, so readers see either
+        the previous snapshot or the new one."""
+
+        if not self.storage.shared:
+            error_message = "Sharded databases cannot be saved as snapshots."
             raise exceptions.DatabaseError(error_message)
 
+        try:
+            snapshot = sqlite3.connect(name)
+        except sqlite3.OperationalError as e:
+            error_message = f"Cannot open snapshot {name}."
+            raise exceptions.DatabaseError(error_message, e)
+
+        try:
+            self.conn.backup(snapshot)
+        except sqlite3.Error as e:
+            error_message = f"Cannot save snapshot {name}."
+            raise exceptions.DatabaseError(error_message, e)
+        finally:
+            snapshot.close()
+
+    def attach_archive(self, name: str):
+        """Attach the given database file under the schema `archive` of
+        every database holding notes."""
+
+        try:
+            for conn in self.storage.connections():
+                conn.execute("ATTACH DATABASE ? AS archive", (name,))
+        except sqlite3.OperationalError as e:
+            error_message = f"Cannot attach archive database {name}."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def detach_archive(self):
+        """Detach the archive database, if any."""
+
+        try:
+            for conn in self.storage.connections():
+                conn.execute("DETACH DATABASE archive")
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot detach archive database."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def cold_tier(self, conn: sqlite3.Connection,
+                  create: bool = False) -> bool:
+        """Attach the cold database of the given library connection under
+        the schema `cold`, if it exists or `create`. Return `True` if it
+        is attached.
+
+        Temporary triggers remove the archived content of notes deleted
+        or unarchived through the connection. They only exist on it, so
+        `DBHelper` methods also remove it themselves, see
+        `discard_cold_copies`."""
+
+        if conn in self.cold_tiers:
+            return True
+        connections = self.storage.connections()
+        if conn not in connections or self.name == MEMORY:
+            return False
+        name = cold_name(
+            self.storage.library_names()[connections.index(conn)])
+        if not create and not os.path.exists(name):
+            return False
+
+        stmts = ["""
+            CREATE TABLE IF NOT EXISTS cold.archived_notes (
+                note_id     INTEGER PRIMARY KEY,
+                content     TEXT    NOT NULL,
+                archived    REAL    NOT NULL
+            )""", """
+            CREATE TEMP TRIGGER IF NOT EXISTS cold_delete
+                   AFTER DELETE ON main.library
+                   WHEN OLD.archived
+            BEGIN
+                DELETE FROM archived_notes WHERE note_id = OLD.note_id;
+            END""", """
+            CREATE TEMP TRIGGER IF NOT EXISTS cold_restore
+                   AFTER UPDATE OF archived ON main.library
+                   WHEN OLD.archived AND NOT NEW.archived
+            BEGIN
+                DELETE FROM archived_notes WHERE note_id = OLD.note_id;
+            END"""]
+        try:
+            conn.execute("ATTACH DATABASE ? AS cold", (name,))
+            for stmt in stmts:
+                conn.execute(stmt)
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            try:
+                conn.execute("DETACH DATABASE cold")
+            except sqlite3.OperationalError:
+                pass
+            error_message = f"Cannot attach cold database {name}."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            conn.commit()
+            self.cold_tiers.add(conn)
+            return True
+
+    def discard_cold_copies(self, cur: sqlite3.Cursor, user_id: int,
+                            item_ids: Iterable[int]):
+        """Delete the archived content of the given notes of the user,
+        about to be deleted or unarchived, within the transaction of the
+        cursor."""
+
+        if cur.connection not in self.cold_tiers:
+            return
+        stmt = """DELETE FROM cold.archived_notes
+                         WHERE note_id IN (SELECT note_id FROM main.library
+                                           WHERE user_id=? AND note_id=?
+                                                 AND archived)"""
+        cur.executemany(stmt, [(user_id, item_id) for item_id in item_ids])
+
+    def content_column(self, conn: sqlite3.Connection) -> str:
+        """Return the expression reading the content of notes through the
+        given connection, wherever they are stored.
+
+        The cold database is attached if another instance created it."""
+
+        return TIERED_CONTENT if self.cold_tier(conn) else "library.content"
+
     # =====  `User` table methods  ========================================
     def create_user(self, user: str, password: str, name: str):
         """Insert info about the user into the database."""
@@ -94,8 +880,8 @@ class DBHelper:
 
         if all(validations.values()):
             # user_id autoincremented, password hashed, avatar_id by default
-            stmt = """INSERT INTO users
-                             VALUES (NULL, ?, hash(?), ?, 0)"""
+            stmt = """INSERT INTO users (username, password, name, avatar_id)
+                             VALUES (?, hash(?), ?, 0)"""
             params = (user, password, name)
             cur = self.conn.cursor()
 
@@ -105,9 +891,9 @@ class DBHelper:
                 error_message = "User already exists in the database."
                 raise exceptions.UsernameExistsError(user, error_message)
 
-            except sqlite3.OperationalError:
+            except sqlite3.OperationalError as e:
                 error_message = "An operational error prevented the insertion."
-                raise exceptions.DatabaseError(error_message)
+                raise exceptions.DatabaseError(error_message, e)
 
             else:
                 self.conn.commit()
@@ -118,6 +904,117 @@ class DBHelper:
             columns = tuple(col for col in validations if not validations[col])
             raise exceptions.ValidationError(columns, error_message)
 
+    def create_users(self, users: Iterable[NewUser],
+                     max_workers: Optional[int] = None
+                     ) -> List[Tuple[int, exceptions.Error]]:
+        """Insert many `(user, password, name)` rows in one transaction.
+
+        Passwords are hashed in parallel by a pool of processes. Rows that
+        cannot be inserted are skipped and returned as `(position, error)`
+        pairs, where the error is a `ValidationError` or a
+        `UsernameExistsError`."""
+
+        rows = list(users)
+        errors = []
+        valid = []
+
+        for position, row in enumerate(rows):
+            if len(row) != 3:
+                # Malformed row, e.g. a CSV line with a missing comma
+                error_message = (f"Expected username, password and name, "
+                                 f"got {len(row)} fields.")
+                errors.append((position, exceptions.ValidationError(
+                    ("username", "password", "name"), error_message)))
+                continue
+
+            user, password, name = row
+            validations = {
+                "username": validate_username(user),
+                "password": validate_pwd(password),
+                "name": validate_name(name)}
+
+            if all(validations.values()):
+                valid.append(position)
+            else:
+                error_message = "Fields validation failed, insertion aborted."
+                columns = tuple(col for col in validations
+                                if not validations[col])
+                errors.append((position, exceptions.ValidationError(
+                    columns, error_message)))
+
+        # Don't waste time hashing passwords of users that already exist
+        taken = self.get_existing_usernames(rows[i][0] for i in valid)
+        pending = []
+        for position in valid:
+            user = rows[position][0]
+            if user in taken:
+                error_message = "User already exists in the database."
+                errors.append((position, exceptions.UsernameExistsError(
+                    user, error_message)))
+            else:
+                taken.add(user)
+                pending.append(position)
+
+        if pending:
+            workers = max_workers or os.cpu_count() or 1
+            # Few big chunks keep the pickling overhead low
+            chunksize = max(1, len(pending) // (workers * 4))
+            with ProcessPoolExecutor(workers) as pool:
+                hashes = list(pool.map(
+                    encrypt_password, (rows[i][1] for i in pending),
+                    chunksize=chunksize))
+
+            stmt = """INSERT INTO users (username, password, name, avatar_id)
+                             VALUES (?, ?, ?, 0)"""
+            cur = self.conn.cursor()
+
+            try:
+                # Within the transaction already open, if any
+                if not self.conn.in_transaction:
+                    cur.execute("BEGIN IMMEDIATE")
+                for position, hashed in zip(pending, hashes):
+                    user, _, name = rows[position]
+                    try:
+                        cur.execute(stmt, (user, hashed, name))
+                    except sqlite3.IntegrityError:
+                        # Inserted by someone else in the meantime
+                        error_message = "User already exists in the database."
+                        errors.append((position,
+                                       exceptions.UsernameExistsError(
+                                           user, error_message)))
+
+            except sqlite3.OperationalError as e:
+                self.conn.rollback()
+                error_message = "An operational error prevented the insertion."
+                raise exceptions.DatabaseError(error_message, e)
+
+            else:
+                self.conn.commit()
+
+        return sorted(errors, key=lambda error: error[0])
+
+    def get_existing_usernames(self, users: Iterable[str]) -> Set[str]:
+        """Return which of the given usernames are already taken."""
+
+        users = list(users)
+        existing = set()
+        cur = self.conn.cursor()
+
+        # Stay below SQLite's default limit of host parameters
+        for i in range(0, len(users), 500):
+            chunk = users[i:i+500]
+            stmt = f"""SELECT username FROM users
+                       WHERE username IN ({", ".join("?" * len(chunk))})"""
+            try:
+                cur.execute(stmt, chunk)
+            except sqlite3.OperationalError as e:
+                error_message = "Cannot retrieve data from table `users`."
+                raise exceptions.DatabaseError(error_message, e)
+            else:
+                existing.update(row[0] for row in cur.fetchall())
+
+        return existing
+
     def check_password(self, user_id: int, password: str) -> bool:
         """Return `True` if `password` matches the password of
         the user with the given id."""
@@ -129,12 +1026,16 @@ class DBHelper:
 
         try:
             cur.execute(stmt, params)
-        except sqlite3.OperationalError:
+        except sqlite3.OperationalError as e:
             error_message = "Cannot retrieve data from table `users`."
-            raise exceptions.DatabaseError(error_message)
+            raise exceptions.DatabaseError(error_message, e)
 
         else:
-            if check_encrypted_password(password, cur.fetchone()[0]):
+            user_ok, new_hash = check_and_update_password(
+                password, cur.fetchone()[0])
+            if user_ok:
+                if new_hash:
+                    self.rehash_password(user_id, new_hash)
                 return True
 
         # Passwords do not match
@@ -150,39 +1051,126 @@ class DBHelper:
 
         try:
             cur.execute(stmt, params)
-        except sqlite3.OperationalError:
+        except sqlite3.OperationalError as e:
             error_message = "Cannot retrieve data from table `users`."
-            raise exceptions.DatabaseError(error_message)
+            raise exceptions.DatabaseError(error_message, e)
 
         else:
             # Check password if user found
             user_pass_combo = cur.fetchone()
             if user_pass_combo:
-                if check_encrypted_password(password, user_pass_combo[1]):
+                user_ok, new_hash = check_and_update_password(
+                    password, user_pass_combo[1])
+                if user_ok:
+                    if new_hash:
+                        self.rehash_password(user_pass_combo[0], new_hash)
                     return user_pass_combo[0]
 
         # User was not found or passwords do not match
         error_message = "Invalid user and/or password."
         raise exceptions.LoginError(user, error_message)
 
-    def get_user_info(self, user_id: int) -> List[UserInfo]:
-        """Return info and notes of the user with the given id."""
+    def update_password_hash(self, user_id: int, hashed: str):
+        """Replace the stored hash of the user's password."""
+
+        stmt = """UPDATE users SET password=?
+                               WHERE user_id=?"""
+        params = (hashed, user_id)
+        # Undo only this update on failure, not other work pending on
+        # the connection. Releasing commits, unless within a transaction
+        try:
+            self.conn.execute("SAVEPOINT rehash")
+            self.conn.execute(stmt, params)
+            self.conn.execute("RELEASE rehash")
+        except sqlite3.OperationalError as e:
+            try:
+                self.conn.execute("ROLLBACK TO rehash")
+                self.conn.execute("RELEASE rehash")
+            except sqlite3.OperationalError:
+                # The savepoint was never opened, or is gone
+                pass
+            error_message = "Cannot update table `users`."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def rehash_password(self, user_id: int, hashed: str):
+        """Replace the stored hash of the user's password, if possible.
+
+        Failing is harmless, since the old hash remains valid and the
+        update is attempted again on the next login."""
 
-        stmt = """SELECT username, name, avatar_id,
-                         note_id, content, creation, last_update
-                  FROM users LEFT JOIN library
-                       ON users.user_id = library.user_id
-                  WHERE users.user_id=?"""
+        try:
+            self.update_password_hash(user_id, hashed)
+        except exceptions.DatabaseError as e:
+            logger.warning("%s Password of user %d not rehashed.",
+                           e.message, user_id)
+
+    def get_user_info(self, user_id: int,
+                      content: bool = True) -> List[UserInfo]:
+        """Return info and notes of the user with the given id.
+
+        Without `content`, the content of the notes is `None`."""
+
+        conn = self.storage.library(user_id)
+        column = self.content_column(conn) if content else "NULL"
+        stmt_user = """SELECT username, name, avatar_id FROM users
+                                                        WHERE user_id=?"""
+        stmt_notes = f"""SELECT note_id, {column}, creation, last_update
+                         FROM library
+                         WHERE user_id=?
+                         ORDER BY note_id"""
         params = (user_id,)
-        cur = self.conn.cursor()
         try:
-            cur.execute(stmt, params)
-        except sqlite3.OperationalError:
+            user = self.conn.execute(stmt_user, params).fetchone()
+            notes = conn.execute(stmt_notes, params).fetchall()
+        except sqlite3.OperationalError as e:
             error_message = ("Cannot retrieve data from tables "
                              "`users` & `library`.")
-            raise exceptions.DatabaseError(error_message)
+            raise exceptions.DatabaseError(error_message, e)
         else:
-            return cur.fetchall()
+            if not user:
+                return []
+            # Same rows as a `users LEFT JOIN library`
+            return [user + note for note in notes or
+                    [(None, None, None, None)]]
+
+    def get_user_summary(self, user_id: int) -> Optional[UserSummary]:
+        """Return info of the user with the given id, with the number of
+        notes and when one was updated last, `None` if there is no such
+        user.
+
+        Notes are counted on the indexes, none of them is read."""
+
+        stmt_user = """SELECT username, name, avatar_id FROM users
+                                                        WHERE user_id=?"""
+        # Separate subqueries, so `max` seeks the end of `update_index`
+        stmt_notes = """SELECT (SELECT count(*) FROM library
+                                                WHERE user_id=?),
+                               (SELECT max(last_update) FROM library
+                                                        WHERE user_id=?)"""
+        try:
+            user = self.conn.execute(stmt_user, (user_id,)).fetchone()
+            notes = self.storage.library(user_id).execute(
+                stmt_notes, (user_id, user_id)).fetchone()
+        except sqlite3.OperationalError as e:
+            error_message = ("Cannot retrieve data from tables "
+                             "`users` & `library`.")
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            return user + notes if user else None
+
+    def get_avatar_ids(self) -> Set[int]:
+        """Return the ids of the custom avatars users have."""
+
+        stmt = """SELECT DISTINCT avatar_id FROM users
+                                           WHERE avatar_id != 0"""
+        cur = self.conn.cursor()
+        try:
+            cur.execute(stmt)
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `users`."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            return {row[0] for row in cur.fetchall()}
 
     def delete_user(self, user_id: int):
         """Delete the user with the given id from the database.
@@ -196,12 +1184,25 @@ class DBHelper:
 
         try:
             cur.execute(stmt, params)
-        except sqlite3.OperationalError:
+        except sqlite3.OperationalError as e:
             error_message = "An operational error prevented the deletion."
-            raise exceptions.DatabaseError(error_message)
+            raise exceptions.DatabaseError(error_message, e)
         else:
             self.conn.commit()
 
+        # Done by the foreign key when notes live in the same database
+        if not self.storage.shared:
+            stmt = """UPDATE library SET user_id=NULL
+                                     WHERE user_id=?"""
+            conn = self.storage.library(user_id)
+            try:
+                conn.execute(stmt, params)
+            except sqlite3.OperationalError as e:
+                error_message = "An operational error prevented the deletion."
+                raise exceptions.DatabaseError(error_message, e)
+            else:
+                conn.commit()
+
     def update_user(self, user_id: int, user: str, name: str,
                     password: Optional[str]=None):
         """Edit info about the user with the given id."""
@@ -231,9 +1232,9 @@ class DBHelper:
                 error_message = "User already exists in the database."
                 raise exceptions.UsernameExistsError(user, error_message)
 
-            except sqlite3.OperationalError:
+            except sqlite3.OperationalError as e:
                 error_message = "An operational error prevented the edition."
-                raise exceptions.DatabaseError(error_message)
+                raise exceptions.DatabaseError(error_message, e)
             else:
                 self.conn.commit()
 
@@ -252,60 +1253,1229 @@ class DBHelper:
         cur = self.conn.cursor()
         try:
             cur.execute(stmt, params)
-        except sqlite3.OperationalError:
+        except sqlite3.OperationalError as e:
             error_message = "An operational error prevented the insertion."
-            raise exceptions.DatabaseError(error_message)
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            self.conn.commit()
+
+    # =====  `Avatars` table methods  =====================================
+    def write_avatar(self, cur: sqlite3.Cursor, image: bytes,
+                     thumbnail: bytes) -> int:
+        """Store the avatar, unless already stored, within the
+        transaction of the cursor. Return its id."""
+
+        digest = hashlib.sha256(image).hexdigest()
+        cur.execute("SELECT avatar_id FROM avatars WHERE hash=?", (digest,))
+        row = cur.fetchone()
+        if row:
+            return row[0]
+
+        # Room for the images, then written in place
+        cur.execute("INSERT INTO avatars VALUES (NULL, ?, zeroblob(?), "
+                    "zeroblob(?))", (digest, len(image), len(thumbnail)))
+        avatar_id = cur.lastrowid
+        write_blob(self.conn, "avatars", "image", avatar_id, image)
+        write_blob(self.conn, "avatars", "thumbnail", avatar_id, thumbnail)
+        return avatar_id
+
+    def upload_avatar(self, user_id: int, image: bytes,
+                      thumbnail: bytes) -> int:
+        """Store the avatar and set it for the given user. Return its id."""
+
+        cur = self.conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            avatar_id = self.write_avatar(cur, image, thumbnail)
+            cur.execute("UPDATE users SET avatar_id=? WHERE user_id=?",
+                        (avatar_id, user_id))
+        except sqlite3.OperationalError as e:
+            self.conn.rollback()
+            error_message = "An operational error prevented the insertion."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            self.conn.commit()
+            return avatar_id
+
+    def read_avatar(self, avatar_id: int,
+                    thumbnail: bool = False) -> Optional[bytes]:
+        """Return the encoded avatar, or its thumbnail, `None` if there is
+        no such avatar."""
+
+        column = "thumbnail" if thumbnail else "image"
+        try:
+            return read_blob(self.conn, "avatars", column, avatar_id)
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `avatars`."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def import_avatars(self, avatars: Dict[int, Optional[AvatarImages]]):
+        """Move avatars kept outside the database into `avatars`, once.
+
+        `avatars` maps the `avatar_id` users had to the images, `None` if
+        lost. Users are pointed to the new ids in the same transaction."""
+
+        cur = self.conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            cur.execute("SELECT value FROM storage WHERE key='avatar_files'")
+            if cur.fetchone():
+                # Another instance got here first
+                self.conn.rollback()
+                return
+
+            cur.execute("""SELECT user_id, avatar_id FROM users
+                                             WHERE avatar_id != 0""")
+            owners = cur.fetchall()
+            new_ids = {old_id: self.write_avatar(cur, *images)
+                       for old_id, images in avatars.items() if images}
+            cur.executemany("UPDATE users SET avatar_id=? WHERE user_id=?",
+                            [(new_ids.get(avatar_id, 0), user_id)
+                             for user_id, avatar_id in owners])
+            cur.execute("""INSERT INTO storage
+                                  VALUES ('avatar_files', 'imported')""")
+        except sqlite3.OperationalError as e:
+            self.conn.rollback()
+            error_message = "An operational error prevented the insertion."
+            raise exceptions.DatabaseError(error_message, e)
         else:
             self.conn.commit()
 
+    def purge_orphaned_avatars(self) -> Tuple[int, int]:
+        """Delete avatars no user has. Return the number of avatars and
+        bytes removed."""
+
+        orphaned = "avatar_id NOT IN (SELECT avatar_id FROM users)"
+        cur = self.conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            cur.execute(f"""SELECT count(*),
+                                   total(length(image) + length(thumbnail))
+                            FROM avatars WHERE {orphaned}""")
+            num_rows, num_bytes = cur.fetchone()
+            cur.execute(f"DELETE FROM avatars WHERE {orphaned}")
+        except sqlite3.OperationalError as e:
+            self.conn.rollback()
+            error_message = "An operational error prevented the deletion."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            self.conn.commit()
+            return num_rows, int(num_bytes)
+
     # =====  `Library` table methods  =====================================
-    def add_item(self, user_id: int, item_text: str):
-        """Add a note to the database."""
+    def add_item(self, user_id: int, item_text: str) -> int:
+        """Add a note to the database and return its id."""
 
-        stmt = """INSERT INTO library
-                         VALUES (NULL, ?, ?, ?, ?)"""
+        stmt = """INSERT INTO library (user_id, content, creation,
+                                       last_update, content_hash, title,
+                                       plain_preview)
+                         VALUES (?, ?, ?, ?, ?, ?, ?)"""
         epoch_time = time.time()
-        params = (user_id, item_text, epoch_time, epoch_time)
-        cur = self.conn.cursor()
+        params = (user_id, item_text, epoch_time, epoch_time,
+                  *derived_columns(item_text))
+        conn = self.storage.library(user_id)
+        cur = conn.cursor()
 
         try:
             cur.execute(stmt, params)
-        except sqlite3.OperationalError:
+            note_id = cur.lastrowid
+            self.index_references(cur, note_id, item_text)
+        except (sqlite3.OperationalError, sqlite3.IntegrityError) as e:
+            conn.rollback()
             error_message = "An operational error prevented the insertion."
-            raise exceptions.DatabaseError(error_message)
+            raise exceptions.DatabaseError(error_message, e)
         else:
-            self.conn.commit()
+            conn.commit()
+            return note_id
+
+    def update_item(self, user_id: int, item_id: int,
+                    item_text: str) -> bool:
+        """Update the given note with a new text.
 
-    def update_item(self, user_id: int, item_id: int, item_text: str):
-        """Update the given note with a new text."""
+        Return `False` if the user has no such note."""
 
+        # Edited notes are hot again
         stmt = """ UPDATE library SET content=?,
-                                      last_update=?
+                                      last_update=?,
+                                      content_hash=?,
+                                      title=?,
+                                      plain_preview=?,
+                                      archived=0
                                   WHERE user_id=? AND note_id=?"""
         epoch_time = time.time()
-        params = (item_text, epoch_time, user_id, item_id)
-        cur = self.conn.cursor()
+        params = (item_text, epoch_time, *derived_columns(item_text),
+                  user_id, item_id)
+        conn = self.storage.library(user_id)
+        self.cold_tier(conn)
+        cur = conn.cursor()
 
         try:
+            self.discard_cold_copies(cur, user_id, (item_id,))
             cur.execute(stmt, params)
-        except sqlite3.OperationalError:
+            updated = cur.rowcount > 0
+            if updated:
+                self.index_references(cur, item_id, item_text)
+        except sqlite3.OperationalError as e:
+            conn.rollback()
             error_message = "An operational error prevented the edition."
-            raise exceptions.DatabaseError(error_message)
+            raise exceptions.DatabaseError(error_message, e)
         else:
-            self.conn.commit()
+            conn.commit()
+            return updated
+
+    def import_items(self, user_id: int, notes: Iterable[ImportedNote],
+                     mode: str = "skip") -> Tuple[int, int, int]:
+        """Add the given notes, matching those the user already has by
+        content hash as `mode` says (see `IMPORT_MODES`).
+
+        Notes are added in a single transaction, so importing the same
+        notes twice adds nothing the second time. Return the number of
+        notes added, skipped and merged."""
+
+        if mode not in IMPORT_MODES:
+            raise ValueError(f"unknown import mode `{mode}`")
+
+        # Notes of the user not filled by `fill_derived_columns` yet
+        stmt_pending = """SELECT note_id, content FROM library
+                                                 WHERE user_id=?
+                                                 AND content_hash IS NULL"""
+        stmt_fill = """UPDATE library SET content_hash=?,
+                                          title=?,
+                                          plain_preview=?
+                                      WHERE note_id=?"""
+        stmt_find = """SELECT note_id FROM library
+                                      WHERE user_id=? AND content_hash=?
+                                      ORDER BY note_id LIMIT 1"""
+        stmt_insert = """INSERT INTO library (user_id, content, creation,
+                                              last_update, content_hash,
+                                              title, plain_preview)
+                                VALUES (?, ?, ?, ?, ?, ?, ?)"""
+        stmt_merge = """UPDATE library
+                               SET creation=min(creation, ?),
+                                   last_update=max(last_update, ?)
+                               WHERE note_id=?"""
+        added, skipped, merged = 0, 0, 0
+        conn = self.storage.library(user_id)
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            cur.execute(stmt_pending, (user_id,))
+            cur.executemany(stmt_fill, [(*derived_columns(content), note_id)
+                                        for note_id, content
+                                        in cur.fetchall()])
+            for content, creation, last_update in notes:
+                epoch_time = time.time()
+                creation = creation or epoch_time
+                last_update = last_update or creation
+                digest = content_hash(content)
+
+                cur.execute(stmt_find, (user_id, digest))
+                row = cur.fetchone()
+                if row and mode == "skip":
+                    skipped += 1
+                elif row and mode == "merge":
+                    cur.execute(stmt_merge, (creation, last_update, row[0]))
+                    merged += 1
+                else:
+                    cur.execute(stmt_insert, (user_id, content, creation,
+                                              last_update, digest,
+                                              note_title(content),
+                                              note_preview(content)))
+                    self.index_references(cur, cur.lastrowid, content)
+                    added += 1
+        except (sqlite3.OperationalError, sqlite3.IntegrityError) as e:
+            conn.rollback()
+            error_message = "An operational error prevented the import."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            conn.commit()
+            return added, skipped, merged
+
+    def find_duplicates(self, user_id: Optional[int] = None
+                        ) -> List[Duplicates]:
+        """Return the groups of notes of a user, or of every user, with
+        the same content (ignoring whitespace), largest first.
+
+        Notes whose hash is not filled yet (see `fill_derived_columns`)
+        are left out."""
+
+        stmt = f"""SELECT user_id, content_hash, count(*),
+                          group_concat(note_id)
+                   FROM library
+                   WHERE user_id IS NOT NULL
+                         AND content_hash IS NOT NULL
+                         {"AND user_id=?" if user_id else ""}
+                   GROUP BY user_id, content_hash
+                   HAVING count(*) > 1"""
+        params = (user_id,) if user_id else ()
+        connections = ([self.storage.library(user_id)] if user_id
+                       else self.storage.connections())
+        duplicates = []
+        try:
+            for conn in connections:
+                for owner, digest, count, note_ids in conn.execute(
+                        stmt, params):
+                    duplicates.append(
+                        (owner, digest, count,
+                         sorted(map(int, note_ids.split(",")))))
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `library`."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            return sorted(duplicates, key=lambda group: (-group[2], group[0]))
+
+    def get_item(self, user_id: int, item_id: int) -> Optional[Note]:
+        """Return the given note, or `None` if the user has no such note."""
+
+        conn = self.storage.library(user_id)
+        stmt = f"""SELECT note_id, {self.content_column(conn)},
+                          creation, last_update
+                   FROM library
+                   WHERE user_id=? AND note_id=?"""
+        params = (user_id, item_id)
+        cur = conn.cursor()
+        try:
+            cur.execute(stmt, params)
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `library`."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            return cur.fetchone()
+
+    def search_items(self, user_id: int, text: str) -> List[Note]:
+        """Return the user's notes containing the given text."""
+
+        # Match `%` and `_` literally
+        pattern = "%" + text.replace("\\", "\\\\").replace(
+            "%", "\\%").replace("_", "\\_") + "%"
+        conn = self.storage.library(user_id)
+        column = self.content_column(conn)
+        stmt = f"""SELECT note_id, {column}, creation, last_update
+                   FROM library
+                   WHERE user_id=? AND {column} LIKE ? ESCAPE '\\'"""
+        params = (user_id, pattern)
+        cur = conn.cursor()
+        try:
+            cur.execute(stmt, params)
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `library`."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            return cur.fetchall()
+
+    def query_items(self, user_id: int, order_by: str = "note_id",
+                    created_between: Optional[Period] = None,
+                    updated_between: Optional[Period] = None,
+                    limit: Optional[int] = None,
+                    after: Optional[Cursor] = None,
+                    content: bool = True) -> List[Note]:
+        """Return a page of the user's notes, sorted and filtered.
+
+        `order_by` is a column of `ORDER_COLUMNS`, descending if prefixed
+        with `-`. Periods are `(start, end)` timestamps, either of them
+        may be `None`, and the end is excluded. The next page starts
+        `after` the cursor of the last note (see `note_cursor`). Without
+        `content`, the content of the notes is `None`."""
+
+        conditions, order, params = page_clauses(
+            user_id, order_by, created_between, updated_between, after)
+        conn = self.storage.library(user_id)
+        column = self.content_column(conn) if content else "NULL"
+        stmt = f"""SELECT note_id, {column}, creation, last_update
+                   FROM library
+                   WHERE {conditions}
+                   ORDER BY {order}
+                   LIMIT ?"""
+        params.append(-1 if limit is None else limit)
+
+        try:
+            return conn.execute(stmt, params).fetchall()
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `library`."
+            raise exceptions.DatabaseError(error_message, e)
 
-    def delete_item(self, user_id: int, item_id: int):
-        """Delete the given note from the database."""
+    def list_items(self, user_id: int, order_by: str = "note_id",
+                   created_between: Optional[Period] = None,
+                   updated_between: Optional[Period] = None,
+                   limit: Optional[int] = None,
+                   after: Optional[Cursor] = None) -> List[NotePreview]:
+        """Return a page of the titles and previews of the user's notes,
+        as `query_items` would return the notes.
+
+        Only notes not backfilled yet have their content read."""
+
+        conditions, order, params = page_clauses(
+            user_id, order_by, created_between, updated_between, after)
+        stmt = f"""SELECT note_id, title, creation, last_update,
+                          plain_preview,
+                          CASE WHEN title IS NULL THEN content END
+                   FROM library
+                   WHERE {conditions}
+                   ORDER BY {order}
+                   LIMIT ?"""
+        params.append(-1 if limit is None else limit)
+
+        try:
+            rows = self.storage.library(user_id).execute(
+                stmt, params).fetchall()
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `library`."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            return [row[:5] if row[5] is None else
+                    (row[0], note_title(row[5]), row[2], row[3],
+                     note_preview(row[5])) for row in rows]
+
+    def count_unfilled_items(self) -> int:
+        """Return the number of notes whose derived columns are empty."""
+
+        stmt = "SELECT count(*) FROM library WHERE title IS NULL"
+        try:
+            return sum(conn.execute(stmt).fetchone()[0]
+                       for conn in self.storage.connections())
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `library`."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def fill_derived_columns(self, batch_size: int) -> int:
+        """Compute the derived columns of up to `batch_size` notes written
+        before they existed. Return the number of notes filled.
+
+        Every batch runs in its own transaction."""
+
+        stmt_select = """SELECT note_id, content FROM library
+                                                 WHERE title IS NULL
+                                                 ORDER BY note_id
+                                                 LIMIT ?"""
+        stmt_update = """UPDATE library SET content_hash=?,
+                                            title=?,
+                                            plain_preview=?
+                                        WHERE note_id=?"""
+        for conn in self.storage.connections():
+            cur = conn.cursor()
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+                cur.execute(stmt_select, (batch_size,))
+                rows = cur.fetchall()
+                cur.executemany(stmt_update,
+                                [(*derived_columns(content), note_id)
+                                 for note_id, content in rows])
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                error_message = "An operational error prevented the edition."
+                raise exceptions.DatabaseError(error_message, e)
+            else:
+                conn.commit()
+                if rows:
+                    return len(rows)
+
+        return 0
+
+    def get_tags(self, user_id: int) -> List[Tuple[str, int]]:
+        """Return the hashtags of the user's notes, with the number of
+        notes having each one."""
+
+        stmt = """SELECT tag, count(*)
+                  FROM library JOIN note_tags
+                       ON library.note_id = note_tags.note_id
+                  WHERE user_id=?
+                  GROUP BY tag
+                  ORDER BY tag"""
+        try:
+            return self.storage.library(user_id).execute(
+                stmt, (user_id,)).fetchall()
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `note_tags`."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def get_link_domains(self, user_id: int) -> List[Tuple[str, int]]:
+        """Return the domains linked from the user's notes, with the
+        number of notes linking to each one."""
+
+        stmt = """SELECT domain, count(DISTINCT library.note_id)
+                  FROM library JOIN note_links
+                       ON library.note_id = note_links.note_id
+                  WHERE user_id=? AND domain IS NOT NULL
+                  GROUP BY domain
+                  ORDER BY domain"""
+        try:
+            return self.storage.library(user_id).execute(
+                stmt, (user_id,)).fetchall()
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `note_links`."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def find_items_by_tag(self, user_id: int, tag: str) -> List[Note]:
+        """Return the user's notes with the given hashtag."""
+
+        conn = self.storage.library(user_id)
+        stmt = f"""SELECT library.note_id, {self.content_column(conn)},
+                          creation, last_update
+                   FROM note_tags JOIN library
+                        ON library.note_id = note_tags.note_id
+                   WHERE tag=? AND user_id=?
+                   ORDER BY library.note_id"""
+        params = (tag.lstrip("#").lower(), user_id)
+        try:
+            return conn.execute(stmt, params).fetchall()
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `note_tags`."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def find_items_by_domain(self, user_id: int, domain: str) -> List[Note]:
+        """Return the user's notes linking to the given domain."""
+
+        conn = self.storage.library(user_id)
+        stmt = f"""SELECT library.note_id, {self.content_column(conn)},
+                          creation, last_update
+                   FROM library
+                   WHERE user_id=? AND note_id IN (SELECT note_id
+                                                   FROM note_links
+                                                   WHERE domain=?)
+                   ORDER BY note_id"""
+        params = (user_id, normalize_domain(domain))
+        try:
+            return conn.execute(stmt, params).fetchall()
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `note_links`."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def get_last_change(self, user_id: int) -> int:
+        """Return the sequence number of the latest change of notes
+        in the database holding the notes of the given user."""
+
+        stmt = """SELECT coalesce(max(seq), 0) FROM library_changes"""
+        try:
+            return self.storage.library(user_id).execute(stmt).fetchone()[0]
+        except sqlite3.OperationalError as e:
+            error_message = ("Cannot retrieve data from table "
+                             "`library_changes`.")
+            raise exceptions.DatabaseError(error_message, e)
+
+    def get_changes(self, user_id: int, since: int) -> List[NoteChange]:
+        """Return notes of the user changed after the change `since`, as
+        `(seq, note_id, deleted, content, creation, last_update)`."""
+
+        conn = self.storage.library(user_id)
+        stmt = f"""SELECT seq, library_changes.note_id, deleted,
+                          {self.content_column(conn)}, creation, last_update
+                   FROM library_changes LEFT JOIN library
+                        ON library_changes.note_id = library.note_id
+                   WHERE library_changes.user_id=? AND seq>?
+                   ORDER BY seq"""
+        params = (user_id, since)
+        cur = conn.cursor()
+        try:
+            cur.execute(stmt, params)
+        except sqlite3.OperationalError as e:
+            error_message = ("Cannot retrieve data from table "
+                             "`library_changes`.")
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            return cur.fetchall()
+
+    def prune_tombstones(self, older_than: Timestamp, batch_size: int) -> int:
+        """Forget up to `batch_size` notes deleted before `older_than` from
+        the feed of changes. Return the number of entries removed.
+
+        Instances and copies that did not pull the changes since then
+        miss those deletions."""
+
+        stmt = """DELETE FROM library_changes
+                         WHERE seq IN (SELECT seq FROM library_changes
+                                       WHERE deleted = 1
+                                             AND (changed IS NULL
+                                                  OR changed < ?)
+                                       LIMIT ?)"""
+        params = (older_than, batch_size)
+
+        for conn in self.storage.connections():
+            cur = conn.cursor()
+            try:
+                cur.execute(stmt, params)
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                error_message = "An operational error prevented the pruning."
+                raise exceptions.DatabaseError(error_message, e)
+            else:
+                conn.commit()
+                if cur.rowcount:
+                    return cur.rowcount
+
+        return 0
+
+    def delete_item(self, user_id: int, item_id: int) -> bool:
+        """Delete the given note from the database.
+
+        Return `False` if the user has no such note."""
 
         stmt = """DELETE FROM library
                          WHERE user_id=? AND note_id=?"""
         params = (user_id, item_id)
-        cur = self.conn.cursor()
+        conn = self.storage.library(user_id)
+        self.cold_tier(conn)
+        cur = conn.cursor()
 
         try:
+            self.discard_cold_copies(cur, user_id, (item_id,))
             cur.execute(stmt, params)
-        except sqlite3.OperationalError:
+        except sqlite3.OperationalError as e:
+            conn.rollback()
             error_message = "An operational error prevented the deletion."
-            raise exceptions.DatabaseError(error_message)
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            conn.commit()
+            return cur.rowcount > 0
+
+    def delete_items(self, user_id: int, item_ids: Iterable[int]) -> int:
+        """Delete the given notes of the user in a single transaction.
+
+        Return the number of notes deleted, ids of notes the user doesn't
+        have are ignored."""
+
+        stmt = """DELETE FROM library
+                         WHERE user_id=? AND note_id=?"""
+        item_ids = list(item_ids)
+        params = [(user_id, item_id) for item_id in item_ids]
+        conn = self.storage.library(user_id)
+        self.cold_tier(conn)
+        cur = conn.cursor()
+
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            self.discard_cold_copies(cur, user_id, item_ids)
+            cur.executemany(stmt, params)
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            error_message = "An operational error prevented the deletion."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            conn.commit()
+            return cur.rowcount
+
+    def write_items(self, cur: sqlite3.Cursor, user_id: int,
+                    items: Iterable[Tuple[int, str]]) -> List[int]:
+        """Replace the content of the given `(note_id, content)` of the
+        user, within the transaction of the cursor. Return the ids of the
+        notes updated."""
+
+        stmt = """UPDATE library SET content=?,
+                                     last_update=?,
+                                     content_hash=?,
+                                     title=?,
+                                     plain_preview=?,
+                                     archived=0
+                                 WHERE user_id=? AND note_id=?"""
+        epoch_time = time.time()
+        updated = []
+        for item_id, item_text in items:
+            self.discard_cold_copies(cur, user_id, (item_id,))
+            cur.execute(stmt, (item_text, epoch_time,
+                               *derived_columns(item_text), user_id,
+                               item_id))
+            if cur.rowcount > 0:
+                self.index_references(cur, item_id, item_text)
+                updated.append(item_id)
+        return updated
+
+    def update_items(self, user_id: int,
+                     items: Iterable[Tuple[int, str]]) -> List[int]:
+        """Replace the content of the given `(note_id, content)` of the
+        user in a single transaction. Return the ids of the notes
+        updated."""
+
+        conn = self.storage.library(user_id)
+        self.cold_tier(conn)
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            updated = self.write_items(cur, user_id, items)
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            error_message = "An operational error prevented the edition."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            conn.commit()
+            return updated
+
+    def transform_items(self, user_id: int, item_ids: Iterable[int],
+                        transform: Callable[[str], str]) -> Dict[int, str]:
+        """Pass the content of the given notes of the user through
+        `transform` and save those it changes, in a single transaction.
+        Return the new content of the notes changed.
+
+        Notes are read within the transaction, so no other connection
+        writes them in between."""
+
+        item_ids = list(item_ids)
+        conn = self.storage.library(user_id)
+        column = self.content_column(conn)
+        cur = conn.cursor()
+        changed = {}
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            for start in range(0, len(item_ids), BULK_CHUNK):
+                chunk = item_ids[start:start + BULK_CHUNK]
+                cur.execute(f"""SELECT note_id, {column} FROM library
+                                WHERE user_id=? AND note_id IN
+                                      ({", ".join("?" * len(chunk))})""",
+                            (user_id, *chunk))
+                for item_id, content in cur.fetchall():
+                    new_content = transform(content)
+                    if new_content != content:
+                        changed[item_id] = new_content
+            self.write_items(cur, user_id, changed.items())
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            error_message = "An operational error prevented the edition."
+            raise exceptions.DatabaseError(error_message, e)
+        except Exception:
+            # Raised by `transform`
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+            return changed
+
+    def release_missing_owners(self, batch_size: int) -> int:
+        """Set to NULL the owner of notes in shards whose user no longer
+        exists, left by a `delete_user` interrupted between the main
+        database and the shard. Return the number of notes released.
+
+        Owners are checked against `users` `batch_size` at a time. Notes
+        in the main database are orphaned by the foreign key instead."""
+
+        if self.storage.shared:
+            return 0
+
+        stmt_owners = """SELECT DISTINCT user_id FROM library
+                                WHERE user_id > ?
+                                ORDER BY user_id
+                                LIMIT ?"""
+        released = 0
+        for conn in self.storage.connections():
+            after = 0
+            while True:
+                try:
+                    owners = [row[0] for row in conn.execute(
+                        stmt_owners, (after, batch_size))]
+                    if not owners:
+                        break
+                    marks = ", ".join("?" * len(owners))
+                    existing = {row[0] for row in self.conn.execute(
+                        f"""SELECT user_id FROM users
+                                   WHERE user_id IN ({marks})""", owners)}
+                    missing = [owner for owner in owners
+                               if owner not in existing]
+                    if missing:
+                        marks = ", ".join("?" * len(missing))
+                        cur = conn.execute(
+                            f"""UPDATE library SET user_id=NULL
+                                               WHERE user_id IN ({marks})""",
+                            missing)
+                        released += cur.rowcount
+                except sqlite3.OperationalError as e:
+                    conn.rollback()
+                    error_message = ("An operational error prevented "
+                                     "checking the owners of notes.")
+                    raise exceptions.DatabaseError(error_message, e)
+                else:
+                    conn.commit()
+                after = owners[-1]
+
+        return released
+
+    def purge_orphaned_items(self, batch_size: int,
+                             archive: bool = False) -> Tuple[int, int]:
+        """Delete up to `batch_size` notes whose owner no longer exists.
+
+        If `archive` is set, notes are first copied into table `orphans`
+        of the attached archive database. Return the number of notes and
+        bytes of content removed."""
+
+        # Notes of users deleted before `foreign_keys` was enabled keep
+        # pointing to a missing `user_id` instead of NULL. In shards, see
+        # `release_missing_owners`
+        orphaned = "user_id IS NULL"
+        if self.storage.shared:
+            orphaned = """(user_id IS NULL OR
+                           user_id NOT IN (SELECT user_id FROM users))"""
+        stmt_select = f"""SELECT count(*), max(note_id),
+                                 total(length(CAST(content AS BLOB)))
+                          FROM (SELECT note_id, content FROM library
+                                WHERE {orphaned}
+                                ORDER BY note_id
+                                LIMIT ?)"""
+        stmt_archive = """INSERT INTO archive.orphans
+                          SELECT note_id, user_id, {}, creation,
+                                 last_update, ?
+                          FROM main.library
+                                 WHERE note_id <= ? AND {}"""
+        stmt_delete = f"""DELETE FROM library
+                                 WHERE note_id <= ? AND {orphaned}"""
+
+        for conn in self.storage.connections():
+            column = self.content_column(conn)
+            cur = conn.cursor()
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+                cur.execute(stmt_select, (batch_size,))
+                num_rows, last_id, num_bytes = cur.fetchone()
+                if num_rows:
+                    if archive:
+                        # Ids of notes in different shards may repeat
+                        cur.execute("""
+                            CREATE TABLE IF NOT EXISTS archive.orphans (
+                                note_id     INTEGER NOT NULL,
+                                user_id     INTEGER,
+                                content     TEXT    NOT NULL,
+                                creation    REAL    NOT NULL,
+                                last_update REAL    NOT NULL,
+                                archived    REAL    NOT NULL
+                            )""")
+                        cur.execute(stmt_archive.format(column, orphaned),
+                                    (time.time(), last_id))
+                    cur.execute(stmt_delete, (last_id,))
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                error_message = "An operational error prevented the deletion."
+                raise exceptions.DatabaseError(error_message, e)
+            else:
+                conn.commit()
+                if num_rows:
+                    return num_rows, int(num_bytes)
+
+        return 0, 0
+
+    def archive_items(self, older_than: Timestamp,
+                      batch_size: int) -> Tuple[int, int]:
+        """Move the content of up to `batch_size` notes not updated since
+        `older_than` into the cold database. Return the number of notes and
+        bytes of content moved.
+
+        Archived notes keep their row in `library`, so they are still
+        listed and found by tag or link, and their content is read from
+        the cold database. Editing one makes it hot again."""
+
+        if self.name == MEMORY:
+            raise ValueError("in-memory databases cannot archive notes")
+
+        # Oldest first, once their derived columns are filled
+        batch = """SELECT note_id FROM main.library
+                   WHERE archived = 0 AND last_update < ?
+                         AND title IS NOT NULL
+                   ORDER BY last_update
+                   LIMIT ?"""
+        stmt_select = f"""SELECT count(*),
+                                 total(length(CAST(content AS BLOB)))
+                          FROM main.library
+                          WHERE note_id IN ({batch})"""
+        stmt_copy = f"""INSERT OR REPLACE INTO cold.archived_notes
+                        SELECT note_id, content, ?
+                        FROM main.library
+                        WHERE note_id IN ({batch})"""
+        stmt_update = f"""UPDATE main.library SET content='', archived=1
+                                              WHERE note_id IN ({batch})"""
+        params = (older_than, batch_size)
+
+        for conn in self.storage.connections():
+            self.cold_tier(conn, create=True)
+            cur = conn.cursor()
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+                cur.execute(stmt_select, params)
+                num_rows, num_bytes = cur.fetchone()
+                if num_rows:
+                    cur.execute(stmt_copy, (time.time(), *params))
+                    cur.execute(stmt_update, params)
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                error_message = "An operational error prevented archiving."
+                raise exceptions.DatabaseError(error_message, e)
+            else:
+                conn.commit()
+                if num_rows:
+                    return num_rows, int(num_bytes)
+
+        return 0, 0
+
+    # =====  `Attachments` table methods  =================================
+    def add_attachment(self, user_id: int, note_id: int, source: BinaryIO,
+                       size: int, name: str) -> Optional[int]:
+        """Stream `size` bytes of `source` into a new attachment of the
+        given note and return its id.
+
+        Return `None` if the user has no such note."""
+
+        stmt_note = """SELECT 1 FROM library
+                                WHERE user_id=? AND note_id=?"""
+        stmt_insert = """INSERT INTO attachments
+                                VALUES (NULL, ?, ?, ?, '', zeroblob(?))"""
+        stmt_hash = """UPDATE attachments SET hash=?
+                                          WHERE attachment_id=?"""
+        conn = self.storage.library(user_id)
+        cur = conn.cursor()
+        digest = hashlib.sha256()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            cur.execute(stmt_note, (user_id, note_id))
+            if not cur.fetchone():
+                conn.rollback()
+                return None
+
+            cur.execute(stmt_insert, (note_id, name, size, size))
+            attachment_id = cur.lastrowid
+            copy_to_blob(conn, "attachments", "data", attachment_id,
+                         source, size, digest)
+            cur.execute(stmt_hash, (digest.hexdigest(), attachment_id))
+        except (sqlite3.OperationalError, sqlite3.IntegrityError,
+                EOFError) as e:
+            conn.rollback()
+            error_message = "An operational error prevented the insertion."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            conn.commit()
+            return attachment_id
+
+    def get_attachment(self, user_id: int,
+                       attachment_id: int) -> Optional[Attachment]:
+        """Return the given attachment, without its data, or `None` if the
+        user has no such attachment."""
+
+        stmt = """SELECT attachment_id, attachments.note_id, name, size, hash
+                  FROM attachments JOIN library
+                       ON library.note_id = attachments.note_id
+                  WHERE user_id=? AND attachment_id=?"""
+        conn = self.storage.library(user_id)
+        try:
+            return conn.execute(stmt, (user_id, attachment_id)).fetchone()
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `attachments`."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def get_attachments(self, user_id: int,
+                        note_id: int) -> List[Attachment]:
+        """Return the attachments of the given note, without their data."""
+
+        stmt = """SELECT attachment_id, attachments.note_id, name, size, hash
+                  FROM attachments JOIN library
+                       ON library.note_id = attachments.note_id
+                  WHERE user_id=? AND attachments.note_id=?
+                  ORDER BY attachment_id"""
+        conn = self.storage.library(user_id)
+        try:
+            return conn.execute(stmt, (user_id, note_id)).fetchall()
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `attachments`."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def open_attachment(self, user_id: int,
+                        attachment_id: int) -> Optional[BinaryIO]:
+        """Return a read-only file object over the data of the given
+        attachment, to be closed by the caller. Return `None` if the user
+        has no such attachment."""
+
+        if not self.get_attachment(user_id, attachment_id):
+            return None
+        conn = self.storage.library(user_id)
+        try:
+            return open_blob(conn, "attachments", "data", attachment_id)
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `attachments`."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def export_attachment(self, user_id: int, attachment_id: int,
+                          target: BinaryIO) -> Optional[int]:
+        """Stream the data of the given attachment into `target`. Return
+        the number of bytes, or `None` if the user has no such
+        attachment."""
+
+        if not self.get_attachment(user_id, attachment_id):
+            return None
+        conn = self.storage.library(user_id)
+        try:
+            return copy_from_blob(conn, "attachments", "data",
+                                  attachment_id, target)
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `attachments`."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def delete_attachment(self, user_id: int, attachment_id: int) -> bool:
+        """Delete the given attachment.
+
+        Return `False` if the user has no such attachment."""
+
+        stmt = """DELETE FROM attachments
+                         WHERE attachment_id=? AND note_id IN (
+                               SELECT note_id FROM library
+                                              WHERE user_id=?)"""
+        conn = self.storage.library(user_id)
+        cur = conn.cursor()
+        try:
+            cur.execute(stmt, (attachment_id, user_id))
+        except sqlite3.OperationalError as e:
+            error_message = "An operational error prevented the deletion."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            conn.commit()
+            return cur.rowcount > 0
+
+    def get_attachment_hashes(self) -> Set[str]:
+        """Return the hashes of the attachments of all the notes."""
+
+        stmt = "SELECT DISTINCT hash FROM attachments"
+        try:
+            return {row[0] for conn in self.storage.connections()
+                    for row in conn.execute(stmt)}
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `attachments`."
+            raise exceptions.DatabaseError(error_message, e)
+
+    # =====  Sync methods  ================================================
+    def get_replica_id(self) -> str:
+        """Return the id of this copy of the database, see `db.sync`."""
+
+        replica_id = self.get_storage_setting("replica_id")
+        if replica_id is None:
+            replica_id = self.reset_replica_id()
+        return replica_id
+
+    def reset_replica_id(self) -> str:
+        """Give this copy of the database a new id, e.g. after copying the
+        file of another one. Return it."""
+
+        replica_id = uuid.uuid4().hex
+        self.set_storage_setting("replica_id", replica_id)
+        return replica_id
+
+    def get_user_changes(self, since: int, limit: int) -> List[UserChange]:
+        """Return up to `limit` users changed after the change `since`."""
+
+        stmt = """SELECT seq, coalesce(users.guid, users_changes.guid),
+                         deleted, coalesce(users.updated, changed, 0),
+                         username, password, name, avatar_id
+                  FROM users_changes LEFT JOIN users
+                       ON users_changes.user_id = users.user_id
+                  WHERE seq>?
+                  ORDER BY seq
+                  LIMIT ?"""
+        try:
+            return self.conn.execute(stmt, (since, limit)).fetchall()
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `users_changes`."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def get_note_changes(self, feed: int, since: int,
+                         limit: int) -> List[NoteSync]:
+        """Return up to `limit` notes changed after the change `since`, in
+        the `feed`-th database holding notes."""
+
+        conn = self.storage.connections()[feed]
+        stmt = f"""SELECT seq, coalesce(library.guid, library_changes.guid),
+                          deleted, coalesce(last_update, changed, 0),
+                          library.user_id, {self.content_column(conn)},
+                          creation, last_update
+                   FROM library_changes LEFT JOIN library
+                        ON library_changes.note_id = library.note_id
+                   WHERE seq>?
+                   ORDER BY seq
+                   LIMIT ?"""
+        try:
+            return conn.execute(stmt, (since, limit)).fetchall()
+        except sqlite3.OperationalError as e:
+            error_message = ("Cannot retrieve data from table "
+                             "`library_changes`.")
+            raise exceptions.DatabaseError(error_message, e)
+
+    def get_user_keys(self, user_ids: Iterable[int]
+                      ) -> Dict[int, Tuple[str, str]]:
+        """Return the `guid` and username of the given users."""
+
+        user_ids = list(user_ids)
+        stmt = f"""SELECT user_id, guid, username FROM users
+                   WHERE user_id IN ({", ".join("?" * len(user_ids))})"""
+        try:
+            return {user_id: (guid, username) for user_id, guid, username
+                    in self.conn.execute(stmt, user_ids)}
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `users`."
+            raise exceptions.DatabaseError(error_message, e)
+
+    def find_user(self, guid: str, username: str) -> Optional[int]:
+        """Return the id of the user with the given `guid`, or else the
+        given username, `None` if there is none."""
+
+        stmt = """SELECT user_id FROM users
+                                 WHERE guid=? OR username=?
+                                 ORDER BY guid=? DESC
+                                 LIMIT 1"""
+        try:
+            row = self.conn.execute(stmt, (guid, username, guid)).fetchone()
+        except sqlite3.OperationalError as e:
+            error_message = "Cannot retrieve data from table `users`."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            return row[0] if row else None
+
+    def apply_user_change(self, change: UserChange,
+                          avatar: Optional[AvatarImages] = None) -> bool:
+        """Bring a user in line with a change from another database, if
+        the change is the latest one. Return `True` if applied.
+
+        Users are matched by `guid`, then by username: accounts created
+        with the same username in both databases become one, keeping the
+        lowest `guid`. Ties are broken by comparing the values, so every
+        database picks the same version."""
+
+        _, guid, deleted, changed, username, password, name, _ = change
+        stmt_find = """SELECT user_id, guid, coalesce(updated, 0), username,
+                              password, name
+                       FROM users
+                       WHERE guid=? OR username=?
+                       ORDER BY guid=? DESC
+                       LIMIT 1"""
+        stmt_insert = """INSERT INTO users (username, password, name,
+                                            avatar_id, guid, updated)
+                                VALUES (?, ?, ?, ?, ?, ?)"""
+        stmt_update = """UPDATE users SET username=?, password=?, name=?,
+                                          avatar_id=?, updated=?
+                                      WHERE user_id=?"""
+        cur = self.conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            cur.execute(stmt_find, (guid, None if deleted else username,
+                                    guid))
+            local = cur.fetchone()
+            applied = False
+            if deleted:
+                if local and local[1] == guid and local[2] <= changed:
+                    cur.execute("DELETE FROM users WHERE user_id=?",
+                                (local[0],))
+                    applied = True
+            elif local is None:
+                avatar_id = self.write_avatar(cur, *avatar) if avatar else 0
+                cur.execute(stmt_insert, (username, password, name,
+                                          avatar_id, guid, changed))
+                applied = True
+            else:
+                if guid < local[1]:
+                    cur.execute("UPDATE users SET guid=? WHERE user_id=?",
+                                (guid, local[0]))
+                if (changed, username, password, name) > local[2:]:
+                    avatar_id = (self.write_avatar(cur, *avatar) if avatar
+                                 else 0)
+                    cur.execute(stmt_update, (username, password, name,
+                                              avatar_id, changed, local[0]))
+                    applied = True
+        except sqlite3.IntegrityError:
+            # Renamed to a username another user has here
+            self.conn.rollback()
+            return False
+        except sqlite3.OperationalError as e:
+            self.conn.rollback()
+            error_message = "An operational error prevented the sync."
+            raise exceptions.DatabaseError(error_message, e)
         else:
             self.conn.commit()
+
+        # Done by the foreign key when notes live in the same database
+        if deleted and applied and not self.storage.shared:
+            conn = self.storage.library(local[0])
+            try:
+                conn.execute("UPDATE library SET user_id=NULL "
+                             "WHERE user_id=?", (local[0],))
+            except sqlite3.OperationalError as e:
+                error_message = "An operational error prevented the sync."
+                raise exceptions.DatabaseError(error_message, e)
+            else:
+                conn.commit()
+        return applied
+
+    def apply_note_changes(self, user_id: int,
+                           notes: Iterable[SyncedNote]) -> Tuple[int, int]:
+        """Add or update notes of the user from another database, in a
+        single transaction. Return the number of notes applied and
+        skipped.
+
+        Notes are matched by `guid`, the one updated last wins and ties
+        are broken by content hash, so every database keeps the same.
+        Notes deleted here after their last update stay deleted."""
+
+        stmt_find = """SELECT note_id, last_update, coalesce(content_hash, '')
+                       FROM library
+                       WHERE guid=?"""
+        stmt_deleted = """SELECT 1 FROM library_changes
+                                   WHERE guid=? AND deleted = 1
+                                         AND changed>=?"""
+        stmt_insert = """INSERT INTO library (user_id, guid, content,
+                                              creation, last_update,
+                                              content_hash, title,
+                                              plain_preview)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+        stmt_update = """UPDATE library SET user_id=?, content=?,
+                                            creation=?, last_update=?,
+                                            content_hash=?, title=?,
+                                            plain_preview=?, archived=0
+                                        WHERE note_id=?"""
+        applied, skipped = 0, 0
+        conn = self.storage.library(user_id)
+        self.cold_tier(conn)
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            for guid, content, creation, last_update in notes:
+                derived = derived_columns(content)
+                cur.execute(stmt_find, (guid,))
+                local = cur.fetchone()
+                if local is None:
+                    # Deleted here after that version
+                    cur.execute(stmt_deleted, (guid, last_update))
+                    if cur.fetchone():
+                        skipped += 1
+                        continue
+                    cur.execute(stmt_insert, (user_id, guid, content,
+                                              creation, last_update,
+                                              *derived))
+                    note_id = cur.lastrowid
+                elif (last_update, derived[0]) > local[1:]:
+                    note_id = local[0]
+                    cur.execute(stmt_update, (user_id, content, creation,
+                                              last_update, *derived,
+                                              note_id))
+                else:
+                    skipped += 1
+                    continue
+                self.index_references(cur, note_id, content)
+                applied += 1
+        except (sqlite3.OperationalError, sqlite3.IntegrityError) as e:
+            conn.rollback()
+            error_message = "An operational error prevented the sync."
+            raise exceptions.DatabaseError(error_message, e)
+        else:
+            conn.commit()
+            return applied, skipped
+
+    def apply_note_deletions(self, deletions: Iterable[Tuple[str, Timestamp]]
+                             ) -> int:
+        """Delete the notes with the given `guid`, unless updated after
+        the given time. Return the number of notes deleted."""
+
+        stmt = """DELETE FROM library
+                         WHERE guid=? AND last_update<=?"""
+        deletions = list(deletions)
+        deleted = 0
+        for conn in self.storage.connections():
+            self.cold_tier(conn)
+            cur = conn.cursor()
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+                for params in deletions:
+                    cur.execute(stmt, params)
+                    deleted += cur.rowcount
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                error_message = "An operational error prevented the sync."
+                raise exceptions.DatabaseError(error_message, e)
+            else:
+                conn.commit()
+        return deleted
@@ -1,24 +1,93 @@
 """Helper functions to start and close database connections."""
 import time
+import random
 import logging
+import sqlite3
+from typing import Callable, Dict, Optional, Tuple
 
-from db import dbhelper
+from db import dbhelper, storage, maintenance, profiles
 from utils import exceptions
 
+logger = logging.getLogger(__name__)
 
-def connect_to_database(database: str) -> dbhelper.DBHelper:
-    """Connect to the given database."""
-    while True:
+# Called with (attempt, delay in seconds, error message) before retrying
+RetryCallback = Callable[[int, float, str], None]
+
+# Attempts to bring up the database before giving up
+RETRY_ATTEMPTS = 8
+
+# Errors of the driver worth retrying, the database may become available
+TRANSIENT_ERRORS = ("database is locked", "database table is locked",
+                    "database is busy", "unable to open database")
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """Exponential backoff with jitter for the given attempt (from 1)."""
+    delay = min(cap, base * 2 ** (attempt - 1))
+
+    # Randomize half of the delay so several instances don't retry in sync
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def is_transient(error: exceptions.DatabaseError) -> bool:
+    """Return `True` if the error may go away by retrying, e.g. the
+    database is locked by another connection or cannot be opened yet."""
+    cause = error.error
+    return (isinstance(cause, sqlite3.OperationalError)
+            and str(cause).startswith(TRANSIENT_ERRORS))
+
+
+def retry_delay(attempt: int, attempts: int,
+                error: exceptions.DatabaseError,
+                on_retry: Optional[RetryCallback] = None) -> float:
+    """Return how long to wait before retrying after the given error.
+
+    Raise it again if it is not transient, or it was the last attempt."""
+    if not is_transient(error) or attempt == attempts:
+        logger.critical(error.message)
+        raise error
+
+    delay = backoff_delay(attempt)
+    logger.critical("%s Retrying in %.1f s.", error.message, delay)
+    if on_retry:
+        on_retry(attempt, delay, error.message)
+    return delay
+
+
+def connect_to_database(database: str, busy_timeout: float = 5.0,
+                        check_same_thread: bool = True,
+                        on_retry: Optional[RetryCallback] = None,
+                        shards: int = 0,
+                        profile: str = profiles.DEFAULT_PROFILE,
+                        snapshot: Optional[str] = None,
+                        content_budget: Optional[int] = None,
+                        attempts: int = RETRY_ATTEMPTS
+                        ) -> dbhelper.DBHelper:
+    """Connect to the given database, retrying up to `attempts` times
+    while it is locked or unavailable. Raise `DatabaseError` if it never
+    becomes available, or on any other error.
+
+    Notes are spread among `shards` database files, if given. An
+    in-memory database starts as a copy of `snapshot`, if given."""
+    for attempt in range(1, attempts + 1):
         try:
-            db = dbhelper.DBHelper(database)
+            db = dbhelper.DBHelper(database, busy_timeout,
+                                   check_same_thread,
+                                   storage.make_backend(shards), profile,
+                                   content_budget)
         except exceptions.DatabaseError as e:
-            logging.critical(e.message)
-
-            # Try to reconnect after 2 seconds
-            time.sleep(2)
+            time.sleep(retry_delay(attempt, attempts, e, on_retry))
             continue
         break
-    logging.info(f"Connected to `{database}`.")
+    logger.info("Connected to `%s`.", database)
+
+    if snapshot:
+        try:
+            db.load_snapshot(snapshot)
+        except exceptions.DatabaseError as e:
+            logger.critical(e.message)
+        else:
+            logger.info("Loaded snapshot `%s`.", snapshot)
     return db
 
 
@@ -27,19 +96,88 @@ def setup_database(db: dbhelper.DBHelper):
     try:
         db.setup()
     except exceptions.DatabaseError as e:
-        logging.critical(e.message)
+        logger.critical(e.message)
+    else:
+        migrate_data(db)
+
+
+def migrate_data(db: dbhelper.DBHelper):
+    """Move data kept by older versions into the database."""
+    try:
+        maintenance.migrate_avatar_files(db)
+    except exceptions.DatabaseError as e:
+        logger.warning(e.message)
+
+
+def bring_up_database(database: str,
+                      on_retry: Optional[RetryCallback] = None,
+                      shards: int = 0,
+                      profile: str = profiles.DEFAULT_PROFILE,
+                      snapshot: Optional[str] = None,
+                      content_budget: Optional[int] = None,
+                      attempts: int = RETRY_ATTEMPTS
+                      ) -> Tuple[dbhelper.DBHelper, Dict[str, float]]:
+    """Connect to the database and create its structure, retrying with
+    backoff while it is locked or unavailable. Raise `DatabaseError` if
+    it never becomes available, or on any other error, e.g. a failed
+    migration.
+
+    Meant to run outside the GUI thread: the connection returned can be
+    handed over to another thread. Timings are given in milliseconds."""
+    start = time.perf_counter()
+    db = connect_to_database(database, check_same_thread=False,
+                             on_retry=on_retry, shards=shards,
+                             profile=profile, snapshot=snapshot,
+                             content_budget=content_budget,
+                             attempts=attempts)
+    connected = time.perf_counter()
+
+    for attempt in range(1, attempts + 1):
+        try:
+            db.setup()
+        except exceptions.DatabaseError as e:
+            try:
+                delay = retry_delay(attempt, attempts, e, on_retry)
+            except exceptions.DatabaseError:
+                close_database_connection(db, attempts=1)
+                raise
+            time.sleep(delay)
+            continue
+        break
+    migrate_data(db)
+    ready = time.perf_counter()
+
+    timings = {"connect": (connected - start) * 1000,
+               "setup": (ready - connected) * 1000,
+               "total": (ready - start) * 1000}
+    logger.info("Database ready in %.0f ms (connect %.0f ms, setup %.0f ms).",
+                timings["total"], timings["connect"], timings["setup"])
+    return db, timings
+
+
+def save_snapshot(db: dbhelper.DBHelper, name: str):
+    """Copy the database to the given file, e.g. before closing an
+    in-memory database."""
+    try:
+        db.save_snapshot(name)
+    except exceptions.DatabaseError as e:
+        logger.critical(e.message)
+    else:
+        logger.info("Saved snapshot `%s`.", name)
 
 
-def close_database_connection(db: dbhelper.DBHelper):
+def close_database_connection(db: dbhelper.DBHelper, attempts: int = 5):
     """Close connection with the database."""
-    while True:
+    for attempt in range(1, attempts + 1):
         try:
-            db.conn.close()
+            db.close()
         except exceptions.DatabaseError as e:
-            logging.critical(e.message)
+            logger.critical(e.message)
+            if attempt == attempts:
+                return
 
-            # Try to disconnect again after 2 seconds
-            time.sleep(2)
+            # Try to disconnect again after a while
+            time.sleep(backoff_delay(attempt))
             continue
         break
-    logging.info(f"Disconnected from `{db.name}`.")
+    logger.info("Disconnected from `%s`.", db.name)
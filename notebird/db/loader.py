@@ -0,0 +1,100 @@
+"""Background bring-up of the database, keeping the GUI responsive."""
+import logging
+import threading
+from typing import Optional
+
+from PySide2 import QtCore
+
+from db import dbhelper, helpers, maintenance, profiles
+from utils import exceptions
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseLoader(QtCore.QObject):
+    """Connect to the database and create its structure in a daemon
+    thread, so closing the app never waits for a database that is down.
+
+    Once ready, the same thread fills the derived columns of notes
+    written by older versions, batch by batch, until done or `stop`.
+
+    Signals:
+        status -- progress message to display.
+        ready -- connected `DBHelper` and timings of the bring-up.
+        failed -- message of the error that kept the database down."""
+
+    status = QtCore.Signal(str)
+    ready = QtCore.Signal(object, dict)
+    failed = QtCore.Signal(str)
+
+    def __init__(self, name: str, shards: int = 0,
+                 profile: str = profiles.DEFAULT_PROFILE,
+                 snapshot: Optional[str] = None,
+                 content_budget: Optional[int] = None,
+                 parent: QtCore.QObject = None):
+        super().__init__(parent)
+        self.name = name
+        self.shards = shards
+        self.profile = profile
+        self.snapshot = snapshot
+        self.content_budget = content_budget
+        self.database = None
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Return `True` if the bring-up finished within `timeout` s."""
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def stop(self):
+        """Stop the backfill after the batch in progress."""
+        self.stopping.set()
+
+    def run(self):
+        self.status.emit("Connecting to database...")
+        try:
+            self.database, timings = helpers.bring_up_database(
+                self.name, on_retry=self.report_retry, shards=self.shards,
+                profile=self.profile, snapshot=self.snapshot,
+                content_budget=self.content_budget)
+        except exceptions.DatabaseError as e:
+            self.failed.emit(e.message)
+            return
+
+        # The GUI uses the connection of an in-memory database, there is
+        # no other one to fill it from
+        if self.name == dbhelper.MEMORY:
+            self.backfill(self.database)
+            self.ready.emit(self.database, timings)
+            return
+
+        self.ready.emit(self.database, timings)
+        try:
+            db = helpers.connect_to_database(self.name, shards=self.shards,
+                                             profile=self.profile)
+        except exceptions.DatabaseError:
+            return
+        try:
+            self.backfill(db)
+        finally:
+            db.close()
+
+    def backfill(self, db: dbhelper.DBHelper):
+        try:
+            if maintenance.fill_derived_columns(
+                    db, on_progress=self.report_backfill,
+                    stop=self.stopping):
+                self.status.emit("Notes indexed.")
+        except exceptions.DatabaseError as e:
+            logger.warning(e.message)
+
+    def report_backfill(self, done: int, total: int):
+        self.status.emit(f"Indexing notes... {done}/{total}")
+
+    def report_retry(self, attempt: int, delay: float, message: str):
+        self.status.emit(f"Database unavailable, retrying in {delay:.0f} s "
+                         f"(attempt {attempt}).")
@@ -0,0 +1,207 @@
+"""Load test of the database layer with many concurrent sessions.
+
+Each worker, a thread or a process, has its own connection and user, and
+runs a random mix of operations. Latencies, throughput and lock errors
+(`database is locked`) are collected so locking modes and pragmas can be
+compared with real numbers."""
+import json
+import time
+import random
+import logging
+import tempfile
+import threading
+import multiprocessing
+from pathlib import Path
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional
+
+from db import dbhelper, profiles, storage
+from utils import exceptions
+from utils.stats import percentile
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = ["login", "add", "update", "read", "delete"]
+DEFAULT_MIX = {"login": 1, "add": 3, "update": 3, "read": 2, "delete": 1}
+
+
+class Sample(NamedTuple):
+    """Outcome of a single operation."""
+    operation: str
+    latency: float
+    error: Optional[str]
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    """Parse `login=1,add=3,...` into weights of each operation."""
+    mix = {}
+    for item in value.split(","):
+        operation, _, weight = item.partition("=")
+        if operation not in OPERATIONS or not weight.isdigit():
+            raise ValueError(f"invalid operation weight `{item}`")
+        mix[operation] = int(weight)
+    if not any(mix.values()):
+        raise ValueError("at least one operation needs a weight above 0")
+    return mix
+
+
+def error_kind(error: exceptions.DatabaseError) -> str:
+    """Tell lock contention apart from other database errors."""
+    cause = str(error.error or "")
+    return "locked" if "locked" in cause or "busy" in cause else "other"
+
+
+def run_worker(name: str, shards: int, busy_timeout: float, user: tuple,
+               operations: int, mix: Dict[str, int], seed: int,
+               profile: str = profiles.DEFAULT_PROFILE) -> List[Sample]:
+    """Run `operations` random operations as the given user."""
+    rand = random.Random(seed)
+    db = dbhelper.DBHelper(name, busy_timeout,
+                           storage=storage.make_backend(shards),
+                           profile=profile)
+    user_id, username, password = user
+    choices = [op for op in OPERATIONS for _ in range(mix.get(op, 0))]
+    note_ids = []
+    samples = []
+
+    for _ in range(operations):
+        operation = rand.choice(choices)
+        # Nothing to edit yet
+        if operation in ("update", "delete") and not note_ids:
+            operation = "add"
+
+        error = None
+        start = time.perf_counter()
+        try:
+            if operation == "login":
+                db.login(username, password)
+            elif operation == "add":
+                note_ids.append(db.add_item(
+                    user_id, f"Load test note {rand.random()}"))
+            elif operation == "update":
+                db.update_item(user_id, rand.choice(note_ids),
+                               f"Updated note {rand.random()}")
+            elif operation == "read":
+                db.get_user_info(user_id)
+            else:
+                db.delete_item(user_id, note_ids.pop(
+                    rand.randrange(len(note_ids))))
+        except exceptions.DatabaseError as e:
+            error = error_kind(e)
+        samples.append(Sample(operation, time.perf_counter() - start, error))
+
+    db.close()
+    return samples
+
+
+def summarize(samples: List[Sample], elapsed: float, settings: dict) -> dict:
+    """Aggregate the samples of every worker."""
+    by_operation = defaultdict(list)
+    for sample in samples:
+        by_operation[sample.operation].append(sample)
+
+    operations = {}
+    for operation, op_samples in sorted(by_operation.items()):
+        latencies = [sample.latency * 1000 for sample in op_samples]
+        operations[operation] = {
+            "count": len(op_samples),
+            "locked": sum(s.error == "locked" for s in op_samples),
+            "errors": sum(s.error == "other" for s in op_samples),
+            "p50_ms": percentile(latencies, 50),
+            "p90_ms": percentile(latencies, 90),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": max(latencies)}
+
+    return {"settings": settings,
+            "elapsed_s": elapsed,
+            "operations_total": len(samples),
+            "throughput_ops": len(samples) / elapsed if elapsed else 0.0,
+            "locked_total": sum(s.error == "locked" for s in samples),
+            "errors_total": sum(s.error == "other" for s in samples),
+            "operations": operations}
+
+
+def format_table(result: dict) -> str:
+    """Human readable summary of a load test."""
+    lines = [f"{result['operations_total']} operations in "
+             f"{result['elapsed_s']:.2f} s: "
+             f"{result['throughput_ops']:.0f} ops/s, "
+             f"{result['locked_total']} locked, "
+             f"{result['errors_total']} other errors",
+             f"{'operation':>10} {'count':>7} {'locked':>7} {'p50 ms':>8} "
+             f"{'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}"]
+    for operation, stats in result["operations"].items():
+        lines.append(f"{operation:>10} {stats['count']:>7} "
+                     f"{stats['locked']:>7} {stats['p50_ms']:>8.2f} "
+                     f"{stats['p90_ms']:>8.2f} {stats['p99_ms']:>8.2f} "
+                     f"{stats['max_ms']:>8.2f}")
+    return "\n".join(lines)
+
+
+def run_load_test(name: Optional[str] = None, workers: int = 8,
+                  operations: int = 200, mix: Dict[str, int] = DEFAULT_MIX,
+                  processes: bool = False, shards: int = 0,
+                  busy_timeout: float = 5.0, seed: int = 0,
+                  profile: str = profiles.DEFAULT_PROFILE) -> dict:
+    """Run the load test against the given database, or a temporary one.
+
+    A user is created for each worker. Errors of the workers other than
+    those of the database are raised once all of them finish."""
+    if not any(mix.values()):
+        raise ValueError("at least one operation needs a weight above 0")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        name = name or str(Path(tmp) / "loadtest.sqlite3")
+        db = dbhelper.DBHelper(name, busy_timeout,
+                               storage=storage.make_backend(shards),
+                               profile=profile)
+        db.setup()
+        stamp = int(time.time())
+        accounts = [(f"load{stamp}_{i:04}", f"password{i}", "Load Test")
+                    for i in range(workers)]
+        db.create_users(accounts)
+        users = [(db.login(username, password), username, password)
+                 for username, password, _ in accounts]
+        db.close()
+
+        args = [(name, shards, busy_timeout, user, operations, mix,
+                 seed + number, profile)
+                for number, user in enumerate(users)]
+        logger.info("Load test with %d %s on `%s`.", workers,
+                    "processes" if processes else "threads", name)
+
+        start = time.perf_counter()
+        if processes:
+            with multiprocessing.Pool(workers) as pool:
+                results = pool.starmap(run_worker, args)
+        else:
+            results = [None] * workers
+            failures = []
+
+            def run(number):
+                try:
+                    results[number] = run_worker(*args[number])
+                except Exception as e:
+                    failures.append(e)
+
+            threads = [threading.Thread(target=run, args=(number,))
+                       for number in range(workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if failures:
+                raise failures[0]
+        elapsed = time.perf_counter() - start
+
+    settings = {"workers": workers, "operations": operations, "mix": mix,
+                "processes": processes, "shards": shards,
+                "busy_timeout": busy_timeout, "profile": profile}
+    return summarize([sample for samples in results for sample in samples],
+                     elapsed, settings)
+
+
+def save_result(result: dict, path: str):
+    """Write the result as JSON."""
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
@@ -0,0 +1,247 @@
+"""Maintenance jobs to reclaim space left behind by deleted accounts and
+to bring data kept by older versions up to date."""
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, NamedTuple, Optional
+
+from db import dbhelper
+from utils import consts, exceptions, images, thumbnails
+
+logger = logging.getLogger(__name__)
+
+# Called with the number of notes filled so far and the total to fill
+ProgressCallback = Callable[[int, int], None]
+# Days deleted notes are kept in the feed of changes, for other instances
+# and copies that did not sync yet
+TOMBSTONE_DAYS = 90
+
+
+class GCStats(NamedTuple):
+    """Metrics of a garbage collection run."""
+    notes: int = 0
+    note_bytes: int = 0
+    avatars: int = 0
+    avatar_bytes: int = 0
+    batches: int = 0
+    file_bytes: int = 0
+    tombstones: int = 0
+    previews: int = 0
+
+
+def collect_orphaned_notes(db: dbhelper.DBHelper, batch_size: int = 500,
+                           max_batches: Optional[int] = None,
+                           archive: Optional[str] = None) -> GCStats:
+    """Delete (or archive) notes whose owner no longer exists.
+
+    Every batch runs in its own transaction, so the database is never
+    locked for longer than it takes to remove `batch_size` notes."""
+
+    # Notes of users whose deletion did not reach their shard
+    released = db.release_missing_owners(batch_size)
+    if released:
+        logger.info("Released %d notes of missing users.", released)
+
+    notes, note_bytes, batches = 0, 0, 0
+    if archive:
+        db.attach_archive(archive)
+
+    try:
+        while max_batches is None or batches < max_batches:
+            num_rows, num_bytes = db.purge_orphaned_items(
+                batch_size, archive=bool(archive))
+            if not num_rows:
+                break
+            notes += num_rows
+            note_bytes += num_bytes
+            batches += 1
+            logger.debug("GC batch %d: %d notes, %d bytes.",
+                         batches, num_rows, num_bytes)
+    finally:
+        if archive:
+            db.detach_archive()
+
+    return GCStats(notes=notes, note_bytes=note_bytes, batches=batches)
+
+
+def migrate_avatar_files(db: dbhelper.DBHelper,
+                         path: Path = consts.AVATAR_PATH):
+    """Move the avatars saved as files by older versions into the
+    database, once. The files are removed after the import."""
+
+    if db.get_storage_setting("avatar_files"):
+        return
+
+    avatars = {}
+    for avatar_id in db.get_avatar_ids():
+        try:
+            avatars[avatar_id] = images.encode_avatar(
+                str(path / f"{avatar_id}.png"))
+        except (OSError, ValueError):
+            logger.warning("Avatar %d is missing or unreadable.", avatar_id)
+            avatars[avatar_id] = None
+    db.import_avatars(avatars)
+    logger.info("Imported %d avatar files into the database.",
+                sum(1 for encoded in avatars.values() if encoded))
+
+    for image in path.glob("*.png"):
+        # Never ever remove the default avatar (0.png)
+        if image.stem.isdigit() and int(image.stem) != 0:
+            try:
+                Path.unlink(image)
+            except FileNotFoundError:
+                continue
+
+
+class ArchiveStats(NamedTuple):
+    """Metrics of an archiving run."""
+    notes: int = 0
+    note_bytes: int = 0
+    batches: int = 0
+    file_bytes: int = 0
+
+
+def archive_old_notes(db: dbhelper.DBHelper, days: float,
+                      batch_size: int = 500,
+                      max_batches: Optional[int] = None,
+                      vacuum: bool = False) -> ArchiveStats:
+    """Move notes not updated for `days` days to the cold databases.
+
+    Every batch runs in its own transaction. With `vacuum`, the database
+    files are rebuilt afterwards and the difference in their size is
+    reported as `file_bytes`."""
+
+    older_than = time.time() - days * 24 * 3600
+    notes, note_bytes, batches = 0, 0, 0
+    while max_batches is None or batches < max_batches:
+        num_rows, num_bytes = db.archive_items(older_than, batch_size)
+        if not num_rows:
+            break
+        notes += num_rows
+        note_bytes += num_bytes
+        batches += 1
+        logger.debug("Archive batch %d: %d notes, %d bytes.",
+                     batches, num_rows, num_bytes)
+
+    file_bytes = 0
+    if vacuum and notes:
+        size_before = sum(map(os.path.getsize, db.storage.files()))
+        db.vacuum()
+        file_bytes = size_before - sum(map(os.path.getsize,
+                                           db.storage.files()))
+
+    logger.info("Archived %d notes (%d bytes) in %d batches.",
+                notes, note_bytes, batches)
+    return ArchiveStats(notes, note_bytes, batches, file_bytes)
+
+
+def fill_derived_columns(db: dbhelper.DBHelper, batch_size: int = 200,
+                         max_batches: Optional[int] = None,
+                         on_progress: Optional[ProgressCallback] = None,
+                         stop: Optional[threading.Event] = None) -> int:
+    """Compute the title, preview and hash of notes written by older
+    versions. Return the number of notes filled.
+
+    Every batch runs in its own transaction and only notes still empty
+    are picked, so the job can be stopped (by setting `stop`) between
+    batches and resumed by a later run."""
+
+    total = db.count_unfilled_items()
+    done, batches = 0, 0
+    while total and (max_batches is None or batches < max_batches):
+        if stop is not None and stop.is_set():
+            break
+        num_rows = db.fill_derived_columns(batch_size)
+        if not num_rows:
+            break
+        done += num_rows
+        batches += 1
+        if on_progress:
+            on_progress(done, total)
+
+    if done:
+        logger.info("Filled derived columns of %d of %d notes.", done, total)
+    return done
+
+
+def collect_orphaned_avatars(db: dbhelper.DBHelper) -> GCStats:
+    """Delete avatars not referenced by any existing user."""
+
+    avatars, avatar_bytes = db.purge_orphaned_avatars()
+    return GCStats(avatars=avatars, avatar_bytes=avatar_bytes)
+
+
+def collect_previews(db: dbhelper.DBHelper,
+                     path: Path = consts.PREVIEW_PATH) -> int:
+    """Delete the previews of images no note has anymore. Return the
+    number of files removed.
+
+    Previews of other database files sharing the folder are generated
+    again when shown. An in-memory database leaves them alone."""
+
+    if db.name == dbhelper.MEMORY:
+        return 0
+    return thumbnails.prune_previews(path, db.get_attachment_hashes())
+
+
+def prune_tombstones(db: dbhelper.DBHelper, days: float = TOMBSTONE_DAYS,
+                     batch_size: int = 500,
+                     max_batches: Optional[int] = None) -> int:
+    """Forget notes deleted more than `days` days ago from the feeds of
+    changes, a batch per transaction. Return the entries removed."""
+
+    older_than = time.time() - days * 24 * 3600
+    tombstones, batches = 0, 0
+    while max_batches is None or batches < max_batches:
+        num_rows = db.prune_tombstones(older_than, batch_size)
+        if not num_rows:
+            break
+        tombstones += num_rows
+        batches += 1
+    return tombstones
+
+
+def collect_garbage(db: dbhelper.DBHelper, batch_size: int = 500,
+                    max_batches: Optional[int] = None,
+                    archive: Optional[str] = None,
+                    vacuum: bool = False) -> GCStats:
+    """Maintenance hook: remove orphaned notes and avatars, old
+    tombstones of deleted notes, and previews of deleted images.
+
+    With `vacuum`, the database file is rebuilt afterwards and the
+    difference in its size is reported as `file_bytes`."""
+
+    notes = collect_orphaned_notes(db, batch_size, max_batches, archive)
+    avatars = collect_orphaned_avatars(db)
+    tombstones = prune_tombstones(db, batch_size=batch_size,
+                                  max_batches=max_batches)
+    previews = collect_previews(db)
+
+    file_bytes = 0
+    if vacuum and notes.notes:
+        size_before = sum(map(os.path.getsize, db.storage.files()))
+        db.vacuum()
+        file_bytes = size_before - sum(map(os.path.getsize,
+                                           db.storage.files()))
+
+    stats = notes._replace(avatars=avatars.avatars,
+                           avatar_bytes=avatars.avatar_bytes,
+                           file_bytes=file_bytes, tombstones=tombstones,
+                           previews=previews)
+    logger.info("GC reclaimed %d notes (%d bytes) in %d batches, "
+                "%d avatars (%d bytes) and %d previews, and pruned %d "
+                "tombstones.", stats.notes, stats.note_bytes, stats.batches,
+                stats.avatars, stats.avatar_bytes, stats.previews,
+                stats.tombstones)
+    return stats
+
+
+def run_maintenance(db: dbhelper.DBHelper):
+    """Bounded garbage collection, safe to run on every shutdown."""
+
+    try:
+        collect_garbage(db, max_batches=10)
+    except exceptions.DatabaseError as e:
+        logger.warning(e.message)
@@ -0,0 +1,77 @@
+"""Named sets of SQLite settings, trading durability for speed.
+
+- durable: SQLite defaults, rollback journal and a full sync on every
+  commit. Nothing committed is lost, even on power failure.
+- balanced: write-ahead log, synced at checkpoints only. A power failure
+  may lose the last commits, never corrupts the database.
+- fast: write-ahead log, never synced. An OS crash may corrupt the
+  database, meant for throwaway data and benchmarks.
+
+Unless one is chosen, connections use the settings of `durable` but keep
+the journal mode of the file, which another instance or the user may
+have switched to WAL."""
+import logging
+import sqlite3
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Profile(NamedTuple):
+    """Values of the pragmas set on every connection. The journal mode
+    is left as it is if `None`."""
+    journal_mode: Optional[str]
+    synchronous: str
+    # Negative values are KiB, positive ones pages
+    cache_size: int
+    # Bytes of the file read through memory-mapped I/O
+    mmap_size: int
+    temp_store: str
+
+
+PROFILES = {
+    "durable": Profile("DELETE", "FULL", -2000, 0, "DEFAULT"),
+    "balanced": Profile("WAL", "NORMAL", -16000, 64 * 1024**2, "MEMORY"),
+    "fast": Profile("WAL", "OFF", -64000, 256 * 1024**2, "MEMORY"),
+}
+DEFAULT_PROFILE = "default"
+PROFILES[DEFAULT_PROFILE] = PROFILES["durable"]._replace(journal_mode=None)
+
+
+def get_profile(name: str) -> Profile:
+    """Return the profile with the given name."""
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f"unknown profile `{name}`, choose from "
+                         f"{', '.join(PROFILES)}") from None
+
+
+def apply_profile(conn: sqlite3.Connection, profile: Profile) -> str:
+    """Set the pragmas of the profile, return the journal mode in use.
+
+    The journal mode is stored in the database file. Leaving WAL mode
+    needs every other connection to be closed, otherwise the database
+    keeps the mode it had."""
+    journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    if profile.journal_mode and journal_mode.upper() != profile.journal_mode:
+        # Don't wait for other instances to close, they may never do
+        busy_timeout = conn.execute("PRAGMA busy_timeout").fetchone()[0]
+        conn.execute("PRAGMA busy_timeout = 0")
+        try:
+            journal_mode = conn.execute(
+                f"PRAGMA journal_mode = {profile.journal_mode}"
+            ).fetchone()[0]
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            logger.info("Database in use, journal mode stays %s.",
+                        journal_mode)
+        finally:
+            conn.execute(f"PRAGMA busy_timeout = {busy_timeout:d}")
+
+    conn.execute(f"PRAGMA synchronous = {profile.synchronous}")
+    conn.execute(f"PRAGMA cache_size = {profile.cache_size:d}")
+    conn.execute(f"PRAGMA mmap_size = {profile.mmap_size:d}")
+    conn.execute(f"PRAGMA temp_store = {profile.temp_store}")
+    return journal_mode
@@ -0,0 +1,284 @@
+"""Headless service exposing the notes of the database as JSON requests.
+
+Clients send one JSON object per line, such as
+`{"id": 1, "op": "login", "username": "...", "password": "..."}`, and get
+back one line `{"id": 1, "ok": true, "result": ...}` or
+`{"id": 1, "ok": false, "error": "..."}`. Each connection is a session:
+after a successful `login`, note operations act on that user's notes."""
+import json
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from db import dbhelper, profiles, storage
+from utils import exceptions
+
+logger = logging.getLogger(__name__)
+
+# Longest request line accepted, notes may be big
+MAX_LINE = 16 * 1024 * 1024
+# Pending connections queued by the OS, many clients may connect at once
+BACKLOG = 1024
+
+
+class RequestError(Exception):
+    """Exception raised by malformed requests.
+
+    Attributes:
+        message -- explanation of the error."""
+
+    def __init__(self, message: str):
+        self.message = message
+
+
+def note_to_dict(note: dbhelper.Note) -> dict:
+    """JSON representation of a note."""
+    return {"note_id": note[0], "content": note[1],
+            "creation": note[2], "last_update": note[3]}
+
+
+class NoteService:
+    """Serve requests concurrently, running the blocking database calls
+    in a bounded pool of threads, and logins, which hash the password, in
+    another one, so a burst of logins never holds up other requests.
+
+    Every thread of the pools has its own connection to the database, and
+    at most `max_requests` requests are being processed at once."""
+
+    def __init__(self, name: str, workers: int = 4, max_requests: int = 64,
+                 shards: int = 0, profile: str = profiles.DEFAULT_PROFILE,
+                 hash_workers: int = 2):
+        self.name = name
+        self.shards = shards
+        self.profile = profile
+        self.workers = workers
+        self.max_requests = max_requests
+        self.local = threading.local()
+        self.connections = []
+        self.executor = ThreadPoolExecutor(workers)
+        self.hashing = ThreadPoolExecutor(hash_workers)
+        self.limit = None
+        self.handlers = {
+            "login": self.login,
+            "logout": self.logout,
+            "list": self.list_notes,
+            "get": self.get_note,
+            "add": self.add_note,
+            "update": self.update_note,
+            "delete": self.delete_note,
+            "update_many": self.update_notes,
+            "delete_many": self.delete_notes,
+            "search": self.search_notes,
+            "export": self.export_notes,
+        }
+
+    def database(self) -> dbhelper.DBHelper:
+        """Return the connection of the current worker thread."""
+        if not hasattr(self.local, "db"):
+            # Closed from the main thread on shutdown
+            self.local.db = dbhelper.DBHelper(
+                self.name, check_same_thread=False,
+                storage=storage.make_backend(self.shards),
+                profile=self.profile)
+            self.connections.append(self.local.db)
+        return self.local.db
+
+    async def run_blocking(self, func: Callable, *args,
+                           executor: Optional[ThreadPoolExecutor] = None):
+        """Run `func(database, *args)` in the given pool, that of the
+        workers by default."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            executor or self.executor, lambda: func(self.database(), *args))
+
+    async def handle_client(self, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter):
+        """Answer the requests of a client until it disconnects."""
+        session = {"user_id": None}
+        peer = writer.get_extra_info("peername")
+        logger.debug("Client %s connected.", peer)
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self.answer(line, session)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError, ValueError) as e:
+            logger.debug("Client %s dropped: %s", peer, e)
+        finally:
+            writer.close()
+        logger.debug("Client %s disconnected.", peer)
+
+    async def answer(self, line: bytes, session: dict) -> dict:
+        """Process a single request line."""
+        request_id = None
+        try:
+            try:
+                request = json.loads(line)
+                request_id = request.get("id")
+                handler = self.handlers[request["op"]]
+            except (ValueError, AttributeError, KeyError, TypeError):
+                raise RequestError("Malformed request.")
+
+            async with self.limit:
+                result = await handler(request, session)
+
+        except RequestError as e:
+            return {"id": request_id, "ok": False, "error": e.message}
+        except (exceptions.DatabaseError, exceptions.LoginError) as e:
+            return {"id": request_id, "ok": False, "error": e.message}
+        except Exception:
+            # Keep the connection, the client still gets an answer
+            logger.exception("Request %r failed.", request_id)
+            return {"id": request_id, "ok": False, "error": "Internal error."}
+
+        return {"id": request_id, "ok": True, "result": result}
+
+    # =====  Handlers  ====================================================
+    @staticmethod
+    def user_of(session: dict) -> int:
+        if session["user_id"] is None:
+            raise RequestError("Not logged in.")
+        return session["user_id"]
+
+    @staticmethod
+    def field(request: dict, name: str, kind: type):
+        value = request.get(name)
+        if not isinstance(value, kind):
+            raise RequestError(f"Missing or invalid field `{name}`.")
+        return value
+
+    async def login(self, request: dict, session: dict):
+        username = self.field(request, "username", str)
+        password = self.field(request, "password", str)
+        session["user_id"] = await self.run_blocking(
+            dbhelper.DBHelper.login, username, password,
+            executor=self.hashing)
+        logger.info("`%s` logged in the service.", username)
+        return session["user_id"]
+
+    async def logout(self, request: dict, session: dict):
+        session["user_id"] = None
+
+    async def list_notes(self, request: dict, session: dict):
+        user_id = self.user_of(session)
+        rows = await self.run_blocking(
+            dbhelper.DBHelper.get_user_info, user_id)
+        return [note_to_dict(row[3:]) for row in rows if row[3]]
+
+    async def get_note(self, request: dict, session: dict):
+        user_id = self.user_of(session)
+        note_id = self.field(request, "note_id", int)
+        note = await self.run_blocking(
+            dbhelper.DBHelper.get_item, user_id, note_id)
+        if not note:
+            raise RequestError(f"No note {note_id}.")
+        return note_to_dict(note)
+
+    async def add_note(self, request: dict, session: dict):
+        user_id = self.user_of(session)
+        content = self.field(request, "content", str)
+        return await self.run_blocking(
+            dbhelper.DBHelper.add_item, user_id, content)
+
+    async def update_note(self, request: dict, session: dict):
+        user_id = self.user_of(session)
+        note_id = self.field(request, "note_id", int)
+        content = self.field(request, "content", str)
+        if not await self.run_blocking(dbhelper.DBHelper.update_item,
+                                       user_id, note_id, content):
+            raise RequestError(f"No note {note_id}.")
+
+    async def delete_note(self, request: dict, session: dict):
+        user_id = self.user_of(session)
+        note_id = self.field(request, "note_id", int)
+        if not await self.run_blocking(dbhelper.DBHelper.delete_item,
+                                       user_id, note_id):
+            raise RequestError(f"No note {note_id}.")
+
+    async def update_notes(self, request: dict, session: dict):
+        user_id = self.user_of(session)
+        notes = self.field(request, "notes", list)
+        if not all(isinstance(note, dict) and
+                   isinstance(note.get("note_id"), int) and
+                   isinstance(note.get("content"), str) for note in notes):
+            raise RequestError("Invalid field `notes`.")
+        return await self.run_blocking(
+            dbhelper.DBHelper.update_items, user_id,
+            [(note["note_id"], note["content"]) for note in notes])
+
+    async def delete_notes(self, request: dict, session: dict):
+        user_id = self.user_of(session)
+        note_ids = self.field(request, "note_ids", list)
+        if not all(isinstance(note_id, int) for note_id in note_ids):
+            raise RequestError("Invalid field `note_ids`.")
+        return await self.run_blocking(
+            dbhelper.DBHelper.delete_items, user_id, note_ids)
+
+    async def search_notes(self, request: dict, session: dict):
+        user_id = self.user_of(session)
+        text = self.field(request, "text", str)
+        notes = await self.run_blocking(
+            dbhelper.DBHelper.search_items, user_id, text)
+        return [note_to_dict(note) for note in notes]
+
+    async def export_notes(self, request: dict, session: dict):
+        user_id = self.user_of(session)
+        rows = await self.run_blocking(
+            dbhelper.DBHelper.get_user_info, user_id)
+        if not rows:
+            # Deleted by another instance
+            raise RequestError("No such user.")
+        return {"username": rows[0][0], "name": rows[0][1],
+                "notes": [note_to_dict(row[3:]) for row in rows if row[3]]}
+
+    # =====  Server  ======================================================
+    async def start(self, host: str = "127.0.0.1", port: int = 8765,
+                    path: Optional[str] = None) -> asyncio.AbstractServer:
+        """Listen on a Unix socket if `path` is given, else on TCP."""
+        self.limit = asyncio.Semaphore(self.max_requests)
+        if path:
+            server = await asyncio.start_unix_server(
+                self.handle_client, path, limit=MAX_LINE, backlog=BACKLOG)
+            logger.info("Serving notes on `%s`.", path)
+        else:
+            server = await asyncio.start_server(
+                self.handle_client, host, port, limit=MAX_LINE,
+                backlog=BACKLOG)
+            logger.info("Serving notes on %s:%d.", host, port)
+        return server
+
+    def close(self):
+        """Stop the workers and close their connections."""
+        self.executor.shutdown()
+        self.hashing.shutdown()
+        for db in self.connections:
+            db.close()
+
+
+def serve(name: str, host: str = "127.0.0.1", port: int = 8765,
+          path: Optional[str] = None, workers: int = 4,
+          max_requests: int = 64, shards: int = 0,
+          profile: str = profiles.DEFAULT_PROFILE, hash_workers: int = 2):
+    """Run the service until interrupted."""
+    service = NoteService(name, workers, max_requests, shards, profile,
+                          hash_workers)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(service.start(host, port, path))
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down the service.")
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+        service.close()
@@ -0,0 +1,124 @@
+"""Storage backends, deciding in which database the notes of a user live.
+
+The `users` table always lives in the main database. Backends hand out the
+connection that holds the `library` table of each user."""
+import sqlite3
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import List
+
+from utils import exceptions
+
+
+class StorageBackend(ABC):
+    """Interface of the storage backends.
+
+    A backend is bound to a single `DBHelper`, which calls `open` once it
+    is connected to the main database."""
+
+    # Whether `library` lives in the main database, next to `users`
+    shared = True
+    num_shards = 0
+
+    def open(self, db):
+        self.db = db
+
+    def setup(self):
+        """Check the backend matches the one the database was created with.
+
+        The first setup records it, databases that already have notes in
+        the main file were created without shards."""
+        if self.db.get_storage_setting("shards") is None:
+            self.db.set_storage_setting(
+                "shards", 0 if self.db.has_library() else self.num_shards)
+
+        stored = self.db.get_storage_setting("shards")
+        if int(stored or 0) != self.num_shards:
+            error_message = (f"Database uses {stored or 0} shards, "
+                             f"not {self.num_shards}.")
+            raise exceptions.DatabaseError(error_message)
+
+    @abstractmethod
+    def library(self, user_id: int) -> sqlite3.Connection:
+        """Return the connection holding the notes of the given user."""
+
+    @abstractmethod
+    def connections(self) -> List[sqlite3.Connection]:
+        """Return every connection holding a `library` table."""
+
+    @abstractmethod
+    def files(self) -> List[str]:
+        """Return the names of every database file used."""
+
+    @abstractmethod
+    def library_names(self) -> List[str]:
+        """Return the names of the files of `connections`, in order."""
+
+    def close(self):
+        """Close the connections opened by the backend."""
+        pass
+
+
+class SingleFileBackend(StorageBackend):
+    """All the notes live in the main database."""
+
+    def library(self, user_id: int) -> sqlite3.Connection:
+        return self.db.conn
+
+    def connections(self) -> List[sqlite3.Connection]:
+        return [self.db.conn]
+
+    def files(self) -> List[str]:
+        return [self.db.name]
+
+    def library_names(self) -> List[str]:
+        return [self.db.name]
+
+
+class ShardedBackend(StorageBackend):
+    """Notes are spread among `num_shards` database files by user id, so
+    users in different shards don't wait for each other's writes.
+
+    Shards are created next to the main database, named after it, as
+    `database.shard0.sqlite3`, `database.shard1.sqlite3`..."""
+
+    shared = False
+
+    def __init__(self, num_shards: int):
+        self.num_shards = num_shards
+        self.names = []
+        self.shards = []
+
+    def open(self, db):
+        super().open(db)
+        path = Path(db.name)
+        self.names = [str(path.with_name(f"{path.stem}.shard{k}{path.suffix}"))
+                      for k in range(self.num_shards)]
+        self.shards = [db.connect(name) for name in self.names]
+
+    def library(self, user_id: int) -> sqlite3.Connection:
+        return self.shards[user_id % self.num_shards]
+
+    def connections(self) -> List[sqlite3.Connection]:
+        return self.shards
+
+    def files(self) -> List[str]:
+        return [self.db.name] + self.names
+
+    def library_names(self) -> List[str]:
+        return self.names
+
+    def close(self):
+        try:
+            for shard in self.shards:
+                shard.close()
+        except sqlite3.Error:
+            error_message = "Cannot close connection with shards."
+            raise exceptions.DatabaseError(error_message)
+
+
+def make_backend(num_shards: int = 0) -> StorageBackend:
+    """Return a single file backend, or a sharded one if `num_shards`."""
+    if num_shards:
+        return ShardedBackend(num_shards)
+    return SingleFileBackend()
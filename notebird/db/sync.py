@@ -0,0 +1,155 @@
+"""Two-way sync of two databases, e.g. the copies of a laptop and a
+desktop, file to file.
+
+Every user and note has a `guid`, the same in both databases, and every
+change is logged with a sequence number (`users_changes`,
+`library_changes`). Each database records, per database it syncs with,
+the last change it pulled from every log of the other, so a sync only
+reads what changed since. When both sides changed the same row, the
+version updated last wins; deleted rows leave a tombstone with the time
+of the deletion, which wins over older versions only."""
+import logging
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from db import dbhelper
+
+logger = logging.getLogger(__name__)
+
+# Changes read from a log at once
+BATCH_SIZE = 500
+
+
+class SyncStats(NamedTuple):
+    """Metrics of the changes pulled from one database into the other."""
+    users: int = 0
+    notes: int = 0
+    deleted: int = 0
+    skipped: int = 0
+
+
+def sync_point(source: dbhelper.DBHelper, target: dbhelper.DBHelper,
+               feed: str) -> Tuple[str, int]:
+    """Return the key under which `target` stores the last change pulled
+    from the given log of `source`, and that change."""
+    key = f"sync:{source.get_replica_id()}:{feed}"
+    return key, int(target.get_storage_setting(key) or 0)
+
+
+def read_avatar(db: dbhelper.DBHelper, avatar_id: Optional[int]
+                ) -> Optional[dbhelper.AvatarImages]:
+    """Return the images of a custom avatar, `None` for the default one."""
+    if not avatar_id:
+        return None
+    image = db.read_avatar(avatar_id)
+    thumbnail = db.read_avatar(avatar_id, thumbnail=True)
+    if image is None or thumbnail is None:
+        return None
+    return image, thumbnail
+
+
+def pull_users(source: dbhelper.DBHelper,
+               target: dbhelper.DBHelper) -> Tuple[int, int]:
+    """Apply the users changed in `source` since the last sync to
+    `target`. Return the number of users applied and skipped."""
+    key, since = sync_point(source, target, "users")
+    applied, skipped = 0, 0
+    while True:
+        changes = source.get_user_changes(since, BATCH_SIZE)
+        for change in changes:
+            avatar = None if change[2] else read_avatar(source, change[7])
+            if target.apply_user_change(change, avatar):
+                applied += 1
+            else:
+                skipped += 1
+        if changes:
+            since = changes[-1][0]
+            target.set_storage_setting(key, since)
+        if len(changes) < BATCH_SIZE:
+            return applied, skipped
+
+
+def pull_notes(source: dbhelper.DBHelper, target: dbhelper.DBHelper,
+               feed: int) -> Tuple[int, int, int]:
+    """Apply the notes changed in the `feed`-th database holding notes of
+    `source` since the last sync to `target`. Return the number of notes
+    applied, deleted and skipped."""
+    key, since = sync_point(source, target, f"library{feed}")
+    # Ids of the owners in `source`, and in `target`
+    owners: Dict[int, Optional[int]] = {}
+    applied, deleted, skipped = 0, 0, 0
+    while True:
+        changes = source.get_note_changes(feed, since, BATCH_SIZE)
+
+        missing = {change[4] for change in changes
+                   if not change[2] and change[4] is not None} - set(owners)
+        for user_id, (guid, username) in source.get_user_keys(
+                missing).items():
+            owners[user_id] = target.find_user(guid, username)
+
+        notes: Dict[int, list] = {}
+        deletions = []
+        for change in changes:
+            guid, is_deleted, changed, user_id = change[1:5]
+            if guid is None:
+                # Deleted before notes had a `guid`
+                skipped += 1
+            elif is_deleted:
+                deletions.append((guid, changed))
+            elif owners.get(user_id) is None:
+                # Orphaned notes, or owner not synced
+                skipped += 1
+            else:
+                notes.setdefault(owners[user_id], []).append(
+                    (guid, *change[5:]))
+
+        for user_id, user_notes in notes.items():
+            num_applied, num_skipped = target.apply_note_changes(
+                user_id, user_notes)
+            applied += num_applied
+            skipped += num_skipped
+        if deletions:
+            num_deleted = target.apply_note_deletions(deletions)
+            deleted += num_deleted
+            skipped += len(deletions) - num_deleted
+
+        if changes:
+            since = changes[-1][0]
+            target.set_storage_setting(key, since)
+        if len(changes) < BATCH_SIZE:
+            return applied, deleted, skipped
+
+
+def pull(source: dbhelper.DBHelper,
+         target: dbhelper.DBHelper) -> SyncStats:
+    """Apply the changes of `source` since the last sync to `target`."""
+    users, skipped = pull_users(source, target)
+    notes, deleted = 0, 0
+    for feed in range(len(source.storage.connections())):
+        num_notes, num_deleted, num_skipped = pull_notes(source, target,
+                                                         feed)
+        notes += num_notes
+        deleted += num_deleted
+        skipped += num_skipped
+    return SyncStats(users, notes, deleted, skipped)
+
+
+def sync_databases(local: dbhelper.DBHelper, remote: dbhelper.DBHelper
+                   ) -> Tuple[SyncStats, SyncStats]:
+    """Exchange the changes of both databases since their last sync.
+    Return what was pulled into `local`, then into `remote`.
+
+    Changes pulled into one database are logged there too, so the next
+    sync sends them back once, and they are skipped as already there."""
+    if local.get_replica_id() == remote.get_replica_id():
+        # One is a copy of the other's file
+        remote.reset_replica_id()
+        logger.info("Databases share an id, gave a new one to the "
+                    "remote copy.")
+
+    pulled = pull(remote, local)
+    pushed = pull(local, remote)
+    logger.info("Sync pulled %d users, %d notes and %d deletions, pushed "
+                "%d users, %d notes and %d deletions.", pulled.users,
+                pulled.notes, pulled.deleted, pushed.users, pushed.notes,
+                pushed.deleted)
+    return pulled, pushed
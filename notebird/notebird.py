@@ -1,26 +1,68 @@
 """Notebird, a desktop app for managing users' notes."""
+import os
+import sys
+import csv
+import json
+import getpass
 import logging
 import argparse
 
-from PySide2 import QtWidgets
+from db import (dbhelper, helpers, loadtest, maintenance, profiles, server,
+                sync)
+from utils import config, consts, exceptions, log, security
 
-from db import helpers
-from utils import consts
-from windows import login
+logger = logging.getLogger("notebird")
+
+
+def init_logging(argv):
+    """Configure logging as requested in the command line."""
+    log.setup_logging(argv.log_level, argv.log_file, argv.log_json,
+                      dict(argv.log_module))
+
+
+def parse_duration(value: str) -> float:
+    """Parse `100ms`, `0.5s` or `100` (milliseconds) into seconds."""
+    value = value.strip().lower()
+    if value.endswith("ms"):
+        return float(value[:-2]) / 1000
+    if value.endswith("s"):
+        return float(value[:-1])
+    return float(value) / 1000
+
+
+def parse_size(value: str) -> int:
+    """Parse `32MB`, `512KB`, `1GB` or `1000` (bytes) into bytes."""
+    value = value.strip().upper().rstrip("B")
+    for exponent, unit in enumerate("KMG", 1):
+        if value.endswith(unit):
+            return int(float(value[:-1]) * 1024 ** exponent)
+    return int(value)
+
+
+def existing_file(value: str) -> str:
+    """Check the given file exists."""
+    if not os.path.isfile(value):
+        raise argparse.ArgumentTypeError(f"no such file: `{value}`")
+    return value
 
 
 def main(argv):
-    # Initialize logging
-    format = "%(asctime)-15s %(levelname)s: %(message)s"
-    logging.basicConfig(format=format, level=logging.DEBUG)
+    # GUI modules are not needed, nor maybe installed, in headless mode
+    from PySide2 import QtWidgets
+    from db import loader
+    from utils import profiling, stalls
+    from windows import login
 
-    # Initialize database
-    db = helpers.connect_to_database(consts.DB_NAME)
-    helpers.setup_database(db)
+    # Initialize logging
+    init_logging(argv)
 
     # Initialize GUI
     app = QtWidgets.QApplication([])
 
+    # Profile from the start, until stopped from the crud window or exit
+    if argv.cprofile:
+        profiling.profiler.start()
+
     # Load and apply stylesheet
     if argv.dark:
         with open(consts.STYLESHEET) as f:
@@ -28,13 +70,280 @@ def main(argv):
         app.setStyleSheet(style)
 
     # Show login  window
-    window = login.LoginWindow(database=db)
+    window = login.LoginWindow()
     window.show()
+
+    # Initialize database in the background
+    db_loader = loader.DatabaseLoader(argv.db, argv.shards, argv.profile,
+                                      argv.snapshot, argv.content_cache)
+    db_loader.status.connect(window.show_status)
+    db_loader.ready.connect(window.set_database)
+    db_loader.failed.connect(window.show_error)
+    db_loader.start()
+
+    # Report stalls of the event loop, if requested
+    if argv.watch_stalls:
+        watchdog = stalls.StallWatchdog(argv.watch_stalls)
+        watchdog.start()
+
     app.exec_()
 
+    if argv.watch_stalls:
+        watchdog.stop()
+        logger.info("Stall report\n%s", watchdog.report())
+
+    if profiling.profiler.running:
+        profiling.profiler.stop()
+
+    # The app may be closed while still connecting or filling notes
+    db_loader.stop()
+    if not db_loader.wait(5):
+        logger.critical("Database did not come up, exiting anyway.")
+        return
+    db = db_loader.database
+    if db is None:
+        return
+
+    # Reclaim space left by deleted accounts
+    maintenance.run_maintenance(db)
+
+    if argv.save_snapshot:
+        helpers.save_snapshot(db, argv.save_snapshot)
+
     # Close database connection
     helpers.close_database_connection(db)
 
+
+def collect_garbage(argv):
+    """Remove notes and avatars of deleted accounts."""
+    init_logging(argv)
+
+    db = helpers.connect_to_database(argv.db, shards=argv.shards,
+                                     profile=argv.profile,
+                                     snapshot=argv.snapshot)
+    helpers.setup_database(db)
+
+    try:
+        stats = maintenance.collect_garbage(
+            db, argv.batch_size, argv.max_batches, argv.archive, argv.vacuum)
+    except exceptions.DatabaseError as e:
+        logger.critical(e.message)
+    else:
+        for metric, value in stats._asdict().items():
+            print(f"{metric:>14}: {value}")
+
+    if argv.save_snapshot:
+        helpers.save_snapshot(db, argv.save_snapshot)
+    helpers.close_database_connection(db)
+
+
+def import_users(argv):
+    """Create the accounts listed in a CSV file."""
+    init_logging(argv)
+
+    db = helpers.connect_to_database(argv.db, shards=argv.shards,
+                                     profile=argv.profile,
+                                     snapshot=argv.snapshot)
+    helpers.setup_database(db)
+
+    # Rows of `username,password,full name`, and their line in the file
+    rows, lines = [], []
+    with open(argv.file, newline="") as f:
+        reader = csv.reader(f)
+        for row in reader:
+            if row:
+                rows.append(tuple(row))
+                lines.append(reader.line_num)
+
+    try:
+        errors = db.create_users(rows, argv.workers)
+    except exceptions.DatabaseError as e:
+        logger.critical(e.message)
+    else:
+        for position, error in errors:
+            if isinstance(error, exceptions.ValidationError):
+                logger.warning("Line %d: invalid field %s.",
+                               lines[position], ", ".join(error.columns))
+            else:
+                logger.warning("Line %d: `%s` already exists.",
+                               lines[position], error.username)
+        logger.info("%d of %d users created.", len(rows) - len(errors),
+                    len(rows))
+
+    if argv.save_snapshot:
+        helpers.save_snapshot(db, argv.save_snapshot)
+    helpers.close_database_connection(db)
+
+
+def import_notes(argv):
+    """Add the notes of a JSON export to an account, once."""
+    init_logging(argv)
+
+    # Exported by the `export` request of `serve`, or a list of notes
+    with open(argv.file) as f:
+        data = json.load(f)
+    notes = [(note["content"], note.get("creation"), note.get("last_update"))
+             for note in (data["notes"] if isinstance(data, dict) else data)]
+
+    db = helpers.connect_to_database(argv.db, shards=argv.shards,
+                                     profile=argv.profile,
+                                     snapshot=argv.snapshot)
+    helpers.setup_database(db)
+
+    try:
+        user_id = db.login(argv.username, getpass.getpass())
+        # Duplicates are found by hash, missing in notes of older versions
+        maintenance.fill_derived_columns(db)
+        added, skipped, merged = db.import_items(user_id, notes, argv.mode)
+    except (exceptions.LoginError, exceptions.DatabaseError) as e:
+        logger.critical(e.message)
+    else:
+        logger.info("%d notes added, %d skipped and %d merged as "
+                    "duplicates.", added, skipped, merged)
+
+    if argv.save_snapshot:
+        helpers.save_snapshot(db, argv.save_snapshot)
+    helpers.close_database_connection(db)
+
+
+def find_duplicates(argv):
+    """Report notes with the same content."""
+    init_logging(argv)
+
+    db = helpers.connect_to_database(argv.db, shards=argv.shards,
+                                     profile=argv.profile,
+                                     snapshot=argv.snapshot)
+    helpers.setup_database(db)
+
+    try:
+        maintenance.fill_derived_columns(db)
+        duplicates = db.find_duplicates()
+    except exceptions.DatabaseError as e:
+        logger.critical(e.message)
+    else:
+        print(f"{'user':>6} {'copies':>6}  notes")
+        for user_id, _, count, note_ids in duplicates:
+            print(f"{user_id:>6} {count:>6}  "
+                  f"{', '.join(map(str, note_ids))}")
+        print(f"{len(duplicates)} groups, "
+              f"{sum(group[2] - 1 for group in duplicates)} extra copies.")
+
+    helpers.close_database_connection(db)
+
+
+def archive_notes(argv):
+    """Move notes not updated for a while to the cold databases."""
+    init_logging(argv)
+
+    db = helpers.connect_to_database(argv.db, shards=argv.shards,
+                                     profile=argv.profile)
+    helpers.setup_database(db)
+
+    try:
+        # Only notes with a title are archived
+        maintenance.fill_derived_columns(db)
+        stats = maintenance.archive_old_notes(
+            db, argv.days, argv.batch_size, argv.max_batches, argv.vacuum)
+    except exceptions.DatabaseError as e:
+        logger.critical(e.message)
+    else:
+        for metric, value in stats._asdict().items():
+            print(f"{metric:>14}: {value}")
+
+    helpers.close_database_connection(db)
+
+
+def sync_with(argv):
+    """Exchange changed users and notes with another database file."""
+    init_logging(argv)
+
+    db = helpers.connect_to_database(argv.db, shards=argv.shards,
+                                     profile=argv.profile,
+                                     snapshot=argv.snapshot)
+    helpers.setup_database(db)
+    other = helpers.connect_to_database(argv.other, shards=argv.other_shards,
+                                        profile=argv.profile)
+    helpers.setup_database(other)
+
+    try:
+        pulled, pushed = sync.sync_databases(db, other)
+    except exceptions.DatabaseError as e:
+        logger.critical(e.message)
+    else:
+        print(f"{'':>8} {'users':>6} {'notes':>6} {'deleted':>8} "
+              f"{'skipped':>8}")
+        for direction, stats in (("pulled", pulled), ("pushed", pushed)):
+            print(f"{direction:>8} {stats.users:>6} {stats.notes:>6} "
+                  f"{stats.deleted:>8} {stats.skipped:>8}")
+
+    if argv.save_snapshot:
+        helpers.save_snapshot(db, argv.save_snapshot)
+    helpers.close_database_connection(other)
+    helpers.close_database_connection(db)
+
+
+def fill_notes(argv):
+    """Compute titles, previews and hashes of notes of older versions."""
+    init_logging(argv)
+
+    db = helpers.connect_to_database(argv.db, shards=argv.shards,
+                                     profile=argv.profile,
+                                     snapshot=argv.snapshot)
+    helpers.setup_database(db)
+
+    def report(done: int, total: int):
+        print(f"\r{done}/{total} notes", end="", flush=True)
+
+    try:
+        done = maintenance.fill_derived_columns(
+            db, argv.batch_size, argv.max_batches, on_progress=report)
+    except exceptions.DatabaseError as e:
+        logger.critical(e.message)
+    else:
+        print(f"\r{done} notes filled, {db.count_unfilled_items()} left.")
+
+    if argv.save_snapshot:
+        helpers.save_snapshot(db, argv.save_snapshot)
+    helpers.close_database_connection(db)
+
+
+def calibrate(argv):
+    """Pick the password hashing rounds for this machine."""
+    rounds = security.calibrate_rounds(argv.target_ms)
+    config.save_setting("security", "pbkdf2_rounds", rounds)
+    print(f"Hashing with {rounds} rounds (~{argv.target_ms:g} ms per login). "
+          f"Saved in `{consts.CONFIG_FILE}`.")
+
+
+def serve(argv):
+    """Expose the notes to other programs through a local socket."""
+    init_logging(argv)
+
+    db = helpers.connect_to_database(argv.db, shards=argv.shards,
+                                     profile=argv.profile,
+                                     snapshot=argv.snapshot)
+    helpers.setup_database(db)
+    helpers.close_database_connection(db)
+
+    server.serve(argv.db, port=argv.port, path=argv.socket,
+                 workers=argv.workers, max_requests=argv.max_requests,
+                 shards=argv.shards, profile=argv.profile,
+                 hash_workers=argv.hash_workers)
+
+
+def load_test(argv):
+    """Hammer the database with many concurrent sessions."""
+    init_logging(argv)
+
+    result = loadtest.run_load_test(
+        argv.database, argv.workers, argv.operations, argv.mix,
+        argv.processes, argv.shards, argv.busy_timeout, argv.seed,
+        argv.profile)
+    print(loadtest.format_table(result))
+    if argv.output:
+        loadtest.save_result(result, argv.output)
+
+
 if __name__ == "__main__":
     # Parse command line arguments
     parser = argparse.ArgumentParser(
@@ -42,7 +351,192 @@ if __name__ == "__main__":
         allow_abbrev=False)
     parser.add_argument("-d", "--dark", action="store_true",
                         help="apply dark stylesheet")
+    parser.add_argument("--log-level", default="DEBUG", type=str.upper,
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR",
+                                 "CRITICAL"],
+                        help="minimum level of the messages logged")
+    parser.add_argument("--log-module", metavar="NAME=LEVEL", default=[],
+                        action="append", type=log.parse_module_level,
+                        help="level for a single module, e.g. db=WARNING "
+                             "(can be repeated)")
+    parser.add_argument("--log-file", metavar="FILE",
+                        help="also log to this file, rotated every 1 MB")
+    parser.add_argument("--log-json", action="store_true",
+                        help="log JSON lines instead of plain text")
+    parser.add_argument("--watch-stalls", metavar="DURATION",
+                        type=parse_duration, default=None,
+                        help="report what blocks the interface for longer "
+                             "than this, e.g. 100ms")
+    parser.add_argument("--cprofile", action="store_true",
+                        help="profile the app until exit, or until "
+                             "Ctrl+Shift+F12 in the notes window, saving "
+                             "it under notebird/profiling")
+    parser.add_argument("--shards", type=int,
+                        default=config.load_config().getint(
+                            "database", "shards", fallback=0),
+                        help="spread notes among this many database files "
+                             "(fixed when the database is created)")
+    parser.add_argument("--db", metavar="NAME",
+                        default=config.load_config().get(
+                            "database", "name", fallback=consts.DB_NAME),
+                        help="database file, or :memory: for a throwaway "
+                             "one (default: %(default)s)")
+    parser.add_argument("--snapshot", metavar="FILE", type=existing_file,
+                        help="with --db :memory:, start from a copy of this "
+                             "database file")
+    parser.add_argument("--save-snapshot", metavar="FILE",
+                        help="copy the database to this file when done")
+    parser.add_argument("--profile", choices=list(profiles.PROFILES),
+                        default=config.load_config().get(
+                            "database", "profile",
+                            fallback=profiles.DEFAULT_PROFILE),
+                        help="SQLite settings, from the safest to the "
+                             "fastest: durable, balanced or fast; default "
+                             "keeps the journal mode of the database "
+                             "(default: %(default)s)")
+    parser.add_argument("--content-cache", metavar="SIZE", type=parse_size,
+                        default=config.load_config().get(
+                            "session", "content_cache", fallback=None),
+                        help="keep at most this much note content in memory, "
+                             "e.g. 32MB (default: all of it)")
+    parser.set_defaults(func=main)
+    subparsers = parser.add_subparsers(title="commands", dest="command")
+
+    gc_parser = subparsers.add_parser(
+        "gc", help="remove notes and avatars of deleted accounts")
+    gc_parser.add_argument("-b", "--batch-size", type=int, default=500,
+                           help="notes deleted per transaction")
+    gc_parser.add_argument("-m", "--max-batches", type=int, default=None,
+                           help="stop after this many batches")
+    gc_parser.add_argument("-a", "--archive", metavar="FILE",
+                           help="move notes to this database file instead "
+                                "of deleting them")
+    gc_parser.add_argument("--vacuum", action="store_true",
+                           help="shrink the database file afterwards")
+    gc_parser.set_defaults(func=collect_garbage)
+
+    users_parser = subparsers.add_parser(
+        "import-users", help="create accounts from a CSV file")
+    users_parser.add_argument("file",
+                              help="CSV file with rows of "
+                                   "`username,password,full name`")
+    users_parser.add_argument("-w", "--workers", type=int, default=None,
+                              help="processes hashing passwords "
+                                   "(default: number of CPUs)")
+    users_parser.set_defaults(func=import_users)
+
+    notes_parser = subparsers.add_parser(
+        "import-notes", help="add the notes of a JSON export to an account")
+    notes_parser.add_argument("file",
+                              help="JSON export of a user, or list of "
+                                   "notes with `content`, `creation` and "
+                                   "`last_update`")
+    notes_parser.add_argument("-u", "--username", required=True,
+                              help="account receiving the notes (its "
+                                   "password is asked for)")
+    notes_parser.add_argument("-m", "--mode", choices=dbhelper.IMPORT_MODES,
+                              default="skip",
+                              help="what to do with notes the user already "
+                                   "has: skip them, merge their dates or "
+                                   "add them anyway (default: skip)")
+    notes_parser.set_defaults(func=import_notes)
+
+    duplicates_parser = subparsers.add_parser(
+        "duplicates", help="report notes with the same content")
+    duplicates_parser.set_defaults(func=find_duplicates)
+
+    archive_parser = subparsers.add_parser(
+        "archive", help="move old notes out of the main database")
+    archive_parser.add_argument("-d", "--days", type=float, default=365,
+                                help="archive notes not updated for this "
+                                     "many days (default: %(default)s)")
+    archive_parser.add_argument("-b", "--batch-size", type=int, default=500,
+                                help="notes archived per transaction")
+    archive_parser.add_argument("-m", "--max-batches", type=int,
+                                default=None,
+                                help="stop after this many batches")
+    archive_parser.add_argument("--vacuum", action="store_true",
+                                help="shrink the database files afterwards")
+    archive_parser.set_defaults(func=archive_notes)
+
+    sync_parser = subparsers.add_parser(
+        "sync", help="exchange changes with another copy of the database")
+    sync_parser.add_argument("other", type=existing_file,
+                             help="database file of the other copy")
+    sync_parser.add_argument("--other-shards", type=int, default=0,
+                             help="shards of the other copy")
+    sync_parser.set_defaults(func=sync_with)
+
+    backfill_parser = subparsers.add_parser(
+        "backfill", help="compute titles and previews of older notes")
+    backfill_parser.add_argument("-b", "--batch-size", type=int, default=200,
+                                 help="notes filled per transaction")
+    backfill_parser.add_argument("-m", "--max-batches", type=int,
+                                 default=None,
+                                 help="stop after this many batches, the "
+                                      "next run resumes")
+    backfill_parser.set_defaults(func=fill_notes)
+
+    calibrate_parser = subparsers.add_parser(
+        "calibrate", help="adjust password hashing cost to this machine")
+    calibrate_parser.add_argument("-t", "--target-ms", type=float,
+                                  default=250,
+                                  help="desired time to check a password")
+    calibrate_parser.set_defaults(func=calibrate)
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="serve notes as JSON requests, without GUI")
+    serve_parser.add_argument("-p", "--port", type=int, default=8765,
+                              help="localhost port to listen on")
+    serve_parser.add_argument("-s", "--socket", metavar="PATH",
+                              help="listen on this Unix socket instead")
+    serve_parser.add_argument("-w", "--workers", type=int, default=4,
+                              help="threads running database calls")
+    serve_parser.add_argument("--hash-workers", type=int, default=2,
+                              help="threads checking passwords on login")
+    serve_parser.add_argument("-m", "--max-requests", type=int, default=64,
+                              help="requests processed at the same time")
+    serve_parser.set_defaults(func=serve)
+
+    load_parser = subparsers.add_parser(
+        "loadtest", help="measure the database under concurrent sessions")
+    load_parser.add_argument("-w", "--workers", type=int, default=8,
+                             help="concurrent sessions, each with its own "
+                                  "connection and user")
+    load_parser.add_argument("-n", "--operations", type=int, default=200,
+                             help="operations run by each session")
+    load_parser.add_argument("--mix", type=loadtest.parse_mix,
+                             default=loadtest.DEFAULT_MIX,
+                             help="weights of the operations, e.g. "
+                                  "login=1,add=3,update=3,read=2,delete=1")
+    load_parser.add_argument("--processes", action="store_true",
+                             help="run sessions in processes, not threads")
+    load_parser.add_argument("--busy-timeout", type=float, default=5.0,
+                             help="seconds waiting for a lock before "
+                                  "`database is locked`")
+    load_parser.add_argument("--database", metavar="FILE",
+                             help="database to use instead of a temporary "
+                                  "one (test users are added to it)")
+    load_parser.add_argument("--seed", type=int, default=0,
+                             help="seed of the random operation mix")
+    load_parser.add_argument("-o", "--output", metavar="FILE",
+                             help="also save the results as JSON")
+    load_parser.set_defaults(func=load_test)
+
     args = parser.parse_args()
+    if args.db == dbhelper.MEMORY:
+        if args.shards:
+            parser.error("an in-memory database cannot be sharded")
+        if args.command == "serve":
+            parser.error("serve needs a database file, each worker has "
+                         "its own connection")
+        if args.command == "archive":
+            parser.error("an in-memory database has nowhere to archive to")
+    elif args.snapshot:
+        parser.error("--snapshot only seeds an in-memory database")
 
-    # Run the app
-    main(args)
+    # Run the app, errors bringing up the database are already logged
+    try:
+        args.func(args)
+    except exceptions.DatabaseError:
+        sys.exit(1)
@@ -0,0 +1,66 @@
+"""Least recently used cache of note contents, bounded in bytes."""
+import sys
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+class ContentCache:
+    """Keep the most recently used contents within `budget` bytes of
+    memory, loading the missing ones with `load(note_id)`.
+
+    Contents larger than the whole budget are never kept."""
+
+    def __init__(self, budget: int, load: Callable[[int], Optional[str]]):
+        self.budget = budget
+        self.load = load
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, note_id: int) -> bool:
+        return note_id in self.entries
+
+    def get(self, note_id: int) -> Optional[str]:
+        """Return the content of the note, `None` if it doesn't exist."""
+        content = self.entries.get(note_id)
+        if content is not None:
+            self.hits += 1
+            self.entries.move_to_end(note_id)
+            return content
+
+        self.misses += 1
+        content = self.load(note_id)
+        if content is not None:
+            self.put(note_id, content)
+        return content
+
+    def put(self, note_id: int, content: str):
+        """Store the latest content of a note."""
+        self.discard(note_id)
+        size = sys.getsizeof(content)
+        if size > self.budget:
+            return
+
+        self.entries[note_id] = content
+        self.size += size
+        while self.size > self.budget:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= sys.getsizeof(evicted)
+            self.evictions += 1
+
+    def discard(self, note_id: int):
+        """Forget the content of a note, if cached."""
+        content = self.entries.pop(note_id, None)
+        if content is not None:
+            self.size -= sys.getsizeof(content)
+
+    def stats(self) -> dict:
+        """Counters of the use of the cache."""
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries), "bytes": self.size,
+                "budget": self.budget}
@@ -0,0 +1,24 @@
+"""Persistent settings stored in an INI file."""
+import configparser
+from pathlib import Path
+
+from utils import consts
+
+
+def load_config(path: Path = consts.CONFIG_FILE) -> configparser.ConfigParser:
+    """Return the settings saved in the given file, if it exists."""
+    config = configparser.ConfigParser()
+    config.read(str(path))
+    return config
+
+
+def save_setting(section: str, option: str, value,
+                 path: Path = consts.CONFIG_FILE):
+    """Store a single setting, keeping the rest of the file."""
+    config = load_config(path)
+    if not config.has_section(section):
+        config.add_section(section)
+    config.set(section, option, str(value))
+
+    with open(path, "w") as f:
+        config.write(f)
@@ -3,4 +3,7 @@ from pathlib import Path
 DB_NAME = str(Path("notebird/db/database.sqlite3"))
 UI_PATH = Path("notebird/windows/interfaces/")
 AVATAR_PATH = Path("notebird/windows/avatars/")
+PREVIEW_PATH = Path("notebird/db/previews/")
 STYLESHEET = Path("notebird/style.qss")
+CONFIG_FILE = Path("notebird/notebird.ini")
+PROFILING_PATH = Path("notebird/profiling/")
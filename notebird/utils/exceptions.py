@@ -1,5 +1,5 @@
 """User-defined exceptions."""
-from typing import Tuple
+from typing import Optional, Tuple
 
 
 class Error(Exception):
@@ -23,10 +23,12 @@ class DatabaseError(Error):
     """Exception raised by errors related to the database operation.
 
     Attributes:
-        message -- explanation of the error."""
+        message -- explanation of the error.
+        error -- error of the database driver behind it, if any."""
 
-    def __init__(self, message: str):
+    def __init__(self, message: str, error: Optional[Exception] = None):
         self.message = message
+        self.error = error
 
 
 class ValidationError(Error):
@@ -0,0 +1,122 @@
+"""Extraction of hashtags, link targets and other data derived from the
+content of notes."""
+import re
+import html
+import hashlib
+from typing import Optional, Pattern, Set
+from urllib.parse import urlsplit
+
+# Contents of these elements are never text of the note
+HIDDEN_PATTERN = re.compile(r"<(style|script)\b.*?</\1\s*>",
+                            re.IGNORECASE | re.DOTALL)
+MARKUP_PATTERN = re.compile(r"<[^>]*>")
+# Spans of a note left as they are when its text is edited
+NOT_TEXT_PATTERN = re.compile(
+    r"<(?:style|script)\b.*?</(?:style|script)\s*>|<[^>]*>",
+    re.IGNORECASE | re.DOTALL)
+# `#project`, but not `C#` nor `page#anchor`
+TAG_PATTERN = re.compile(r"(?<![\w#/])#([^\W\d_][\w-]*)")
+HREF_PATTERN = re.compile(
+    r"""\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+# Characters of the title and the plain text preview stored for each note
+TITLE_LENGTH = 80
+PREVIEW_LENGTH = 200
+
+
+def plain_text(content: str) -> str:
+    """Return the text of a note without its html tags."""
+    text = HIDDEN_PATTERN.sub(" ", content)
+    return html.unescape(MARKUP_PATTERN.sub(" ", text))
+
+
+def replace_in_text(pattern: Pattern, replacement: str,
+                    content: str) -> str:
+    """Return the content with the matches of the pattern replaced in its
+    text only, never in html tags nor their attributes."""
+    parts = []
+    start = 0
+    for match in NOT_TEXT_PATTERN.finditer(content):
+        parts.append(pattern.sub(replacement, content[start:match.start()]))
+        parts.append(match.group())
+        start = match.end()
+    parts.append(pattern.sub(replacement, content[start:]))
+    return "".join(parts)
+
+
+def extract_tags(content: str) -> Set[str]:
+    """Return the hashtags of a note, lowercase and without `#`."""
+    return {tag.lower().rstrip("-")
+            for tag in TAG_PATTERN.findall(plain_text(content))}
+
+
+def normalize_tag(text: str) -> Optional[str]:
+    """Return the hashtag typed by the user, lowercase and without `#`,
+    `None` if it is not a valid one."""
+    match = TAG_PATTERN.fullmatch("#" + text.strip().lstrip("#"))
+    return match.group(1).lower().rstrip("-") if match else None
+
+
+def add_tag(content: str, tag: str) -> str:
+    """Return the content with the hashtag on a line of its own at the
+    end, unless the note already has it."""
+    if tag in extract_tags(content):
+        return content
+    content = content.rstrip()
+    return f"{content}\n#{tag}" if content else f"#{tag}"
+
+
+def remove_tag(content: str, tag: str) -> str:
+    """Return the content without the hashtag, in any case. Links such as
+    `href="#tag"` are left as they are."""
+    pattern = re.compile(rf"[ \t]?(?<![\w#/])#{re.escape(tag)}-*(?![\w-])",
+                         re.IGNORECASE)
+    stripped = replace_in_text(pattern, "", content)
+    # Drop the line of a hashtag added last by `add_tag`
+    if stripped != content and not content.endswith("\n"):
+        stripped = stripped.rstrip("\n")
+    return stripped
+
+
+def normalize_domain(domain: str) -> str:
+    """Lowercase domain without `www.`, as stored in the index."""
+    domain = domain.strip().lower().rstrip(".")
+    return domain[4:] if domain.startswith("www.") else domain
+
+
+def link_domain(url: str) -> Optional[str]:
+    """Return the domain a link points to, `None` for relative links."""
+    try:
+        hostname = urlsplit(url).hostname
+    except ValueError:
+        return None
+    return normalize_domain(hostname) if hostname else None
+
+
+def extract_links(content: str) -> Set[str]:
+    """Return the targets of the links (`href`) of a note."""
+    links = set()
+    for match in HREF_PATTERN.finditer(HIDDEN_PATTERN.sub(" ", content)):
+        url = html.unescape(next(group for group in match.groups()
+                                 if group is not None)).strip()
+        # Anchors within the note itself
+        if url and not url.startswith("#"):
+            links.add(url)
+    return links
+
+
+def content_hash(content: str) -> str:
+    """Return the hash of a note, the same for contents differing only in
+    whitespace."""
+    normalized = " ".join(content.split())
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def note_title(content: str) -> str:
+    """Return the first line of the text of a note."""
+    line = plain_text(content).strip().split("\n", 1)[0]
+    return " ".join(line.split())[:TITLE_LENGTH]
+
+
+def note_preview(content: str) -> str:
+    """Return the start of the text of a note, in a single line."""
+    return " ".join(plain_text(content).split())[:PREVIEW_LENGTH]
@@ -0,0 +1,56 @@
+"""Encoding of the images stored in the database."""
+import io
+from typing import BinaryIO, Tuple, Union
+
+from PIL import Image
+
+AVATAR_SIZE = (175, 175)
+THUMBNAIL_SIZE = (75, 75)
+# Largest image shown inside a rendered note
+PREVIEW_SIZE = (300, 300)
+
+ImageSource = Union[str, bytes, BinaryIO]
+
+
+def open_image(source: ImageSource) -> Image.Image:
+    """Open an image from a file name, a file object or its bytes."""
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    return Image.open(source)
+
+
+def fit(image: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    """Resize the image to fit in `size`, conserving aspect ratio."""
+    max_width, max_height = size
+    ratio = min(max_width/image.width, max_height/image.height)
+    new_size = (max(1, int(ratio * image.width)),
+                max(1, int(ratio * image.height)))
+    return image.resize(new_size, Image.LANCZOS)
+
+
+def to_png(image: Image.Image) -> bytes:
+    """Encode the image as png."""
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def encode_avatar(source: ImageSource) -> Tuple[bytes, bytes]:
+    """Return the avatar and its thumbnail as png, from any image."""
+    image = open_image(source)
+    return to_png(fit(image, AVATAR_SIZE)), to_png(fit(image, THUMBNAIL_SIZE))
+
+
+def encode_preview(source: ImageSource,
+                   size: Tuple[int, int] = PREVIEW_SIZE) -> bytes:
+    """Return a png preview of the image that fits in `size`.
+
+    JPEG images are decoded already scaled down, so most of the full
+    resolution image is never decoded."""
+    image = open_image(source)
+    image.draft("RGB", size)
+    if image.mode not in ("RGB", "RGBA", "L", "LA"):
+        image = image.convert("RGBA")
+    if image.width > size[0] or image.height > size[1]:
+        image = fit(image, size)
+    return to_png(image)
@@ -0,0 +1,81 @@
+"""Logging set up where handlers do their I/O in a background thread."""
+import copy
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from typing import Dict, Optional
+
+FORMAT = "%(asctime)-15s %(levelname)s %(name)s: %(message)s"
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"time": record.created,
+                 "level": record.levelname,
+                 "logger": record.name,
+                 "thread": record.threadName,
+                 "message": record.getMessage()}
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue records with the message merged with its arguments, so
+    mutable arguments are logged as they were when the record was made.
+    Formatting the line (time, level, JSON...) and writing it is left to
+    the listener thread."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging(level: str = "DEBUG", log_file: Optional[str] = None,
+                  json_lines: bool = False,
+                  module_levels: Optional[Dict[str, str]] = None,
+                  max_bytes: int = 1024 * 1024, backup_count: int = 3
+                  ) -> logging.handlers.QueueListener:
+    """Send log records to standard error, and to a rotating file if
+    given, through a queue served by a background thread.
+
+    `module_levels` maps logger names, such as `db` or `windows.crud`,
+    to their own level."""
+
+    formatter = JSONFormatter() if json_lines else logging.Formatter(FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count,
+            encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(-1)
+    root = logging.getLogger()
+    root.handlers = [DeferredQueueHandler(log_queue)]
+    root.setLevel(level)
+    for name, module_level in (module_levels or {}).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+
+    # Flush pending records on exit
+    atexit.register(listener.stop)
+    return listener
+
+
+def parse_module_level(value: str) -> tuple:
+    """Parse `name=LEVEL` command line values."""
+    name, _, level = value.partition("=")
+    level = level.upper()
+    if not name or not isinstance(logging.getLevelName(level), int):
+        raise ValueError(f"invalid module level `{value}`")
+    return name, level
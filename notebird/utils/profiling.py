@@ -0,0 +1,128 @@
+"""On-demand profiling of the running app with `cProfile`."""
+import io
+import time
+import pstats
+import logging
+import cProfile
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from utils import consts
+
+logger = logging.getLogger(__name__)
+
+# Key of a function in `pstats`: file, line and name
+FunctionKey = Tuple[str, int, str]
+
+# Areas whose time is annotated in the summary
+AREAS = ("DBHelper", "passlib", "PIL", "Qt")
+
+# Calls of Qt that only wait for events, not doing any work themselves
+QT_EVENT_LOOP = ("exec_", "exec")
+
+
+def area_of(function: FunctionKey) -> Optional[str]:
+    """Return the area a function of the profile belongs to, if any."""
+    filename, _, name = function
+    path = Path(filename).as_posix()
+    if path.endswith("db/dbhelper.py"):
+        return "DBHelper"
+    if "/passlib/" in path:
+        return "passlib"
+    if "/PIL/" in path:
+        return "PIL"
+    # Builtin methods, e.g. `<method 'setHtml' of 'PySide2...' objects>`
+    if filename == "~" and "PySide2." in name and not any(
+            f"'{method}'" in name for method in QT_EVENT_LOOP):
+        return "Qt"
+    return None
+
+
+def area_times(stats: pstats.Stats) -> Dict[str, float]:
+    """Return the time spent in each area, including the functions it
+    calls (e.g. SQLite for `DBHelper`).
+
+    Only calls entering an area from outside of it are counted, so its
+    recursive and internal calls are not counted twice. Calls from frames
+    started before the capture, e.g. the event loop, have no caller."""
+    times = dict.fromkeys(AREAS, 0.0)
+    for function, (*_, cumulative, callers) in stats.stats.items():
+        area = area_of(function)
+        if area is None:
+            continue
+        internal = sum(caller_stats[3] for caller, caller_stats
+                       in callers.items() if area_of(caller) == area)
+        times[area] += max(0.0, cumulative - internal)
+    return times
+
+
+def summarize(stats: pstats.Stats, top: int = 30) -> str:
+    """Summary of a profile: time spent in each area, and the functions
+    with the highest cumulative time."""
+    lines = [f"Profiled {stats.total_tt * 1000:.0f} ms in the GUI thread."]
+    if stats.total_tt:
+        lines.append(f"{'total ms':>10} {'share':>6}  area")
+        for area, spent in area_times(stats).items():
+            lines.append(f"{spent * 1000:>10.0f} "
+                         f"{spent / stats.total_tt:>6.0%}  {area}")
+        lines.append("Areas include what they call, and may overlap. Qt "
+                     "counts calls made from Python only.")
+
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    lines.append(stream.getvalue().strip("\n"))
+    return "\n".join(lines)
+
+
+class Profiler:
+    """Start and stop `cProfile` around an interval chosen by the user.
+
+    Every capture is written to `folder` as a `.prof` file, which can be
+    opened with `pstats` or `snakeviz`, and a `.txt` summary next to it.
+    Only the thread that started the capture is profiled."""
+
+    def __init__(self, folder: Path = consts.PROFILING_PATH):
+        self.folder = folder
+        self.profile = None
+        self.started = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self.profile is not None
+
+    def start(self):
+        if self.running:
+            return
+        self.profile = cProfile.Profile()
+        self.started = time.perf_counter()
+        self.profile.enable()
+        logger.info("Profiling started.")
+
+    def stop(self) -> Optional[Path]:
+        """Stop the capture and save it. Return the `.prof` file, `None`
+        if no capture was running."""
+        if not self.running:
+            return None
+        self.profile.disable()
+        profile, self.profile = self.profile, None
+        elapsed = time.perf_counter() - self.started
+
+        self.folder.mkdir(parents=True, exist_ok=True)
+        filename = self.folder / time.strftime("notebird-%Y%m%d-%H%M%S.prof")
+        profile.dump_stats(str(filename))
+        summary = summarize(pstats.Stats(profile))
+        filename.with_suffix(".txt").write_text(summary, encoding="utf-8")
+        logger.info("Profiled %.1f s, saved to `%s`.", elapsed, filename)
+        return filename
+
+    def toggle(self) -> Optional[Path]:
+        """Start a capture, or stop and save the one running."""
+        if self.running:
+            return self.stop()
+        self.start()
+        return None
+
+
+# Shared by every window, so a capture survives logging out and in
+profiler = Profiler()
@@ -1,14 +1,47 @@
 """Functions to manage hashed and salted passwords."""
+import time
+from typing import Optional, Tuple
+
+from passlib.hash import pbkdf2_sha256
 from passlib.context import CryptContext
 
+from utils.config import load_config
+
+DEFAULT_ROUNDS = 30000
+MIN_ROUNDS = 10000
+
 # CryptContext
 pwd_context = CryptContext(
         schemes=["pbkdf2_sha256"],
         default="pbkdf2_sha256",
-        pbkdf2_sha256__default_rounds=30000
+        pbkdf2_sha256__default_rounds=DEFAULT_ROUNDS
 )
 
 
+def set_rounds(rounds: int):
+    """Hash new passwords with the given rounds.
+
+    Existing hashes with fewer rounds are flagged for an update,
+    stronger ones are kept as they are."""
+    pwd_context.update(pbkdf2_sha256__default_rounds=rounds,
+                       pbkdf2_sha256__min_rounds=rounds)
+
+
+def calibrate_rounds(target_ms: float = 250, samples: int = 5) -> int:
+    """Return the rounds needed for a hash to take `target_ms` here."""
+    probe = pbkdf2_sha256.using(rounds=MIN_ROUNDS)
+
+    # Best of several runs, to ignore hiccups of the machine
+    elapsed = float("inf")
+    for _ in range(samples):
+        start = time.perf_counter()
+        probe.hash("calibration password")
+        elapsed = min(elapsed, time.perf_counter() - start)
+
+    rounds = int(MIN_ROUNDS * target_ms / 1000 / elapsed)
+    return max(MIN_ROUNDS, rounds)
+
+
 def encrypt_password(password: str) -> str:
     """Return the password hashed and salted."""
     return pwd_context.hash(password)
@@ -17,3 +50,15 @@ def encrypt_password(password: str) -> str:
 def check_encrypted_password(password: str, hashed: str) -> bool:
     """Return True if both passwords match."""
     return pwd_context.verify(password, hashed)
+
+
+def check_and_update_password(password: str,
+                              hashed: str) -> Tuple[bool, Optional[str]]:
+    """Return if both passwords match, and a new hash for the password
+    if the current one was made with outdated settings."""
+    return pwd_context.verify_and_update(password, hashed)
+
+
+# Apply rounds calibrated for this machine, if any
+set_rounds(load_config().getint("security", "pbkdf2_rounds",
+                                fallback=DEFAULT_ROUNDS))
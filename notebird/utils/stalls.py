@@ -0,0 +1,142 @@
+"""Detection of stalls of the GUI event loop, sampling what blocked it."""
+import sys
+import time
+import logging
+import threading
+import traceback
+from pathlib import Path
+from collections import defaultdict, deque
+from typing import List
+
+from PySide2 import QtCore
+
+from utils.stats import percentile
+
+logger = logging.getLogger(__name__)
+
+# Frames of files under this folder are reported as call sites
+APP_PATH = Path(__file__).resolve().parents[1]
+
+
+class StallWatchdog(QtCore.QObject):
+    """Measure the latency of the event loop with a heartbeat timer.
+
+    A background thread checks the heartbeat, and while it is late by
+    more than `threshold` seconds it samples the stack of the main thread,
+    so the time of each stall can be attributed to the functions that
+    were running."""
+
+    def __init__(self, threshold: float, sample_interval: float = 0.01,
+                 parent: QtCore.QObject = None):
+        super().__init__(parent)
+        self.threshold = threshold
+        self.sample_interval = sample_interval
+        self.interval = min(0.05, threshold / 2)
+
+        self.last_beat = time.perf_counter()
+        self.latencies = deque(maxlen=100000)
+        self.num_stalls = 0
+        self.stalled_time = 0.0
+        # Call site -> [total time, stalls, longest stall]
+        self.sites = defaultdict(lambda: [0.0, 0, 0.0])
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.beat)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.watch, daemon=True,
+                                       name="stall-watchdog")
+
+    def start(self):
+        self.last_beat = time.perf_counter()
+        self.timer.start(int(self.interval * 1000))
+        self.thread.start()
+
+    def stop(self):
+        self.timer.stop()
+        self.stopped.set()
+        self.thread.join()
+
+    def beat(self):
+        """Heartbeat, run by the event loop of the GUI thread."""
+        now = time.perf_counter()
+        self.latencies.append(max(0.0, now - self.last_beat - self.interval))
+        self.last_beat = now
+
+    def watch(self):
+        """Sample the main thread while the heartbeat is late."""
+        main_id = threading.main_thread().ident
+        samples = []
+        stall_beat = None
+
+        while not self.stopped.wait(self.sample_interval):
+            last_beat = self.last_beat
+            late = time.perf_counter() - last_beat - self.interval
+
+            if samples and last_beat != stall_beat:
+                # Heartbeat is back, the stall is over
+                self.record_stall(last_beat - stall_beat - self.interval,
+                                  samples)
+                samples = []
+
+            if late > self.threshold:
+                frame = sys._current_frames().get(main_id)
+                if frame:
+                    stall_beat = last_beat
+                    samples.append(self.call_sites(frame))
+
+    @staticmethod
+    def call_sites(frame) -> set:
+        """Return the app functions in the stack, plus the innermost
+        function if it belongs to another library."""
+        stack = traceback.extract_stack(frame)
+        sites = set()
+        for entry in stack:
+            path = Path(entry.filename)
+            if APP_PATH in path.parents:
+                sites.add(f"{path.relative_to(APP_PATH).as_posix()}:"
+                          f"{entry.name}")
+        if stack and APP_PATH not in Path(stack[-1].filename).parents:
+            sites.add(f"{Path(stack[-1].filename).name}:{stack[-1].name}")
+        return sites
+
+    def record_stall(self, duration: float, samples: List[set]):
+        """Split the duration of a stall among the sampled call sites."""
+        self.num_stalls += 1
+        self.stalled_time += duration
+
+        weights = defaultdict(int)
+        for sites in samples:
+            for site in sites:
+                weights[site] += 1
+        for site, weight in weights.items():
+            entry = self.sites[site]
+            entry[0] += duration * weight / len(samples)
+            entry[1] += 1
+            entry[2] = max(entry[2], duration)
+
+        slowest = max(weights, key=lambda site: (weights[site], site))
+        logger.warning("GUI stalled for %.0f ms in %s.", duration * 1000,
+                       slowest)
+
+    def report(self, top: int = 15) -> str:
+        """Summary of the event loop latency and the slowest call sites."""
+        lines = []
+        if self.latencies:
+            latencies = list(self.latencies)
+            lines.append(
+                f"Event loop latency over {len(latencies)} beats: "
+                f"p50 {percentile(latencies, 50) * 1000:.1f} ms, "
+                f"p99 {percentile(latencies, 99) * 1000:.1f} ms, "
+                f"max {max(latencies) * 1000:.1f} ms.")
+        lines.append(f"Stalls over {self.threshold * 1000:.0f} ms: "
+                     f"{self.num_stalls} ({self.stalled_time * 1000:.0f} ms "
+                     "in total).")
+
+        if self.sites:
+            lines.append(f"{'total ms':>10} {'stalls':>7} {'max ms':>8}  "
+                         "call site")
+            ranking = sorted(self.sites.items(), key=lambda item: -item[1][0])
+            for site, (total, stalls, longest) in ranking[:top]:
+                lines.append(f"{total * 1000:>10.0f} {stalls:>7} "
+                             f"{longest * 1000:>8.0f}  {site}")
+        return "\n".join(lines)
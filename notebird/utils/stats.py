@@ -0,0 +1,10 @@
+"""Statistics of the latencies measured by benchmarks and diagnostics."""
+from typing import List
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of the given samples."""
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1,
+                      int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
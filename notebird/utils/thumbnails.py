@@ -0,0 +1,110 @@
+"""Previews of the images attached to notes, kept in memory and on disk."""
+import os
+import base64
+import logging
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Encodes the preview of the given attachment, `None` if not possible
+Generate = Callable[[int], Optional[bytes]]
+
+
+def prune_previews(path: Path, keep: Iterable[str]) -> int:
+    """Delete the previews in `path` of images whose hash is not in
+    `keep`. Return the number of files removed."""
+    keep = set(keep)
+    removed = 0
+    for preview in Path(path).glob("*.png"):
+        if preview.stem in keep:
+            continue
+        try:
+            preview.unlink()
+        except OSError as e:
+            logger.warning("Cannot remove preview `%s`: %s.", preview.name, e)
+        else:
+            removed += 1
+    return removed
+
+
+class ThumbnailCache:
+    """Previews of attachments as `data:` URIs, ready to be rendered.
+
+    The most recently used ones are kept in memory within `budget` bytes.
+    All of them are saved as png files in `path`, named after the hash of
+    the attachment, so each one is generated only once."""
+
+    def __init__(self, path: Path, budget: int, generate: Generate):
+        self.path = Path(path)
+        self.generate = generate
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, attachment_id: int, digest: str) -> Optional[str]:
+        """Return the preview of the attachment with the given hash."""
+        key = (attachment_id, digest)
+        uri = self.entries.get(key)
+        if uri is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return uri
+
+        self.misses += 1
+        uri = self.load(key)
+        if uri is not None:
+            self.put(key, uri)
+        return uri
+
+    def put(self, key: Tuple[int, str], uri: str):
+        """Keep a preview in memory, evicting the least recently used."""
+        # `data:` URIs are ASCII, one byte per character
+        if len(uri) > self.budget:
+            return
+
+        self.entries[key] = uri
+        self.size += len(uri)
+        while self.size > self.budget:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def load(self, key: Tuple[int, str]) -> Optional[str]:
+        """Read the preview from disk, generating it if missing."""
+        attachment_id, digest = key
+        preview = self.path / f"{digest}.png"
+        try:
+            data = preview.read_bytes()
+        except FileNotFoundError:
+            data = self.generate(attachment_id)
+            if data is None:
+                return None
+            self.save(preview, data)
+        return "data:image/png;base64," + base64.b64encode(data).decode()
+
+    def save(self, preview: Path, data: bytes):
+        """Write the preview to disk, in one go so that other instances
+        sharing the folder never read half of it."""
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            fd, temp = tempfile.mkstemp(suffix=".tmp", dir=self.path)
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(temp, preview)
+        except OSError as e:
+            logger.warning("Cannot save preview `%s`: %s.", preview.name, e)
+
+    def stats(self) -> dict:
+        """Counters of the use of the memory cache."""
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries), "bytes": self.size,
+                "budget": self.budget}
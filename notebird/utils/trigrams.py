@@ -0,0 +1,180 @@
+"""In-memory trigram index of notes, for fuzzy quick-open."""
+import heapq
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+from utils.extraction import note_title, note_preview
+
+# Postings read to find candidates, starting with the rarest trigrams
+CANDIDATE_BUDGET = 10000
+# Candidates scored in full
+MAX_CANDIDATES = 300
+# Weight of recency in the ranking, over a fuzzy score from 0 to 1
+RECENCY_WEIGHT = 0.15
+# Dead slots allowed per live one, plus a margin, before compacting
+DEAD_RATIO = 2
+DEAD_MARGIN = 1000
+
+
+class Match(NamedTuple):
+    """Note found by a quick-open query."""
+    note_id: int
+    title: str
+    score: float
+
+
+def normalize(text: str) -> str:
+    """Lowercase words separated by single spaces, with a leading space
+    so trigrams can also match the start of words."""
+    return " " + " ".join(text.lower().split())
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i+3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """Index of the title and the plain text preview of each note.
+
+    Notes take slots in parallel arrays, and every trigram maps to an
+    array of the slots containing it. Removed notes leave a dead slot
+    behind, skipped by searches, until `needs_compaction` and the owner
+    replaces the index with a `compacted` copy, e.g. built in another
+    thread. Edited notes move to a new slot, so with notes added oldest
+    first, later slots hold more recent notes."""
+
+    def __init__(self):
+        self.note_ids = array("q")
+        self.updates = array("d")
+        self.alive = bytearray()
+        self.titles: List[str] = []
+        self.texts: List[str] = []
+        self.postings: Dict[str, array] = {}
+        self.slots: Dict[int, int] = {}
+        self.oldest = self.newest = None
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def build(self, notes: Iterable[Tuple[int, str, str, float]]):
+        """Index the given `(note_id, title, preview, last_update)`, as
+        stored in the database."""
+        for note in sorted(notes, key=lambda note: note[3]):
+            self.add_preview(*note)
+
+    def add(self, note_id: int, content: str, last_update: float):
+        """Index a note, replacing the previous version if any."""
+        self.add_preview(note_id, note_title(content), note_preview(content),
+                         last_update)
+
+    def add_preview(self, note_id: int, title: str, preview: str,
+                    last_update: float):
+        """Index a note by its title and the start of its text."""
+        if note_id in self.slots:
+            self.remove(note_id)
+        self.insert(note_id, title, normalize(title + "\n" + preview),
+                    last_update)
+
+    def insert(self, note_id: int, title: str, text: str,
+               last_update: float):
+        """Put a note not indexed yet in a new slot, by its title and
+        its normalized text."""
+        slot = len(self.note_ids)
+        self.note_ids.append(note_id)
+        self.updates.append(last_update)
+        self.alive.append(1)
+        self.titles.append(title)
+        self.texts.append(text)
+        for trigram in trigrams(text):
+            posting = self.postings.get(trigram)
+            if posting is None:
+                self.postings[trigram] = array("I", (slot,))
+            else:
+                posting.append(slot)
+        self.slots[note_id] = slot
+        if self.oldest is None:
+            self.oldest = self.newest = last_update
+        self.oldest = min(self.oldest, last_update)
+        self.newest = max(self.newest, last_update)
+
+    def remove(self, note_id: int):
+        """Forget a note, if indexed."""
+        slot = self.slots.pop(note_id, None)
+        if slot is None:
+            return
+        self.alive[slot] = 0
+        self.titles[slot] = self.texts[slot] = ""
+
+    def needs_compaction(self) -> bool:
+        """Whether dead slots waste enough memory and search time to
+        rebuild the index without them."""
+        dead = len(self.note_ids) - len(self.slots)
+        return dead > DEAD_RATIO * len(self.slots) + DEAD_MARGIN
+
+    def live_notes(self) -> List[Tuple[int, str, str, float]]:
+        """Return the `(note_id, title, text, last_update)` of the
+        indexed notes, oldest slot first, to build a `compacted` index."""
+        return [(self.note_ids[slot], self.titles[slot], self.texts[slot],
+                 self.updates[slot]) for slot in sorted(self.slots.values())]
+
+    @classmethod
+    def compacted(cls, notes: Iterable[Tuple[int, str, str, float]]
+                  ) -> "TrigramIndex":
+        """Return a new index of the given `live_notes`, without dead
+        slots."""
+        index = cls()
+        for note in notes:
+            index.insert(*note)
+        return index
+
+    def recency(self, slot: int) -> float:
+        """Last update of a note, from 0 (oldest) to 1 (newest)."""
+        span = self.newest - self.oldest
+        return (self.updates[slot] - self.oldest) / span if span else 1.0
+
+    def search(self, query: str, limit: int = 20) -> List[Match]:
+        """Return the notes best matching the query, best first."""
+        query = normalize(query)
+        if len(query) < 3:
+            # Too short for trigrams, latest notes containing it
+            slots = (slot for slot in reversed(range(len(self.note_ids)))
+                     if self.alive[slot] and query.strip() in self.texts[slot])
+            return [Match(self.note_ids[slot], self.titles[slot],
+                          self.recency(slot))
+                    for slot, _ in zip(slots, range(limit))]
+
+        wanted = trigrams(query)
+        known = sorted((self.postings[trigram] for trigram in wanted
+                        if trigram in self.postings), key=len)
+        if not known:
+            return []
+
+        # Candidates share the rarest trigrams of the query. Postings are
+        # read newest first, so ties favor recent notes
+        hits = Counter()
+        budget = CANDIDATE_BUDGET
+        for posting in known:
+            if budget <= 0:
+                break
+            latest = posting[:-budget-1:-1]
+            hits.update(latest)
+            budget -= len(latest)
+        candidates = heapq.nlargest(
+            MAX_CANDIDATES, (slot for slot in hits if self.alive[slot]),
+            key=hits.get)
+
+        matches = []
+        stripped = query.strip()
+        for slot in candidates:
+            text = self.texts[slot]
+            score = sum(trigram in text for trigram in wanted) / len(wanted)
+            if stripped in text:
+                # Whole query, better at the start of a word or in the title
+                score += 0.3 if query in text else 0.2
+                if stripped in self.titles[slot].lower():
+                    score += 0.2
+            score += RECENCY_WEIGHT * self.recency(slot)
+            matches.append(Match(self.note_ids[slot], self.titles[slot],
+                                 score))
+        return heapq.nlargest(limit, matches, key=lambda match: match.score)
@@ -1,18 +1,36 @@
 """Crud window, main one, where user interacts with their data."""
+import os
+import re
 import time
 import logging
+from functools import partial
 from pathlib import Path
+from typing import Optional
 
-from PIL import Image
 from PySide2 import QtWidgets, QtCore, QtGui
 
 from db import dbhelper
-from windows import login
-from utils import consts, exceptions
+from windows import login, quick_open, select_notes
+from utils import consts, exceptions, images, profiling
+from utils.extraction import add_tag, normalize_tag, remove_tag
+from utils.cache import ContentCache
+from utils.thumbnails import ThumbnailCache
+from utils.trigrams import TrigramIndex
 from utils.pyside_dynamic import load_ui
 from utils.custom_widgets import ClickableLineEdit, ClickablePlainTextEdit
 from utils.validations import validate_username, validate_pwd, validate_name
 
+logger = logging.getLogger(__name__)
+
+# Milliseconds between checks for notes changed by other instances
+CHANGES_POLL_INTERVAL = 1000
+# Notes of tab0 fetched at once, more are fetched when reaching the last
+NOTES_PAGE = 50
+# Bytes of previews of attachments kept in memory
+PREVIEW_CACHE = 8 * 1024**2
+# Images of notes pointing to an attachment, `<img src="attachment:ID">`
+ATTACHMENT_SRC = re.compile(r"""src=(["'])attachment:(\d+)\1""")
+
 
 def epoch_to_local_date(timestamp: float):
     """Epoch timestamp to `day/month/year - time` representation."""
@@ -45,10 +63,37 @@ class CrudWindow(QtWidgets.QMainWindow):
         self.actionLogout.setStatusTip("Log out of the application")
         self.actionLogout.triggered.connect(self.logout)
 
+        # Only a database in memory needs to be saved
+        self.actionSaveSnapshot.setShortcut("Ctrl+S")
+        self.actionSaveSnapshot.setStatusTip(
+            "Copy the in-memory database to a file")
+        self.actionSaveSnapshot.triggered.connect(self.save_snapshot)
+        self.actionSaveSnapshot.setVisible(
+            self.database.name == dbhelper.MEMORY)
+
         self.actionNew.setShortcut("Ctrl+N")
         self.actionNew.setStatusTip("Create a new note")
         self.actionNew.triggered.connect(self.new_note)
 
+        self.actionFilter.setShortcut("Ctrl+F")
+        self.actionFilter.setStatusTip(
+            "Show only notes with a hashtag or linking to a domain")
+        self.actionFilter.triggered.connect(self.filter_notes)
+
+        self.actionQuickOpen.setShortcut("Ctrl+P")
+        self.actionQuickOpen.setStatusTip(
+            "Jump to a note by typing part of it")
+        self.actionQuickOpen.triggered.connect(self.quick_open)
+
+        self.actionSelectNotes.setShortcut("Ctrl+M")
+        self.actionSelectNotes.setStatusTip(
+            "Delete or tag many notes at once")
+        self.actionSelectNotes.triggered.connect(self.select_notes)
+
+        self.actionAttach.setShortcut("Ctrl+I")
+        self.actionAttach.setStatusTip("Insert an image in the edited note")
+        self.actionAttach.triggered.connect(self.attach_image)
+
         self.actionUpdate.setShortcut("Ctrl+E")
         self.actionUpdate.setStatusTip("Update account info")
         self.actionUpdate.triggered.connect(self.update_info)
@@ -65,12 +110,21 @@ class CrudWindow(QtWidgets.QMainWindow):
         self.actionAbout.setStatusTip("Show app info")
         self.actionAbout.triggered.connect(self.about_info)
 
+        # Hidden, only reachable by its shortcut
+        self.actionProfile = QtWidgets.QAction("Profile", self)
+        self.actionProfile.setShortcut("Ctrl+Shift+F12")
+        self.actionProfile.triggered.connect(self.toggle_profiling)
+        self.addAction(self.actionProfile)
+
         # Inputboxes
         self.username_line_edit.clicked.connect(self.label_message.clear)
         self.name_line_edit.clicked.connect(self.label_message.clear)
         self.pwd_line_edit.clicked.connect(self.label_message.clear)
         self.comment_block.clicked.connect(self.label_message2.clear)
 
+        # Links of the displayed note, attachments are saved to a file
+        self.note_rendered_label.linkActivated.connect(self.open_link)
+
         # Buttons
         self.btn_create.clicked.connect(self.new_note)
         self.btn_discard_note.clicked.connect(self.discard_note)
@@ -95,9 +149,70 @@ class CrudWindow(QtWidgets.QMainWindow):
         if pos:
             self.move(pos)
 
+        # Hashtag or domain of the notes shown in tab0, all if `None`
+        self.note_filter = None
+        self.filter_ids = None
+        self.filter_label = QtWidgets.QLabel()
+        self.statusbar.addPermanentWidget(self.filter_label)
+
+        # Order and period of the notes shown in tab0, fetched by pages
+        self.note_order = "note_id"
+        self.note_period = None
+        self.shown = []
+        self.more_notes = False
+        # Notes of tab1 are fetched by pages too, sorted by id, into
+        # `current_user["notes"]`
+        self.more_edited = False
+        self.period_days = {self.actionPeriodAll: None,
+                            self.actionPeriodDay: 1,
+                            self.actionPeriodWeek: 7,
+                            self.actionPeriodMonth: 30}
+        sort_group = QtWidgets.QActionGroup(self)
+        for action in (self.actionSortNumber, self.actionSortCreation,
+                       self.actionSortUpdate):
+            sort_group.addAction(action)
+        period_group = QtWidgets.QActionGroup(self)
+        for action in self.period_days:
+            period_group.addAction(action)
+        for action in sort_group.actions() + period_group.actions() + [
+                self.actionSortDescending]:
+            action.triggered.connect(self.change_note_view)
+
+        # Built in the background the first time the quick-open palette
+        # is used, and rebuilt there when dead slots pile up
+        self.quick_open_index = None
+        self.index_builder = None
+        # Notes changed while building, `None` for deleted ones
+        self.index_pending = {}
+
+        # Keep only some note contents in memory, if there is a budget
+        self.contents = None
+        if self.database.content_budget:
+            self.contents = ContentCache(self.database.content_budget,
+                                         self.load_content)
+
+        # Previews of the images attached to notes, generated once
+        self.previews = ThumbnailCache(consts.PREVIEW_PATH, PREVIEW_CACHE,
+                                       self.make_preview)
+
+        # Tabs are filled when shown, hidden ones are only marked as stale
+        self.tab_populators = {
+            self.tabWidget.indexOf(self.tab_main): self.populate_main_tab,
+            self.tabWidget.indexOf(self.tab_edition): self.populate_notes_tab,
+            self.tabWidget.indexOf(self.tab_account):
+                self.populate_account_tab}
+        self.stale_tabs = set()
+        self.tabWidget.currentChanged.connect(self.tab_changed)
+
         # Fill window with user's info
         self.populate_user_info()
 
+        # Watch for notes changed by other instances of the app
+        self.data_version = None
+        self.changes_timer = QtCore.QTimer(self)
+        self.changes_timer.timeout.connect(self.check_external_changes)
+        self.changes_timer.start(CHANGES_POLL_INTERVAL)
+
     def save_note(self):
         """Update an existing note or create a new one."""
 
@@ -109,21 +224,22 @@ class CrudWindow(QtWidgets.QMainWindow):
         if note_position == 0:
             # New note
             try:
-                self.database.add_item(user_id, text)
+                note_id = self.database.add_item(user_id, text)
 
             except exceptions.DatabaseError as e:
                 self.label_message.setText("Internal error.")
-                logging.warning(e.message)
+                logger.warning(e.message)
 
             else:
-                # Refresh user's info
-                self.populate_user_info()
+                self.note_saved(note_id)
 
                 # Finish edition
-                last_note = len(self.database.current_user["notes"])
+                last_note = self.find_edited(note_id)
+                self.spinBox_2.setMaximum(
+                    len(self.database.current_user["notes"]))
                 self.spinBox_2.setValue(last_note)
 
-                logging.info(f"`{username}` created a new note.")
+                logger.info("`%s` created a new note.", username)
                 self.label_message2.setText("New note created.")
 
         else:
@@ -134,16 +250,15 @@ class CrudWindow(QtWidgets.QMainWindow):
 
             except exceptions.DatabaseError as e:
                 self.label_message.setText("Internal error.")
-                logging.warning(e.message)
+                logger.warning(e.message)
 
             else:
-                # Refresh user's info
-                self.populate_user_info()
+                self.note_saved(note_id)
 
                 # Finish edition
                 self.spinBox_2.setValue(note_position)
 
-                logging.info(f"`{username}` updated `note {note_id}`.")
+                logger.info("`%s` updated `note %d`.", username, note_id)
                 self.label_message2.setText(f"Note {note_position} updated.")
 
     def delete_note(self):
@@ -159,16 +274,18 @@ class CrudWindow(QtWidgets.QMainWindow):
 
         except exceptions.DatabaseError as e:
             self.label_message.setText("Internal error.")
-            logging.warning(e.message)
+            logger.warning(e.message)
 
         else:
+            self.note_changed(note_id)
+
             # Refresh user's info
             self.populate_user_info()
 
             # Finish edition
             self.discard_note()
 
-            logging.info(f"`{username}` deleted `note {note_id}`.")
+            logger.info("`%s` deleted `note %d`.", username, note_id)
             self.label_message2.setText(f"Note {note_position} deleted.")
 
     def save_info(self):
@@ -199,7 +316,7 @@ class CrudWindow(QtWidgets.QMainWindow):
 
                 except exceptions.DatabaseError as e:
                     self.label_message.setText("Internal error.")
-                    logging.warning(e.message)
+                    logger.warning(e.message)
 
                 else:
                     if not user_ok:
@@ -212,23 +329,23 @@ class CrudWindow(QtWidgets.QMainWindow):
 
                         except exceptions.DatabaseError as e:
                             self.label_message.setText("Internal error.")
-                            logging.warning(e.message)
+                            logger.warning(e.message)
 
                         except exceptions.ValidationError as e:
                             self.label_message.setText(
                                 f"Invalid field {', '.join(e.columns)}")
-                            logging.debug(f"`{e.columns}` - {e.message}")
+                            logger.debug("`%s` - %s", e.columns, e.message)
 
                         except exceptions.UsernameExistsError as e:
                             self.label_message.setText(
                                 f"User {user} already exists.")
-                            logging.debug(e.message)
+                            logger.debug(e.message)
 
                         else:
                             # Everything ok
-                            logging.info(
-                                f"Info updated for `user {user_id}` "
-                                f"- `{user}`.")
+                            logger.info(
+                                "Info updated for `user %d` - `%s`.",
+                                user_id, user)
 
                             # Refresh user's info
                             self.populate_user_info()
@@ -242,41 +359,51 @@ class CrudWindow(QtWidgets.QMainWindow):
         # Some validations failed
         elif not validations['username']:
             self.label_message.setText("Invalid username (min. 5 characters).")
-            logging.debug("The username entered is too short.")
+            logger.debug("The username entered is too short.")
 
         elif not validations['name']:
             self.label_message.setText(
                 "Please enter your full name (min. 2 words).")
-            logging.debug("The name entered is too short.")
+            logger.debug("The name entered is too short.")
 
         elif not validations['password']:
             self.label_message.setText("Weak password (min. 8 characters).")
-            logging.debug("The password entered is too weak.")
+            logger.debug("The password entered is too weak.")
 
     def change_displayed_note(self, note: int):
         """Change the note displayed in tab0."""
 
         if note > 0:
-            text = self.database.current_user["notes"][note-1][1]
-            self.note_rendered_label.setText(text)
+            notes = self.shown_notes()
+            text = self.note_content(notes[note-1])
+            self.note_rendered_label.setText(self.render_note(text))
             self.creation_date_label.setText(
-                epoch_to_local_date(
-                    self.database.current_user["notes"][note-1][2]))
+                epoch_to_local_date(notes[note-1][2]))
             self.last_update_label.setText(
-                epoch_to_local_date(
-                        self.database.current_user["notes"][note-1][3]))
-            note_content = self.database.current_user["notes"][note-1][1]
-            self.number_words_label.setText(str(len(note_content.split())))
+                epoch_to_local_date(notes[note-1][3]))
+            self.number_words_label.setText(str(len(text.split())))
+
+            # Reached the last note fetched
+            if note == len(self.shown) and self.more_notes:
+                self.load_more_notes()
+                self.spinBox.setMaximum(len(self.shown))
 
     def change_edited_note(self, note: int):
         """Change the note displayed in tab1."""
 
         if note > 0:
-            text = self.database.current_user["notes"][note-1][1]
+            notes = self.database.current_user["notes"]
+            text = self.note_content(notes[note-1])
             self.comment_block.setPlainText(text)
             self.btn_create.setEnabled(True)
             self.btn_delete.setEnabled(True)
 
+            # Reached the last note fetched
+            if note == len(notes) and self.more_edited:
+                self.load_more_edited()
+                self.spinBox_2.setMaximum(
+                    len(self.database.current_user["notes"]))
+
         else:
             self.comment_block.clear()
             self.btn_create.setEnabled(False)
@@ -289,32 +416,591 @@ class CrudWindow(QtWidgets.QMainWindow):
         self.label_message2.clear()
 
     def populate_user_info(self):
-        """Fill application with user's info."""
+        """Fill application with user's info. Notes are counted, and only
+        the first page of them is fetched."""
 
         try:
-            user_info = self.database.get_user_info(
+            # Changes made from now on will be pulled by the next check
+            last_change = self.database.get_last_change(
                 self.database.current_user["id"])
+            user_info = self.database.get_user_summary(
+                self.database.current_user["id"])
+
+        except exceptions.DatabaseError as e:
+            logger.warning(e.message)
+
+        else:
+            self.database.current_user["username"] = user_info[0]
+            self.database.current_user["name"] = user_info[1]
+            self.database.current_user["avatar"] = user_info[2]
+            self.database.current_user["num_notes"] = user_info[3]
+            self.database.current_user["last_update"] = user_info[4]
+            self.database.current_user["last_change"] = last_change
+            self.load_edited_notes()
+
+            self.refresh_tabs(*self.tab_populators)
+
+    def refresh_note_stats(self):
+        """Count the user's notes again, after some of them changed."""
+
+        try:
+            user_info = self.database.get_user_summary(
+                self.database.current_user["id"])
+
+        except exceptions.DatabaseError as e:
+            logger.warning(e.message)
+
+        else:
+            if user_info:
+                self.database.current_user["num_notes"] = user_info[3]
+                self.database.current_user["last_update"] = user_info[4]
+
+    def note_saved(self, note_id: int):
+        """Put a note saved in this window in the notes in memory, instead
+        of reloading all of them, and refresh the tabs listing notes."""
+
+        try:
+            note = self.database.get_item(
+                self.database.current_user["id"], note_id)
+
+        except exceptions.DatabaseError as e:
+            logger.warning(e.message)
+            note = None
+
+        if note is None:
+            self.populate_user_info()
+            return
+
+        self.note_changed(note_id, note[1], note[3])
+        if self.contents:
+            note = (note_id, None, *note[2:])
+
+        # Sorted by id, new notes go last, or come with the last page if
+        # not fetched yet. Drop the empty row used when the user had no
+        # notes
+        notes = self.database.current_user["notes"]
+        position = self.note_position(note_id)
+        if position:
+            notes[position-1] = note
+        elif not self.more_edited:
+            if notes[0][0]:
+                notes.append(note)
+            else:
+                self.database.current_user["notes"] = [note]
+        self.refresh_note_stats()
+
+        self.refresh_tabs(self.tabWidget.indexOf(self.tab_main),
+                          self.tabWidget.indexOf(self.tab_edition))
+
+    def refresh_tabs(self, *tabs: int):
+        """Fill again the given tabs if visible, marking the others as
+        stale until they are shown."""
+
+        for tab in tabs:
+            if tab == self.tabWidget.currentIndex():
+                self.stale_tabs.discard(tab)
+                self.tab_populators[tab]()
+            else:
+                self.stale_tabs.add(tab)
+
+    def tab_changed(self, tab: int):
+        """Fill the tab being shown if its data changed while hidden."""
+
+        if tab in self.stale_tabs:
+            self.stale_tabs.discard(tab)
+            self.tab_populators[tab]()
+
+    def show_tab(self, tab: int):
+        """Switch to the given tab, filling it again."""
+
+        self.stale_tabs.add(tab)
+        self.tabWidget.setCurrentIndex(tab)
+        # No signal if it was already shown
+        self.tab_changed(tab)
+
+    def check_external_changes(self):
+        """Pull the notes changed by other instances since last check."""
+
+        if not self.database.current_user:
+            return
+
+        try:
+            # Cheap check, only changes when others commit
+            data_version = self.database.get_data_version(
+                self.database.current_user["id"])
+            if data_version == self.data_version:
+                return
+            self.data_version = data_version
+
+            changes = self.database.get_changes(
+                self.database.current_user["id"],
+                self.database.current_user["last_change"])
+
+        except exceptions.DatabaseError as e:
+            logger.warning(e.message)
+
+        else:
+            if changes:
+                self.apply_note_changes(changes)
+
+    def apply_note_changes(self, changes: list):
+        """Update the notes in memory and on screen with the given
+        changes, without reloading the rest of the user's info."""
+
+        notes = {note[0]: note for note in self.database.current_user["notes"]
+                 if note[0]}
+        # Notes after the last one fetched come with their page
+        last_fetched = max(notes, default=0) if self.more_edited else None
+        shown_id = self.note_id_at(self.spinBox.value(), self.shown_notes())
+        edited_id = self.note_id_at(self.spinBox_2.value())
+
+        changed_ids = set()
+        for _, note_id, deleted, *note in changes:
+            if (not deleted and note_id in notes and
+                    notes[note_id][3] == note[2]):
+                # Saved in this window, already in memory
+                continue
+            changed_ids.add(note_id)
+            if deleted or note[0] is None:
+                notes.pop(note_id, None)
+                self.note_changed(note_id)
+            else:
+                self.note_changed(note_id, note[0], note[2])
+                if last_fetched is not None and note_id > last_fetched:
+                    continue
+                if self.contents:
+                    note[0] = None
+                notes[note_id] = (note_id, *note)
+
+        self.database.current_user["last_change"] = changes[-1][0]
+        # Keep the empty row used when the user has no notes
+        self.database.current_user["notes"] = (
+            [notes[note_id] for note_id in sorted(notes)] or
+            [(None, None, None, None)])
+        self.refresh_note_stats()
+        logger.debug("Applied %d changes made by other instances.",
+                     len(changes))
+
+        # Notes tab, unless the note being edited is gone
+        if edited_id in changed_ids:
+            self.label_message2.setText(
+                "This note was changed in another window.")
+        num_notes = len(notes)
+        self.spinBox_2.setMaximum(num_notes)
+        if edited_id:
+            self.spinBox_2.blockSignals(True)
+            self.spinBox_2.setValue(self.note_position(edited_id))
+            self.spinBox_2.blockSignals(False)
+
+        # Main tab, keeping the displayed note if it still exists
+        main_tab = self.tabWidget.indexOf(self.tab_main)
+        self.refresh_tabs(main_tab)
+        if main_tab not in self.stale_tabs:
+            shown_position = self.find_shown(shown_id)
+            if shown_position:
+                self.spinBox.setValue(shown_position)
+
+    def note_id_at(self, position: int, notes: list = None) -> int:
+        """Return the id of the note at the given position (from 1) of
+        `notes`, all the user's notes by default."""
+
+        notes = notes or self.database.current_user["notes"]
+        if position > 0:
+            return notes[position-1][0]
+        return 0
+
+    def note_position(self, note_id: int, notes: list = None) -> int:
+        """Return the position (from 1) of the note with the given id in
+        `notes`, or 0 if there is no such note."""
+
+        notes = notes or self.database.current_user["notes"]
+        for position, note in enumerate(notes):
+            if note[0] == note_id:
+                return position + 1
+        return 0
+
+    def filter_notes(self):
+        """Ask for a hashtag or domain and show only the notes with it."""
+
+        user_id = self.database.current_user["id"]
+        try:
+            tags = self.database.get_tags(user_id)
+            domains = self.database.get_link_domains(user_id)
 
         except exceptions.DatabaseError as e:
-            logging.warning(e.message)
+            logger.warning(e.message)
 
         else:
-            self.database.current_user["username"] = user_info[0][0]
-            self.database.current_user["name"] = user_info[0][1]
-            self.database.current_user["avatar"] = user_info[0][2]
-            self.database.current_user["notes"] = [
-                note[3:] for note in user_info]
+            items = (["All notes"] + [f"#{tag}" for tag, _ in tags] +
+                     [domain for domain, _ in domains])
+            current = (items.index(self.note_filter)
+                       if self.note_filter in items else 0)
+            text, ok = QtWidgets.QInputDialog.getItem(
+                self, "Filter notes", "Hashtag (#tag) or linked domain:",
+                items, current, True)
+
+            if ok:
+                text = text.strip()
+                self.note_filter = text if text not in ("", items[0]) else None
+                self.show_tab(self.tabWidget.indexOf(self.tab_main))
+
+    def quick_open(self):
+        """Jump to a note found by typing part of it."""
+
+        if self.quick_open_index is None and self.index_builder is None:
+            self.build_quick_open_index(partial(
+                self.index_notes, self.database.current_user["id"]))
+
+        # Searches the index being built once it is ready
+        dial = quick_open.QuickOpenDialog(self.quick_open_index, self)
+        builder = self.index_builder
+        if builder:
+            builder.ready.connect(dial.set_index)
+        accepted = dial.exec_()
+        if builder:
+            builder.ready.disconnect(dial.set_index)
+        if accepted:
+            self.show_note(dial.note_id)
+
+    def index_notes(self, user_id: int) -> TrigramIndex:
+        """Read the previews of the user's notes and index them, in the
+        thread of the index builder."""
+
+        index = TrigramIndex()
+        index.build((note[0], note[1], note[4], note[3])
+                    for note in self.all_previews(user_id))
+        return index
+
+    def build_quick_open_index(self, build):
+        """Build the quick-open index in the background, keeping track of
+        the notes changed meanwhile."""
+
+        self.index_pending = {}
+        self.index_builder = quick_open.IndexBuilder(build)
+        self.index_builder.ready.connect(self.quick_open_index_ready)
+        self.index_builder.start()
+
+    def quick_open_index_ready(self, index: TrigramIndex):
+        """Use the index built, with the notes changed meanwhile."""
+
+        for note_id, change in self.index_pending.items():
+            if change is None:
+                index.remove(note_id)
+            else:
+                index.add(note_id, *change)
+        self.quick_open_index = index
+        self.index_builder = None
+        self.index_pending = {}
+
+    def select_notes(self):
+        """Delete, tag or untag the notes picked by the user, all in one
+        transaction, reloading the user's info once."""
+
+        # Listed once read in the background
+        dial = select_notes.SelectNotesDialog(None, self)
+        loader = select_notes.PreviewLoader(partial(
+            list, self.all_previews(self.database.current_user["id"])))
+        loader.ready.connect(dial.set_notes)
+        loader.start()
+        accepted = dial.exec_()
+        loader.ready.disconnect(dial.set_notes)
+        if not accepted or not dial.note_ids:
+            return
+
+        user_id = self.database.current_user["id"]
+        username = self.database.current_user["username"]
+        num_notes = len(dial.note_ids)
+
+        if dial.action == select_notes.DELETE:
+            text = (f"Are you sure you want to delete {num_notes} notes?\n"
+                    "This action cannot be undone.")
+            response = QtWidgets.QMessageBox.warning(
+                self, "Delete notes", text,
+                QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.Cancel,
+                QtWidgets.QMessageBox.Cancel)
+            if response != QtWidgets.QMessageBox.Yes:
+                return
+
+            try:
+                deleted = self.database.delete_items(user_id, dial.note_ids)
+
+            except exceptions.DatabaseError as e:
+                self.statusbar.showMessage("Cannot delete notes.", 5000)
+                logger.warning(e.message)
+                return
+
+            for note_id in dial.note_ids:
+                self.note_changed(note_id)
+            message = f"{deleted} notes deleted."
+            logger.info("`%s` deleted %d notes.", username, deleted)
 
+        else:
+            adding = dial.action == select_notes.ADD_TAG
+            text, ok = QtWidgets.QInputDialog.getText(
+                self, "Add hashtag" if adding else "Remove hashtag",
+                "Hashtag:")
+            if not ok:
+                return
+            tag = normalize_tag(text)
+            if tag is None:
+                self.statusbar.showMessage("Not a valid hashtag.", 5000)
+                return
+
+            transform = partial(add_tag if adding else remove_tag, tag=tag)
+            try:
+                changed = self.database.transform_items(
+                    user_id, dial.note_ids, transform)
+
+            except exceptions.DatabaseError as e:
+                self.statusbar.showMessage("Cannot update notes.", 5000)
+                logger.warning(e.message)
+                return
+
+            epoch_time = time.time()
+            for note_id, content in changed.items():
+                self.note_changed(note_id, content, epoch_time)
+            message = (f"#{tag} {'added to' if adding else 'removed from'} "
+                       f"{len(changed)} notes.")
+            logger.info("`%s` updated %d notes.", username, len(changed))
+
+        # Refresh user's info, once for all the notes
+        self.populate_user_info()
+        self.statusbar.showMessage(message, 5000)
+
+    def note_changed(self, note_id: int, content: str = None,
+                     last_update: float = None):
+        """Keep the quick-open index and the cached contents in line with
+        a note saved with the given content, or deleted if there is no
+        content."""
+
+        if self.contents:
+            if content is None:
+                self.contents.discard(note_id)
+            else:
+                self.contents.put(note_id, content)
+
+        if self.index_builder:
+            self.index_pending[note_id] = (
+                None if content is None else (content, last_update))
+        if self.quick_open_index is None:
+            return
+        if content is None:
+            self.quick_open_index.remove(note_id)
+        else:
+            self.quick_open_index.add(note_id, content, last_update)
+
+        # Rebuild without removed notes, searching this index meanwhile
+        if not self.index_builder and self.quick_open_index.needs_compaction():
+            self.build_quick_open_index(partial(
+                TrigramIndex.compacted, self.quick_open_index.live_notes()))
+
+    def load_content(self, note_id: int) -> str:
+        """Read the content of a note of the user from the database."""
+
+        try:
+            note = self.database.get_item(
+                self.database.current_user["id"], note_id)
+
+        except exceptions.DatabaseError as e:
+            logger.warning(e.message)
+
+        else:
+            return note[1] if note else None
+
+    def note_content(self, note: tuple) -> str:
+        """Return the content of the given note, from the cache if only
+        metadata of notes is kept in memory."""
+
+        if note[1] is not None or not self.contents:
+            return note[1]
+        return self.contents.get(note[0]) or ""
+
+    def all_previews(self, user_id: int):
+        """Yield the title and preview of all the notes of the user, read
+        from the database a page at a time.
+
+        Meant to be read outside the GUI thread, the connection of the
+        window can be used from any thread."""
+
+        after = None
+        while True:
+            try:
+                page = self.database.list_items(
+                    user_id, limit=NOTES_PAGE, after=after)
+
+            except exceptions.DatabaseError as e:
+                logger.warning(e.message)
+                return
+
+            yield from page
+            if len(page) < NOTES_PAGE:
+                return
+            after = dbhelper.note_cursor(page[-1])
+
+    def show_note(self, note_id: int):
+        """Display the given note in tab0."""
+
+        # Fills it if stale
+        self.tabWidget.setCurrentIndex(self.tabWidget.indexOf(self.tab_main))
+        position = self.find_shown(note_id)
+        if not position:
+            # Hidden by the filter or the period
+            self.note_filter = None
+            self.actionPeriodAll.setChecked(True)
+            self.note_period = None
             self.populate_main_tab()
-            self.populate_notes_tab()
-            self.populate_account_tab()
+            position = self.find_shown(note_id)
+
+        self.spinBox.setValue(position)
+
+    def refresh_filter(self):
+        """Look up which notes match the current filter."""
+
+        self.filter_ids = None
+        if self.note_filter:
+            user_id = self.database.current_user["id"]
+            try:
+                if self.note_filter.startswith("#"):
+                    notes = self.database.find_items_by_tag(
+                        user_id, self.note_filter)
+                else:
+                    notes = self.database.find_items_by_domain(
+                        user_id, self.note_filter)
+
+            except exceptions.DatabaseError as e:
+                logger.warning(e.message)
+
+            else:
+                self.filter_ids = {note[0] for note in notes}
+
+        if self.filter_ids is None:
+            self.filter_label.clear()
+        else:
+            self.filter_label.setText(
+                f"{len(self.filter_ids)} notes with {self.note_filter}")
+
+    def change_note_view(self):
+        """Sort and filter the notes of tab0 as chosen in the menu."""
+
+        column = "note_id"
+        if self.actionSortCreation.isChecked():
+            column = "creation"
+        elif self.actionSortUpdate.isChecked():
+            column = "last_update"
+        descending = self.actionSortDescending.isChecked()
+        self.note_order = ("-" if descending else "") + column
+
+        self.note_period = next(days for action, days in
+                                self.period_days.items()
+                                if action.isChecked())
+
+        self.show_tab(self.tabWidget.indexOf(self.tab_main))
+
+    def load_shown_notes(self):
+        """Fetch the first page of notes of tab0."""
+
+        self.shown = []
+        self.more_notes = True
+        self.load_more_notes()
+
+    def load_more_notes(self):
+        """Fetch the next page of notes of tab0, sorted and filtered by
+        the database."""
+
+        user_id = self.database.current_user["id"]
+        updated_between = None
+        if self.note_period:
+            updated_between = (time.time() - self.note_period * 86400, None)
+
+        num_shown = len(self.shown)
+        # Pages may have no notes with the hashtag or domain
+        while self.more_notes and len(self.shown) == num_shown:
+            after = None
+            if self.shown:
+                after = dbhelper.note_cursor(self.shown[-1], self.note_order)
+            try:
+                page = self.database.query_items(
+                    user_id, self.note_order, None, updated_between,
+                    NOTES_PAGE, after, self.contents is None)
+
+            except exceptions.DatabaseError as e:
+                logger.warning(e.message)
+                self.more_notes = False
+
+            else:
+                self.more_notes = len(page) == NOTES_PAGE
+                if self.filter_ids is not None:
+                    page = [note for note in page
+                            if note[0] in self.filter_ids]
+                self.shown.extend(page)
+
+    def find_shown(self, note_id: int) -> int:
+        """Return the position (from 1) of the given note in tab0,
+        fetching more notes until found, or 0 if it is not shown."""
+
+        if not note_id:
+            return 0
+        position = self.note_position(note_id, self.shown_notes())
+        while not position and self.more_notes:
+            self.load_more_notes()
+            position = self.note_position(note_id, self.shown_notes())
+        return position
+
+    def load_edited_notes(self):
+        """Fetch the first page of notes of tab1."""
+
+        self.database.current_user["notes"] = [(None, None, None, None)]
+        self.more_edited = True
+        self.load_more_edited()
+
+    def load_more_edited(self):
+        """Fetch the next page of notes of tab1, sorted by id."""
+
+        # Drop the empty row used when the user has no notes
+        notes = [note for note in self.database.current_user["notes"]
+                 if note[0]]
+        after = dbhelper.note_cursor(notes[-1]) if notes else None
+        try:
+            page = self.database.query_items(
+                self.database.current_user["id"], limit=NOTES_PAGE,
+                after=after, content=self.contents is None)
+
+        except exceptions.DatabaseError as e:
+            logger.warning(e.message)
+            self.more_edited = False
+
+        else:
+            self.more_edited = len(page) == NOTES_PAGE
+            notes.extend(page)
+
+        self.database.current_user["notes"] = (
+            notes or [(None, None, None, None)])
+
+    def find_edited(self, note_id: int) -> int:
+        """Return the position (from 1) of the given note in tab1,
+        fetching more notes until found, or 0 if there is no such note."""
+
+        position = self.note_position(note_id)
+        while not position and self.more_edited:
+            self.load_more_edited()
+            position = self.note_position(note_id)
+        return position
+
+    def shown_notes(self) -> list:
+        """Return the notes of tab0 fetched so far."""
+
+        # Keep the empty row used when there are no notes
+        return self.shown or [(None, None, None, None)]
 
     def populate_main_tab(self):
         """Fill tab 0 with data."""
 
-        num_notes = len(self.database.current_user["notes"])
-        if not self.database.current_user["notes"][0][0]:
-            num_notes = 0
+        num_notes = self.database.current_user["num_notes"]
+
+        self.refresh_filter()
+        self.load_shown_notes()
+        notes = self.shown_notes()
+        num_shown = len(notes) if notes[0][0] else 0
 
         self.author_label.setText(
             f"{self.database.current_user['name']} "
@@ -322,46 +1008,164 @@ class CrudWindow(QtWidgets.QMainWindow):
         self.total_notes_label.setText(str(num_notes))
 
         # Add avatar
-        img = QtGui.QPixmap(str(consts.AVATAR_PATH /
-                                str(self.database.current_user["avatar"])) +
-                            ".png")
-        img2 = img.scaled(
-            QtCore.QSize(75, 75), QtCore.Qt.KeepAspectRatio,
-            QtCore.Qt.TransformationMode.SmoothTransformation)
-        self.avatar_mini.setPixmap(img2)
+        self.avatar_mini.setPixmap(self.avatar_pixmap(thumbnail=True))
 
         if num_notes > 0:
-            self.note_rendered_label.setText(
-                self.database.current_user["notes"][0][1])
+            # Most recent update among all their notes
+            self.date_label.setText(epoch_to_local_date(
+                self.database.current_user["last_update"]))
+        else:
+            self.date_label.setText("-")
+
+        if num_shown > 0:
+            text = self.note_content(notes[0])
+            self.note_rendered_label.setText(self.render_note(text))
 
             self.spinBox.setMinimum(1)
-            self.spinBox.setMaximum(num_notes)
+            self.spinBox.setMaximum(num_shown)
             self.spinBox.setValue(1)
 
-            # Most recent update among all their notes
-            last_update = max(note[3] for note in
-                              self.database.current_user["notes"])
-            self.date_label.setText(epoch_to_local_date(last_update))
-
             # Displayed note's metadata
-            self.creation_date_label.setText(
-                epoch_to_local_date(
-                    self.database.current_user["notes"][0][2]))
-            self.last_update_label.setText(
-                epoch_to_local_date(
-                    self.database.current_user["notes"][0][3]))
-            self.number_words_label.setText(
-                str(len(self.database.current_user["notes"][0][1].split())))
+            self.creation_date_label.setText(epoch_to_local_date(notes[0][2]))
+            self.last_update_label.setText(epoch_to_local_date(notes[0][3]))
+            self.number_words_label.setText(str(len(text.split())))
 
         else:
             self.note_rendered_label.clear()
             self.spinBox.setMinimum(0)
             self.spinBox.setMaximum(0)
-            self.date_label.setText("-")
             self.creation_date_label.setText("-")
             self.last_update_label.setText("-")
             self.number_words_label.setText("0")
 
+    def render_note(self, text: str) -> str:
+        """Point the images attached to the note to their previews."""
+
+        if "attachment:" not in text:
+            return text
+        return ATTACHMENT_SRC.sub(self.preview_src, text)
+
+    def preview_src(self, match: re.Match) -> str:
+        """Source of the preview of an attachment, left as it is if the
+        user has no such attachment."""
+
+        attachment_id = int(match.group(2))
+        try:
+            attachment = self.database.get_attachment(
+                self.database.current_user["id"], attachment_id)
+
+        except exceptions.DatabaseError as e:
+            logger.warning(e.message)
+            return match.group(0)
+
+        preview = None
+        if attachment:
+            preview = self.previews.get(attachment_id, attachment[4])
+        return f'src="{preview}"' if preview else match.group(0)
+
+    def make_preview(self, attachment_id: int) -> Optional[bytes]:
+        """Encode the preview of an attachment, read from the database
+        as it is decoded."""
+
+        try:
+            blob = self.database.open_attachment(
+                self.database.current_user["id"], attachment_id)
+
+        except exceptions.DatabaseError as e:
+            logger.warning(e.message)
+            return None
+
+        if blob is None:
+            return None
+        with blob:
+            try:
+                return images.encode_preview(blob)
+            except (OSError, ValueError):
+                logger.warning("Attachment %d is not an image.",
+                               attachment_id)
+                return None
+
+    def attach_image(self):
+        """Stream an image into the database and insert it at the cursor
+        of the edited note."""
+
+        note_position = self.spinBox_2.value()
+        if note_position == 0:
+            self.tabWidget.setCurrentIndex(1)
+            self.label_message2.setText("Save the note before attaching.")
+            return
+
+        dial = QtWidgets.QFileDialog()
+        dial.setFileMode(QtWidgets.QFileDialog.ExistingFile)
+        dial.setNameFilters(["Image files (*.png *.jpg *.jpeg *.gif *.bmp)"])
+        if not dial.exec_():
+            return
+
+        filename = dial.selectedFiles()[0]
+        note_id = self.database.current_user["notes"][note_position-1][0]
+        try:
+            with open(filename, "rb") as file:
+                size = os.fstat(file.fileno()).st_size
+                attachment_id = self.database.add_attachment(
+                    self.database.current_user["id"], note_id, file, size,
+                    Path(filename).name)
+
+        except OSError:
+            self.label_message2.setText("Cannot read the image.")
+            logger.warning("Cannot read `%s`.", filename)
+
+        except exceptions.DatabaseError as e:
+            self.label_message2.setText("Internal error.")
+            logger.warning(e.message)
+
+        else:
+            if attachment_id is None:
+                return
+            self.tabWidget.setCurrentIndex(1)
+            self.comment_block.insertPlainText(
+                f'<a href="attachment:{attachment_id}">'
+                f'<img src="attachment:{attachment_id}"></a>')
+            self.label_message2.setText("Image attached, save the note.")
+            logger.info("`%s` attached `%s` to `note %d`.",
+                        self.database.current_user["username"],
+                        Path(filename).name, note_id)
+
+    def open_link(self, link: str):
+        """Open a link of the displayed note, saving attachments."""
+
+        if not link.startswith("attachment:"):
+            QtGui.QDesktopServices.openUrl(QtCore.QUrl(link))
+            return
+
+        user_id = self.database.current_user["id"]
+        try:
+            attachment = self.database.get_attachment(
+                user_id, int(link[len("attachment:"):]))
+
+        except ValueError:
+            return
+
+        except exceptions.DatabaseError as e:
+            logger.warning(e.message)
+            return
+
+        if not attachment:
+            return
+        filename, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self, "Save attachment", attachment[2])
+        if not filename:
+            return
+
+        try:
+            with open(filename, "wb") as file:
+                self.database.export_attachment(user_id, attachment[0], file)
+
+        except OSError:
+            logger.warning("Cannot write `%s`.", filename)
+
+        except exceptions.DatabaseError as e:
+            logger.warning(e.message)
+
     def populate_notes_tab(self):
         """Fill tab 1 with data."""
 
@@ -387,10 +1191,29 @@ class CrudWindow(QtWidgets.QMainWindow):
         self.name_line_edit.setText(self.database.current_user["name"])
 
         # Add avatar
-        img = QtGui.QPixmap(str(consts.AVATAR_PATH /
-                                str(self.database.current_user["avatar"])) +
-                            ".png")
-        self.avatar.setPixmap(img)
+        self.avatar.setPixmap(self.avatar_pixmap())
+
+    def avatar_pixmap(self, thumbnail: bool = False) -> QtGui.QPixmap:
+        """Avatar of the current user, read from the database."""
+
+        data = None
+        avatar_id = self.database.current_user["avatar"]
+        if avatar_id:
+            try:
+                data = self.database.read_avatar(avatar_id, thumbnail)
+            except exceptions.DatabaseError as e:
+                logger.warning(e.message)
+
+        img = QtGui.QPixmap()
+        if data is None or not img.loadFromData(data, "PNG"):
+            # Default avatar, shipped with the app
+            img = QtGui.QPixmap(str(consts.AVATAR_PATH / "0.png"))
+            if thumbnail:
+                img = img.scaled(
+                    QtCore.QSize(*images.THUMBNAIL_SIZE),
+                    QtCore.Qt.KeepAspectRatio,
+                    QtCore.Qt.TransformationMode.SmoothTransformation)
+        return img
 
     def update_avatar(self):
         """Upload a new image as avatar."""
@@ -403,32 +1226,21 @@ class CrudWindow(QtWidgets.QMainWindow):
         if dial.exec_():
             filename = dial.selectedFiles()[0]
 
-            # Read image
-            new_avatar = Image.open(filename)
-
-            # Resize image conserving aspect ratio
-            max_width, max_height = (175, 175)
-            ratio = min(max_width/new_avatar.width,
-                        max_height/new_avatar.height)
-            new_size = (int(ratio * new_avatar.width),
-                        int(ratio * new_avatar.height))
-            new_avatar = new_avatar.resize(new_size, Image.LANCZOS)
-
-            # Save image as png
-            filename = (str(consts.AVATAR_PATH /
-                            str(self.database.current_user["id"])) + ".png")
-            new_avatar.save(filename)
-
-            if self.database.current_user["avatar"] == 0:
-                # User didn't have a previous avatar
-                user_id = self.database.current_user["id"]
-                try:
-                    self.database.set_avatar(user_id, user_id)
-                except exceptions.DatabaseError as e:
-                    logging.warning(e.message)
+            # Resize image conserving aspect ratio, and its thumbnail
+            try:
+                image, thumbnail = images.encode_avatar(filename)
+            except (OSError, ValueError):
+                logger.warning("Cannot read image `%s`.", filename)
+                return
 
-            logging.info(f"`{self.database.current_user['username']}` "
-                         "uploaded new avatar.")
+            user_id = self.database.current_user["id"]
+            try:
+                self.database.upload_avatar(user_id, image, thumbnail)
+            except exceptions.DatabaseError as e:
+                logger.warning(e.message)
+
+            logger.info("`%s` uploaded new avatar.",
+                        self.database.current_user["username"])
 
             # Refresh user's info
             self.populate_user_info()
@@ -453,20 +1265,16 @@ class CrudWindow(QtWidgets.QMainWindow):
         response = dial.exec_()
         if response == 0:
             # Delete avatar
+            # The image itself is removed by the garbage collection
             user_id = self.database.current_user["id"]
-            if user_id:  # Never ever remove the default avatar (0.png)
-                try:
-                    Path.unlink(consts.AVATAR_PATH / (str(user_id) + ".png"))
-                except FileNotFoundError:
-                    pass
             try:
                 self.database.set_avatar(user_id, 0)
 
             except exceptions.DatabaseError as e:
-                logging.warning(e.message)
+                logger.warning(e.message)
 
-            logging.info(f"`{self.database.current_user['username']}` "
-                         "deleted avatar.")
+            logger.info("`%s` deleted avatar.",
+                        self.database.current_user["username"])
 
             # Refresh user's info
             self.populate_user_info()
@@ -532,19 +1340,11 @@ class CrudWindow(QtWidgets.QMainWindow):
                 self.database.delete_user(user_id)
 
             except exceptions.DatabaseError as e:
-                logging.warning(e.message)
+                logger.warning(e.message)
 
             else:
                 username = self.database.current_user['username']
-                logging.info(f"Account `{username}` deleted.")
-
-                # Delete avatar
-                if self.database.current_user["avatar"] != 0:
-                    try:
-                        Path.unlink(
-                            consts.AVATAR_PATH / (str(user_id) + ".png"))
-                    except FileNotFoundError:
-                        pass
+                logger.info("Account `%s` deleted.", username)
 
                 # Log user out of the application
                 self.logout()
@@ -592,10 +1392,54 @@ class CrudWindow(QtWidgets.QMainWindow):
         self.pwd_line_edit.clear()
         self.pwd_checkbox.setCheckState(QtCore.Qt.Unchecked)
 
+    def save_snapshot(self):
+        """Copy the whole database to a file chosen by the user."""
+
+        filename, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self, "Save snapshot", "", "SQLite databases (*.sqlite3)")
+        if not filename:
+            return
+
+        try:
+            self.database.save_snapshot(filename)
+
+        except exceptions.DatabaseError as e:
+            self.statusbar.showMessage("Cannot save snapshot.", 5000)
+            logger.warning(e.message)
+
+        else:
+            self.statusbar.showMessage(f"Snapshot saved to {filename}.",
+                                       5000)
+            logger.info("Saved snapshot `%s`.", filename)
+
+    def toggle_profiling(self):
+        """Start profiling the app, or stop and save the profile."""
+
+        try:
+            filename = profiling.profiler.toggle()
+
+        except OSError as e:
+            self.statusbar.showMessage("Cannot save profile.", 5000)
+            logger.warning("Cannot save profile: %s", e)
+
+        else:
+            if filename:
+                self.statusbar.showMessage(
+                    f"Profile saved to {filename}.", 5000)
+            else:
+                self.statusbar.showMessage(
+                    "Profiling, press Ctrl+Shift+F12 again to stop.", 5000)
+
     def logout(self):
         """Log user out of the application, showing login window again."""
 
-        logging.info(f"`{self.database.current_user['username']}` logged out.")
+        logger.info("`%s` logged out.", self.database.current_user["username"])
+        if self.contents:
+            logger.info("Content cache: %(hits)d hits, %(misses)d misses, "
+                        "%(evictions)d evictions, %(bytes)d of %(budget)d "
+                        "bytes.", self.contents.stats())
+        logger.debug("Preview cache: %(hits)d hits, %(misses)d misses.",
+                     self.previews.stats())
         self.database.current_user = None
 
         window = login.LoginWindow(
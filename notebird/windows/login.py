@@ -3,12 +3,14 @@ import logging
 
 from PySide2 import QtWidgets, QtCore
 
-from db import helpers, dbhelper
+from db import dbhelper
 from windows import crud, signup
 from utils import consts, exceptions
 from utils.pyside_dynamic import load_ui
 from utils.custom_widgets import ClickableLineEdit
 
+logger = logging.getLogger(__name__)
+
 
 class LoginWindow(QtWidgets.QMainWindow):
     """Starting window where user can log in or open sign up window."""
@@ -42,6 +44,31 @@ class LoginWindow(QtWidgets.QMainWindow):
         if pos:
             self.move(pos)
 
+        # Wait until the database is ready
+        if not self.database:
+            self.pushButton_login.setEnabled(False)
+            self.pushButton_signup.setEnabled(False)
+
+    def show_status(self, message: str):
+        """Display a message about the state of the application."""
+
+        self.label_message.setText(message)
+
+    def show_error(self, message: str):
+        """Report that the database could not be brought up."""
+
+        self.label_message.setText("Database unavailable.")
+        QtWidgets.QMessageBox.critical(self, "Database error", message)
+
+    def set_database(self, database: dbhelper.DBHelper, timings: dict):
+        """Start using the database once it has been brought up."""
+
+        self.database = database
+        self.pushButton_login.setEnabled(True)
+        self.pushButton_signup.setEnabled(True)
+        self.label_message.setText(
+            f"Database ready in {timings['total']:.0f} ms.")
+
     def check_login(self):
         """Identify the user against the database."""
 
@@ -53,17 +80,17 @@ class LoginWindow(QtWidgets.QMainWindow):
 
         except exceptions.DatabaseError as e:
             self.label_message.setText("Internal error.")
-            logging.warning(e.message)
+            logger.warning(e.message)
 
         except exceptions.LoginError as e:
             # Wrong user/password
             self.label_message.setText(e.message)
-            logging.warning(f"`{e.username}` - {e.message}")
+            logger.warning("`%s` - %s", e.username, e.message)
 
         else:
             # Correct login
             self.label_message.setText(f"Logged in as {user}.")
-            logging.info(f"`{user}` logged in the database.")
+            logger.info("`%s` logged in the database.", user)
             self.database.current_user = {"id": user_id}
 
             # Close window and show crud
@@ -0,0 +1,99 @@
+"""Quick-open palette, to jump to a note by typing part of it."""
+import threading
+from typing import Callable, Optional
+
+from PySide2 import QtWidgets, QtCore
+
+from utils import consts
+from utils.trigrams import TrigramIndex
+from utils.pyside_dynamic import load_ui
+
+# Results listed at once
+MAX_RESULTS = 20
+
+
+class IndexBuilder(QtCore.QObject):
+    """Build a trigram index in a daemon thread, so indexing many notes
+    never freezes the GUI.
+
+    Signals:
+        ready -- the `TrigramIndex` built."""
+
+    ready = QtCore.Signal(object)
+
+    def __init__(self, build: Callable[[], TrigramIndex],
+                 parent: QtCore.QObject = None):
+        super().__init__(parent)
+        self.build = build
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        self.ready.emit(self.build())
+
+
+class QuickOpenDialog(QtWidgets.QDialog):
+    """Dialog searching the notes of the session as the user types.
+
+    Without an index, it waits for one to be given with `set_index`.
+    After it is accepted, `note_id` holds the chosen note."""
+
+    def __init__(self, index: Optional[TrigramIndex],
+                 parent: QtWidgets.QMainWindow = None):
+        super().__init__(parent)
+        self.index = index
+        self.note_id = None
+
+        # Load UI
+        load_ui(str(consts.UI_PATH / "quick_open.ui"), self, None,
+                str(consts.UI_PATH))
+
+        self.search_line_edit.textChanged.connect(self.search)
+        self.search_line_edit.returnPressed.connect(self.accept)
+        self.results_list.itemActivated.connect(self.accept)
+
+        # Latest notes until something is typed
+        self.search("")
+
+    def search(self, text: str):
+        """List the notes matching the text, best first."""
+
+        self.results_list.clear()
+        if self.index is None:
+            item = QtWidgets.QListWidgetItem("Indexing notes...")
+            item.setFlags(QtCore.Qt.NoItemFlags)
+            self.results_list.addItem(item)
+            return
+
+        for match in self.index.search(text, MAX_RESULTS):
+            item = QtWidgets.QListWidgetItem(match.title or "(empty note)")
+            item.setData(QtCore.Qt.UserRole, match.note_id)
+            self.results_list.addItem(item)
+        self.results_list.setCurrentRow(0)
+
+    def set_index(self, index: TrigramIndex):
+        """Search the index once it is built."""
+
+        self.index = index
+        self.search(self.search_line_edit.text())
+
+    def keyPressEvent(self, event):
+        """Move through the results without leaving the search box."""
+
+        if event.key() in (QtCore.Qt.Key_Up, QtCore.Qt.Key_Down):
+            step = -1 if event.key() == QtCore.Qt.Key_Up else 1
+            row = self.results_list.currentRow() + step
+            if 0 <= row < self.results_list.count():
+                self.results_list.setCurrentRow(row)
+        else:
+            super().keyPressEvent(event)
+
+    def accept(self):
+        """Close the palette with the selected note."""
+
+        item = self.results_list.currentItem()
+        if item and item.data(QtCore.Qt.UserRole) is not None:
+            self.note_id = item.data(QtCore.Qt.UserRole)
+            super().accept()
@@ -0,0 +1,94 @@
+"""Dialog to pick many notes at once and act on all of them."""
+import threading
+from typing import Callable, Iterable, List, Optional
+
+from PySide2 import QtWidgets, QtCore
+
+from db import dbhelper
+from utils import consts
+from utils.pyside_dynamic import load_ui
+
+# Actions the dialog can be accepted with
+DELETE, ADD_TAG, REMOVE_TAG = "delete", "add_tag", "remove_tag"
+
+
+class PreviewLoader(QtCore.QObject):
+    """Read the previews of notes in a daemon thread, so listing many
+    notes never freezes the GUI.
+
+    Signals:
+        ready -- the list of `NotePreview` read."""
+
+    ready = QtCore.Signal(object)
+
+    def __init__(self, fetch: Callable[[], List[dbhelper.NotePreview]],
+                 parent: QtCore.QObject = None):
+        super().__init__(parent)
+        self.fetch = fetch
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        self.ready.emit(self.fetch())
+
+
+class SelectNotesDialog(QtWidgets.QDialog):
+    """Dialog listing the given notes, several of them can be selected
+    with Ctrl, Shift or Ctrl+A.
+
+    Without notes, it waits for them to be given with `set_notes`.
+    After it is accepted, `action` holds the button pressed and
+    `note_ids` the selected notes."""
+
+    def __init__(self, notes: Optional[Iterable[dbhelper.NotePreview]],
+                 parent: QtWidgets.QMainWindow = None):
+        super().__init__(parent)
+        self.action = None
+        self.note_ids: List[int] = []
+
+        # Load UI
+        load_ui(str(consts.UI_PATH / "select_notes.ui"), self, None,
+                str(consts.UI_PATH))
+
+        if notes is None:
+            item = QtWidgets.QListWidgetItem("Loading notes...")
+            item.setFlags(QtCore.Qt.NoItemFlags)
+            self.notes_list.addItem(item)
+        else:
+            self.set_notes(notes)
+
+        self.notes_list.itemSelectionChanged.connect(self.selection_changed)
+        self.btn_delete.clicked.connect(lambda: self.finish(DELETE))
+        self.btn_add_tag.clicked.connect(lambda: self.finish(ADD_TAG))
+        self.btn_remove_tag.clicked.connect(lambda: self.finish(REMOVE_TAG))
+
+    def set_notes(self, notes: Iterable[dbhelper.NotePreview]):
+        """List the given notes, once read."""
+
+        self.notes_list.clear()
+        for note_id, title, _, _, preview in notes:
+            item = QtWidgets.QListWidgetItem(title or "(empty note)")
+            item.setData(QtCore.Qt.UserRole, note_id)
+            item.setToolTip(preview)
+            self.notes_list.addItem(item)
+
+    def selection_changed(self):
+        """Count the selected notes, enabling the buttons if any."""
+
+        num_selected = len(self.notes_list.selectedItems())
+        self.selected_label.setText(
+            f"{num_selected} notes selected" if num_selected
+            else "No notes selected")
+        for button in (self.btn_delete, self.btn_add_tag,
+                       self.btn_remove_tag):
+            button.setEnabled(bool(num_selected))
+
+    def finish(self, action: str):
+        """Close the dialog with the selected notes and the action."""
+
+        self.action = action
+        self.note_ids = [item.data(QtCore.Qt.UserRole)
+                         for item in self.notes_list.selectedItems()]
+        self.accept()
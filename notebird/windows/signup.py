@@ -10,6 +10,8 @@ from utils.pyside_dynamic import load_ui
 from utils.custom_widgets import ClickableLineEdit
 from utils.validations import validate_username, validate_pwd, validate_name
 
+logger = logging.getLogger(__name__)
+
 
 class SignUpWindow(QtWidgets.QMainWindow):
     """Window for creating accounts in the application."""
@@ -60,36 +62,36 @@ class SignUpWindow(QtWidgets.QMainWindow):
                 self.database.create_user(user, password, name)
             except exceptions.DatabaseError as e:
                 self.label_message.setText("Internal error.")
-                logging.warning(e.message)
+                logger.warning(e.message)
 
             except exceptions.ValidationError as e:
                 self.label_message.setText(
                     f"Invalid field {', '.join(e.columns)}")
-                logging.debug(f"`{e.columns}` - {e.message}")
+                logger.debug("`%s` - %s", e.columns, e.message)
 
             except exceptions.UsernameExistsError as e:
                 self.label_message.setText(f"User {user} already exists.")
-                logging.debug(e.message)
+                logger.debug(e.message)
 
             else:
                 self.label_message.setText("User created. You can login now.")
-                logging.info(f"`{user}`'s info inserted in the database.")
+                logger.info("`%s`'s info inserted in the database.", user)
                 self.line_edit_username.clear()
                 self.line_edit_password.clear()
                 self.line_edit_name.clear()
 
         elif not validations['username']:
             self.label_message.setText("Invalid username (min. 5 characters).")
-            logging.debug("The username entered is too short.")
+            logger.debug("The username entered is too short.")
 
         elif not validations['password']:
             self.label_message.setText("Weak password (min. 8 characters).")
-            logging.debug("The password entered is too weak.")
+            logger.debug("The password entered is too weak.")
 
         elif not validations['name']:
             self.label_message.setText(
                 "Please enter full name (min. 2 words).")
-            logging.debug("The name entered is too short.")
+            logger.debug("The name entered is too short.")
 
     def to_login(self):
         """Close current window and show new one."""
@@ -0,0 +1,107 @@
+"""Archive of old notes into the cold database and their restore.
+
+Run from the repository root:
+
+    python -m unittest discover tests
+"""
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "notebird"))
+
+from db import dbhelper  # noqa: E402
+
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.name = str(Path(self.tmp.name) / "notebird.sqlite3")
+        self.dbs = []
+        self.db = self.open()
+        self.db.create_user("alice", "Passw0rd!x", "Alice Smith")
+        for text in ("one", "two", "three"):
+            self.db.add_item(1, f"Note {text}")
+        self.db.fill_derived_columns(100)
+
+    def tearDown(self):
+        for db in self.dbs:
+            db.close()
+        self.tmp.cleanup()
+
+    def open(self) -> dbhelper.DBHelper:
+        db = dbhelper.DBHelper(self.name)
+        db.setup()
+        self.dbs.append(db)
+        return db
+
+    def archive(self) -> tuple:
+        return self.db.archive_items(time.time() + 10, 100)
+
+    @staticmethod
+    def hot_contents(db: dbhelper.DBHelper) -> list:
+        return db.conn.execute("""SELECT note_id, content, archived
+                                  FROM library ORDER BY note_id""").fetchall()
+
+    @staticmethod
+    def cold_ids(db: dbhelper.DBHelper) -> list:
+        return [row[0] for row in db.conn.execute(
+            "SELECT note_id FROM cold.archived_notes ORDER BY note_id")]
+
+    def test_archived_notes_are_still_read(self):
+        num_notes, num_bytes = self.archive()
+
+        self.assertEqual((num_notes, num_bytes), (3, len("Note one" "Note two"
+                                                         "Note three")))
+        self.assertEqual(self.hot_contents(self.db), [(1, "", 1), (2, "", 1),
+                                                      (3, "", 1)])
+        self.assertEqual(self.db.get_item(1, 2)[1], "Note two")
+        self.assertEqual([note[0] for note in
+                          self.db.search_items(1, "three")], [3])
+        self.assertEqual(self.archive(), (0, 0))
+
+    def test_edited_note_is_restored(self):
+        self.archive()
+
+        self.assertTrue(self.db.update_item(1, 2, "Note two, edited"))
+
+        self.assertEqual(self.hot_contents(self.db)[1],
+                         (2, "Note two, edited", 0))
+        self.assertEqual(self.cold_ids(self.db), [1, 3])
+        self.assertEqual(self.db.get_item(1, 2)[1], "Note two, edited")
+
+    def test_deleted_note_leaves_no_cold_copy(self):
+        self.archive()
+
+        self.assertTrue(self.db.delete_item(1, 1))
+
+        self.assertEqual(self.cold_ids(self.db), [2, 3])
+
+    def test_other_instance_restores_archived_notes(self):
+        self.archive()
+        # Opened after the cold database was created by another instance
+        other = self.open()
+
+        self.assertEqual(other.get_item(1, 1)[1], "Note one")
+        self.assertTrue(other.update_item(1, 1, "Note one, edited"))
+        self.assertTrue(other.delete_item(1, 3))
+
+        self.assertEqual(self.cold_ids(self.db), [2])
+        self.assertEqual(self.db.get_item(1, 1)[1], "Note one, edited")
+        self.assertEqual(self.db.get_item(1, 2)[1], "Note two")
+
+    def test_restored_notes_can_be_archived_again(self):
+        self.archive()
+        self.db.update_item(1, 1, "Note one, edited")
+
+        self.assertEqual(self.archive()[0], 1)
+
+        self.assertEqual(self.cold_ids(self.db), [1, 2, 3])
+        self.assertEqual(self.db.get_item(1, 1)[1], "Note one, edited")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+"""Garbage collection of notes left behind by deleted accounts.
+
+Run from the repository root:
+
+    python -m unittest discover tests
+"""
+import sys
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "notebird"))
+
+from db import dbhelper, maintenance, storage  # noqa: E402
+
+
+class OrphanedNotesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = Path(self.tmp.name)
+        self.dbs = []
+
+    def tearDown(self):
+        for db in self.dbs:
+            db.close()
+        self.tmp.cleanup()
+
+    def open(self, shards: int = 0) -> dbhelper.DBHelper:
+        db = dbhelper.DBHelper(str(self.folder / "notebird.sqlite3"),
+                               storage=storage.make_backend(shards))
+        db.setup()
+        self.dbs.append(db)
+        return db
+
+    @staticmethod
+    def add_users(db: dbhelper.DBHelper):
+        """Two users, the first one with 3 notes, the second one with 1."""
+        db.create_user("alice", "Passw0rd!x", "Alice Smith")
+        db.create_user("bobby", "Passw0rd!x", "Bobby Jones")
+        for text in ("one", "two", "three"):
+            db.add_item(1, f"Note {text} of alice")
+        db.add_item(2, "Note of bobby")
+
+    @staticmethod
+    def owners(db: dbhelper.DBHelper) -> list:
+        return sorted((row[0] for conn in db.storage.connections()
+                       for row in conn.execute("SELECT user_id FROM library")),
+                      key=lambda owner: owner or 0)
+
+    def test_notes_of_deleted_users_are_purged_in_batches(self):
+        db = self.open()
+        self.add_users(db)
+        db.delete_user(1)
+
+        stats = maintenance.collect_orphaned_notes(db, batch_size=2)
+
+        self.assertEqual((stats.notes, stats.batches), (3, 2))
+        self.assertGreater(stats.note_bytes, 0)
+        self.assertEqual(self.owners(db), [2])
+
+    def test_batches_are_bounded(self):
+        db = self.open()
+        self.add_users(db)
+        db.delete_user(1)
+
+        stats = maintenance.collect_orphaned_notes(db, batch_size=2,
+                                                   max_batches=1)
+
+        self.assertEqual((stats.notes, stats.batches), (2, 1))
+        self.assertEqual(self.owners(db), [None, 2])
+
+    def test_purge_skips_notes_with_owner(self):
+        db = self.open()
+        self.add_users(db)
+
+        self.assertEqual(db.purge_orphaned_items(10), (0, 0))
+        self.assertEqual(self.owners(db), [1, 1, 1, 2])
+
+    def test_purged_notes_can_be_archived(self):
+        db = self.open()
+        self.add_users(db)
+        db.delete_user(1)
+        archive = str(self.folder / "archive.sqlite3")
+
+        stats = maintenance.collect_orphaned_notes(db, archive=archive)
+
+        self.assertEqual(stats.notes, 3)
+        conn = sqlite3.connect(archive)
+        try:
+            contents = sorted(row[0] for row in
+                              conn.execute("SELECT content FROM orphans"))
+        finally:
+            conn.close()
+        self.assertEqual(contents, ["Note one of alice", "Note three of alice",
+                                    "Note two of alice"])
+
+    def test_shards_release_notes_of_missing_users(self):
+        db = self.open(shards=2)
+        self.add_users(db)
+        # Deleted from the main database only, as if interrupted
+        db.conn.execute("DELETE FROM users WHERE user_id = 1")
+        db.conn.commit()
+
+        stats = maintenance.collect_orphaned_notes(db)
+
+        self.assertEqual(stats.notes, 3)
+        self.assertEqual(self.owners(db), [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
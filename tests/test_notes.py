@@ -0,0 +1,158 @@
+"""Paging through and importing the notes of a user.
+
+Run from the repository root:
+
+    python -m unittest discover tests
+"""
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "notebird"))
+
+from db import dbhelper  # noqa: E402
+
+# `creation` of each note, with several notes sharing the same one
+CREATIONS = (3000.0, 1000.0, 2000.0, 1000.0, 3000.0, 1000.0, 2000.0)
+
+
+class PaginationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = dbhelper.DBHelper(str(Path(self.tmp.name) /
+                                        "notebird.sqlite3"))
+        self.db.setup()
+        self.db.create_user("alice", "Passw0rd!x", "Alice Smith")
+        for position, creation in enumerate(CREATIONS):
+            self.db.add_item(1, f"Note {position}")
+            self.db.conn.execute(
+                """UPDATE library SET creation=?, last_update=?
+                                  WHERE note_id=?""",
+                (creation, creation, position + 1))
+        self.db.conn.commit()
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def pages(self, order_by: str, limit: int, **filters) -> list:
+        """Return the ids of every page of notes, following the cursors."""
+        pages, after = [], None
+        while True:
+            page = self.db.query_items(1, order_by, limit=limit,
+                                       after=after, **filters)
+            if not page:
+                return pages
+            pages.append([note[0] for note in page])
+            after = dbhelper.note_cursor(page[-1], order_by)
+
+    def test_ascending_pages_split_equal_keys(self):
+        pages = self.pages("creation", 2)
+
+        self.assertEqual(pages, [[2, 4], [6, 3], [7, 1], [5]])
+
+    def test_descending_pages_split_equal_keys(self):
+        pages = self.pages("-last_update", 2)
+
+        self.assertEqual(pages, [[5, 1], [7, 3], [6, 4], [2]])
+
+    def test_pages_match_the_whole_query(self):
+        for order_by in ("note_id", "-note_id", "creation", "-creation"):
+            with self.subTest(order_by=order_by):
+                whole = [note[0] for note in
+                         self.db.query_items(1, order_by)]
+                for limit in (1, 3, 7):
+                    pages = self.pages(order_by, limit)
+                    self.assertEqual(sum(pages, []), whole)
+
+    def test_pages_within_a_period(self):
+        pages = self.pages("creation", 2, created_between=(1000.0, 3000.0))
+
+        self.assertEqual(pages, [[2, 4], [6, 3], [7]])
+
+    def test_previews_are_paged_as_notes(self):
+        previews, after = [], None
+        while True:
+            page = self.db.list_items(1, "-creation", limit=3, after=after)
+            if not page:
+                break
+            previews.extend(preview[0] for preview in page)
+            after = dbhelper.note_cursor(page[-1], "-creation")
+
+        self.assertEqual(previews, sum(self.pages("-creation", 3), []))
+
+
+class ImportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = dbhelper.DBHelper(str(Path(self.tmp.name) /
+                                        "notebird.sqlite3"))
+        self.db.setup()
+        self.db.create_user("alice", "Passw0rd!x", "Alice Smith")
+        self.db.add_item(1, "Shopping list")
+        self.db.conn.execute(
+            "UPDATE library SET creation=1000.0, last_update=2000.0")
+        self.db.conn.commit()
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def notes(self) -> list:
+        return self.db.conn.execute(
+            """SELECT content, creation, last_update FROM library
+                                                     ORDER BY note_id"""
+        ).fetchall()
+
+    def test_importing_twice_adds_nothing(self):
+        notes = [("Ideas", 500.0, 600.0), ("Recipes", None, None)]
+
+        self.assertEqual(self.db.import_items(1, notes), (2, 0, 0))
+        self.assertEqual(self.db.import_items(1, notes), (0, 2, 0))
+        self.assertEqual([note[0] for note in self.notes()],
+                         ["Shopping list", "Ideas", "Recipes"])
+
+    def test_skip_matches_contents_differing_in_whitespace(self):
+        result = self.db.import_items(1, [("  Shopping\n list ", 1.0, 2.0)])
+
+        self.assertEqual(result, (0, 1, 0))
+        self.assertEqual(self.notes(), [("Shopping list", 1000.0, 2000.0)])
+
+    def test_merge_widens_the_dates(self):
+        result = self.db.import_items(1, [("Shopping list", 500.0, 600.0),
+                                          ("Shopping list", 1500.0, 3000.0)],
+                                      mode="merge")
+
+        self.assertEqual(result, (0, 0, 2))
+        self.assertEqual(self.notes(), [("Shopping list", 500.0, 3000.0)])
+
+    def test_all_adds_duplicates(self):
+        result = self.db.import_items(1, [("Shopping list", 500.0, None)],
+                                      mode="all")
+
+        self.assertEqual(result, (1, 0, 0))
+        self.assertEqual(self.notes(), [("Shopping list", 1000.0, 2000.0),
+                                        ("Shopping list", 500.0, 500.0)])
+
+    def test_notes_without_hash_are_matched(self):
+        # Written before notes had derived columns
+        self.db.conn.execute("""UPDATE library SET content_hash=NULL,
+                                                   title=NULL,
+                                                   plain_preview=NULL""")
+        self.db.conn.commit()
+
+        self.assertEqual(self.db.import_items(1, [("Shopping list", 1.0,
+                                                   1.0)]), (0, 1, 0))
+        self.assertEqual(self.db.count_unfilled_items(), 0)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            self.db.import_items(1, [("Ideas", None, None)], mode="replace")
+        self.assertEqual(len(self.notes()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
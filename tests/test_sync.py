@@ -0,0 +1,94 @@
+"""Sync of copies of a database written before notes had a `guid`.
+
+Run from the repository root:
+
+    python -m unittest discover tests
+"""
+import sys
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "notebird"))
+
+from db import dbhelper, sync  # noqa: E402
+
+# Tables of the first version of the database
+BASELINE = """
+    CREATE TABLE users (
+        user_id     INTEGER PRIMARY KEY AUTOINCREMENT,
+        username    TEXT    NOT NULL    UNIQUE,
+        password    TEXT    NOT NULL,
+        name        TEXT    NOT NULL,
+        avatar_id   INTEGER NOT NULL
+    );
+    CREATE TABLE library (
+        note_id     INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id     INTEGER,
+        content     TEXT    NOT NULL,
+        creation    REAL    NOT NULL,
+        last_update REAL    NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+                              ON UPDATE CASCADE
+                              ON DELETE SET NULL
+    );
+    INSERT INTO users VALUES (1, 'alice', 'hash', 'Alice Smith', 0);
+    INSERT INTO library VALUES (1, 1, 'old note 1', 1000.5, 1000.5);
+    INSERT INTO library VALUES (2, 1, 'old note 2', 2000.5, 2000.5);
+"""
+
+
+class BaselineSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = Path(self.tmp.name)
+        conn = sqlite3.connect(str(self.folder / "baseline.sqlite3"))
+        conn.executescript(BASELINE)
+        conn.close()
+        self.dbs = []
+
+    def tearDown(self):
+        for db in self.dbs:
+            db.close()
+        self.tmp.cleanup()
+
+    def open(self, name: str, copy: bool = True) -> dbhelper.DBHelper:
+        """Open a copy of the baseline database, or a new one."""
+        path = self.folder / name
+        if copy:
+            path.write_bytes((self.folder / "baseline.sqlite3").read_bytes())
+        db = dbhelper.DBHelper(str(path))
+        db.setup()
+        self.dbs.append(db)
+        return db
+
+    @staticmethod
+    def notes(db: dbhelper.DBHelper) -> list:
+        return sorted(row[0] for row in
+                      db.conn.execute("SELECT content FROM library"))
+
+    def test_copies_match_their_notes(self):
+        local, remote = self.open("local.sqlite3"), self.open("remote.sqlite3")
+        self.assertTrue(local.update_item(1, 1, "edited on local"))
+
+        sync.sync_databases(local, remote)
+
+        expected = ["edited on local", "old note 2"]
+        self.assertEqual(self.notes(local), expected)
+        self.assertEqual(self.notes(remote), expected)
+
+    def test_new_database_gets_older_notes(self):
+        local = self.open("local.sqlite3", copy=False)
+        remote = self.open("remote.sqlite3")
+
+        sync.sync_databases(local, remote)
+
+        expected = ["old note 1", "old note 2"]
+        self.assertEqual(self.notes(local), expected)
+        self.assertEqual(self.notes(remote), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+"""Creation of users in bulk and rehash of their passwords.
+
+Run from the repository root:
+
+    python -m unittest discover tests
+"""
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "notebird"))
+
+from passlib.hash import pbkdf2_sha256  # noqa: E402
+
+from db import dbhelper  # noqa: E402
+from utils import exceptions, security  # noqa: E402
+
+
+class CreateUsersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = Path(self.tmp.name)
+        self.dbs = []
+
+    def tearDown(self):
+        for db in self.dbs:
+            db.close()
+        self.tmp.cleanup()
+
+    def open(self) -> dbhelper.DBHelper:
+        db = dbhelper.DBHelper(str(self.folder / "notebird.sqlite3"))
+        db.setup()
+        self.dbs.append(db)
+        return db
+
+    @staticmethod
+    def usernames(db: dbhelper.DBHelper) -> list:
+        return sorted(row[0] for row in
+                      db.conn.execute("SELECT username FROM users"))
+
+    def test_users_are_inserted_and_can_log_in(self):
+        db = self.open()
+
+        errors = db.create_users([("alice", "Passw0rd!x", "Alice Smith"),
+                                  ("bobby", "Passw0rd!y", "Bobby Jones")],
+                                 max_workers=1)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self.usernames(db), ["alice", "bobby"])
+        self.assertEqual(db.login("bobby", "Passw0rd!y"), 2)
+
+    def test_duplicates_are_skipped(self):
+        db = self.open()
+        db.create_user("alice", "Passw0rd!x", "Alice Smith")
+
+        errors = db.create_users([("alice", "Passw0rd!x", "Alice Smith"),
+                                  ("bobby", "Passw0rd!x", "Bobby Jones"),
+                                  ("bobby", "Passw0rd!x", "Bobby Jones"),
+                                  ("carol", "short", "Carol"),
+                                  ("david", "Passw0rd!x")],
+                                 max_workers=1)
+
+        self.assertEqual([position for position, _ in errors], [0, 2, 3, 4])
+        self.assertIsInstance(errors[0][1], exceptions.UsernameExistsError)
+        self.assertIsInstance(errors[1][1], exceptions.UsernameExistsError)
+        self.assertEqual(errors[2][1].columns, ("password", "name"))
+        self.assertIsInstance(errors[3][1], exceptions.ValidationError)
+        self.assertEqual(self.usernames(db), ["alice", "bobby"])
+
+    def test_failed_insertion_is_rolled_back(self):
+        db = self.open()
+        # Fail on the second row, after the first one was inserted
+        db.conn.execute("""CREATE TRIGGER fail_on_bobby
+                           AFTER INSERT ON users
+                           WHEN NEW.username = 'bobby'
+                           BEGIN
+                               INSERT INTO missing_table VALUES (1);
+                           END""")
+        db.conn.commit()
+
+        with self.assertRaises(exceptions.DatabaseError):
+            db.create_users([("alice", "Passw0rd!x", "Alice Smith"),
+                             ("bobby", "Passw0rd!x", "Bobby Jones")],
+                            max_workers=1)
+
+        self.assertFalse(db.conn.in_transaction)
+        self.assertEqual(self.usernames(db), [])
+
+
+class RehashTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = dbhelper.DBHelper(str(Path(self.tmp.name) /
+                                        "notebird.sqlite3"))
+        self.db.setup()
+        self.db.create_user("alice", "Passw0rd!x", "Alice Smith")
+        # Hash made before the rounds were raised
+        self.old_hash = pbkdf2_sha256.using(
+            rounds=security.MIN_ROUNDS - 1).hash("Passw0rd!x")
+        self.set_hash(self.old_hash)
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def set_hash(self, hashed: str):
+        self.db.conn.execute("UPDATE users SET password=? WHERE user_id=1",
+                             (hashed,))
+        self.db.conn.commit()
+
+    def stored_hash(self) -> str:
+        return self.db.conn.execute(
+            "SELECT password FROM users WHERE user_id=1").fetchone()[0]
+
+    def test_outdated_hash_is_updated_on_login(self):
+        self.assertEqual(self.db.login("alice", "Passw0rd!x"), 1)
+
+        new_hash = self.stored_hash()
+        self.assertNotEqual(new_hash, self.old_hash)
+        self.assertFalse(security.pwd_context.needs_update(new_hash))
+        self.assertFalse(self.db.conn.in_transaction)
+        self.assertEqual(self.db.login("alice", "Passw0rd!x"), 1)
+
+    def test_wrong_password_keeps_hash(self):
+        with self.assertRaises(exceptions.LoginError):
+            self.db.login("alice", "Wr0ngPass!")
+
+        self.assertEqual(self.stored_hash(), self.old_hash)
+
+    def test_current_hash_is_kept(self):
+        current = security.encrypt_password("Passw0rd!x")
+        self.set_hash(current)
+
+        self.assertEqual(self.db.login("alice", "Passw0rd!x"), 1)
+        self.assertEqual(self.stored_hash(), current)
+
+    def test_rehash_keeps_pending_work(self):
+        self.db.conn.execute("BEGIN")
+        self.db.conn.execute("UPDATE users SET name='Alice Jones'")
+
+        self.assertEqual(self.db.login("alice", "Passw0rd!x"), 1)
+
+        # Still within the transaction opened before the login
+        self.assertTrue(self.db.conn.in_transaction)
+        self.db.conn.rollback()
+        self.assertEqual(self.stored_hash(), self.old_hash)
+
+
+if __name__ == "__main__":
+    unittest.main()